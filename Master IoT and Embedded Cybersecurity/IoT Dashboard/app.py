@@ -6,11 +6,17 @@
 # ==============================
 # IMPORTS
 # ==============================
-from flask import Flask, render_template
+from flask import Flask, render_template, request, jsonify
 from flask_socketio import SocketIO
-import paho.mqtt.client as mqtt
 import threading
 import json
+import time
+import os
+import re
+
+from broadcast import Broadcaster
+from green_mqtt import GreenMQTT
+from wire import BinaryCodec
 
 # ==============================
 # FLASK APP SETUP
@@ -24,54 +30,119 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 # ==============================
 # MQTT CONFIGURATION
 # ==============================
-MQTT_BROKER = "broker.hivemq.com"
-MQTT_PORT = 1883
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "broker.hivemq.com")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+
+# "green": MQTT runs as green threads inside the eventlet hub (green_mqtt.py), so messages, relay
+# publishes and Socket.IO emits never cross a thread boundary.
+# "thread": paho's loop runs in a separate OS thread, as before.
+INGEST_MODE = os.environ.get("INGEST_MODE", "green")
+
+if INGEST_MODE == "thread":
+    import paho.mqtt.client as mqtt
 
 TOPIC_DATA = "pico/data"
+TOPIC_DEVICE_DATA = "pico/+/data"  # fleets publish per device
 TOPIC_CONTROL = "pico/control"
+DEFAULT_DEVICE = "pico"  # device id for the single-device "pico/data" topic
+# Same rule as the web app: ids go into MQTT topics, so no "/", "+" or "#"
+DEVICE_ID = re.compile(r"[A-Za-z0-9_.:-]{1,64}")
+
+
+def valid_device_id(device_id):
+    return isinstance(device_id, str) and DEVICE_ID.fullmatch(device_id) is not None
+
+
+def device_from_topic(topic):
+    # "pico/<device_id>/data" -> "<device_id>", "pico/data" -> DEFAULT_DEVICE
+    parts = topic.split('/')
+    return parts[1] if len(parts) >= 3 else DEFAULT_DEVICE
+
+
+def control_topic(device_id):
+    if not valid_device_id(device_id):
+        raise ValueError(f"invalid device id {device_id!r}")
+    return TOPIC_CONTROL if device_id == DEFAULT_DEVICE else f"pico/{device_id}/control"
 
 # ==============================
-# MQTT CALLBACKS
+# BROADCAST CONFIGURATION
 # ==============================
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("✅ Connected to MQTT Broker")
-        client.subscribe(TOPIC_DATA)
-        print(f"📡 Subscribed to {TOPIC_DATA}")
-    else:
-        print("❌ Failed to connect to MQTT Broker")
+# Readings are coalesced per device and sent as one frame per tick, at most 1 / BROADCAST_INTERVAL per second
+BROADCAST_INTERVAL = float(os.environ.get("BROADCAST_INTERVAL", 0.1))
+BROADCAST_ACK_TIMEOUT = float(os.environ.get("BROADCAST_ACK_TIMEOUT", 5))  # seconds before an unacknowledged frame is given up on
+# Groups browsers can subscribe to as a whole, e.g. '{"greenhouse": ["pico1", "pico2"]}'; "*" is every device
+DEVICE_GROUPS = json.loads(os.environ.get("DEVICE_GROUPS", "{}"))
+HISTORY_SIZE = int(os.environ.get("HISTORY_SIZE", 60))  # readings per device sent to browsers when they subscribe
+# "json" or "binary": update frames as compact records with per-layout schema ids (wire.py)
+WIRE_FORMAT = os.environ.get("WIRE_FORMAT", "json")
 
+broadcaster = Broadcaster(socketio, interval=BROADCAST_INTERVAL, ack_timeout=BROADCAST_ACK_TIMEOUT,
+                          groups=DEVICE_GROUPS, history_size=HISTORY_SIZE,
+                          codec=BinaryCodec() if WIRE_FORMAT == "binary" else None)
 
-def on_message(client, userdata, msg):
+# ==============================
+# MQTT CALLBACKS
+# ==============================
+def handle_message(topic, payload):
     try:
-        payload = msg.payload.decode()
-        data = json.loads(payload)
-
-        print("📥 Received:", data)
-
-        # Emit data to all connected browsers
-        socketio.emit("update_data", data)
+        device_id = device_from_topic(topic)
+        if not valid_device_id(device_id):
+            print(f"⚠ Ignored MQTT message on {topic}: invalid device id")
+            return
+        data = json.loads(payload.decode())
+        if not isinstance(data, dict):
+            print(f"⚠ Ignored MQTT message on {topic}: not a JSON object")
+            return
+
+        # Only the newest reading per device is kept; the broadcaster sends it on its next tick
+        broadcaster.update(device_id, data)
 
     except Exception as e:
         print("⚠ Error parsing MQTT message:", e)
 
 
+def on_status(connected, error):
+    if connected:
+        print("✅ Connected to MQTT Broker")
+        print(f"📡 Subscribed to {TOPIC_DATA} and {TOPIC_DEVICE_DATA}")
+    elif error:
+        print("❌ MQTT connection failed:", error)
+
+
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        client.subscribe([(TOPIC_DATA, 0), (TOPIC_DEVICE_DATA, 0)])
+    on_status(rc == 0, None if rc == 0 else f"return code {rc}")
+
+
+def on_message(client, userdata, msg):
+    handle_message(msg.topic, msg.payload)
+
+
 # ==============================
 # START MQTT CLIENT IN BACKGROUND
 # ==============================
 def start_mqtt():
-    mqtt_client.loop_forever()
-
+    while True:
+        try:
+            mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            mqtt_client.loop_forever()
+        except Exception as e:
+            on_status(False, e)
+            time.sleep(5)
 
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
 
-mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+if INGEST_MODE == "thread":
+    mqtt_client = mqtt.Client()
+    mqtt_client.on_connect = on_connect
+    mqtt_client.on_message = on_message
 
-mqtt_thread = threading.Thread(target=start_mqtt)
-mqtt_thread.daemon = True
-mqtt_thread.start()
+    mqtt_thread = threading.Thread(target=start_mqtt)
+    mqtt_thread.daemon = True
+    mqtt_thread.start()
+else:
+    mqtt_client = GreenMQTT(MQTT_BROKER, MQTT_PORT, [TOPIC_DATA, TOPIC_DEVICE_DATA], handle_message, on_status)
+    mqtt_client.start()
 
 # ==============================
 # FLASK ROUTE
@@ -81,20 +152,86 @@ def index():
     return render_template("index.html")
 
 
+@app.route('/stats')
+def broadcast_stats():
+    return jsonify(broadcaster.stats())
+
+
+# ==============================
+# SOCKET.IO CLIENTS
+# ==============================
+# A browser can subscribe while connecting, with auth {"devices": [...], "groups": [...]}, and then
+# gets the last known state of those devices in the same round trip as the handshake
+@socketio.on("connect")
+def handle_connect(auth=None):
+    broadcaster.add_client(request.sid)
+    broadcaster.start()
+    devices, groups = subscription(auth)
+    try:
+        broadcaster.subscribe(request.sid, devices, groups)
+    except ValueError as e:
+        print("⚠ Error subscribing:", e)
+        devices, groups = [], []
+    try:
+        socketio.emit("snapshot", broadcaster.snapshot(broadcaster.devices_in(devices, groups)), to=request.sid)
+    except Exception as e:
+        print("⚠ Error sending snapshot:", e)
+
+
+@socketio.on("disconnect")
+def handle_disconnect(*args):
+    broadcaster.remove_client(request.sid)
+
+
+def subscription(data):
+    data = data if isinstance(data, dict) else {}
+    return list(data.get("devices", [])), list(data.get("groups", []))
+
+
+# Browsers only receive the devices they subscribed to: {"devices": [...], "groups": [...]}.
+# The reply carries the snapshot of the newly subscribed devices.
+@socketio.on("subscribe")
+def handle_subscribe(data):
+    try:
+        devices, groups = subscription(data)
+        rooms = broadcaster.subscribe(request.sid, devices, groups)
+        return {"rooms": rooms, "snapshot": broadcaster.snapshot(broadcaster.devices_in(devices, groups))}
+    except Exception as e:
+        print("⚠ Error subscribing:", e)
+        return {"error": str(e)}
+
+
+@socketio.on("unsubscribe")
+def handle_unsubscribe(data):
+    try:
+        return {"rooms": broadcaster.unsubscribe(request.sid, *subscription(data))}
+    except Exception as e:
+        print("⚠ Error unsubscribing:", e)
+        return {"error": str(e)}
+
+
 # ==============================
 # HANDLE RELAY CONTROL FROM BROWSER
 # ==============================
+# Only devices that have reported data can be switched; the reply is {"sent": ...} or {"error": ...}
 @socketio.on("relay_control")
 def handle_relay_control(data):
     try:
         action = data.get("action")
+        device_id = data.get("device") or DEFAULT_DEVICE
+
+        if action not in ["ON", "OFF"]:
+            return {"error": f"unknown action {action!r}"}
+        if not valid_device_id(device_id) or not broadcaster.known(device_id):
+            return {"error": f"unknown device {device_id!r}"}
 
-        if action in ["ON", "OFF"]:
-            mqtt_client.publish(TOPIC_CONTROL, action)
-            print(f"📤 Sent relay command: {action}")
+        mqtt_client.publish(control_topic(device_id), action)
+        print(f"📤 Sent relay command to {device_id}: {action}")
+        return {"sent": action, "device": device_id}
 
     except Exception as e:
         print("⚠ Error sending relay command:", e)
+        return {"error": str(e)}
 
 
 # ==============================
@@ -102,4 +239,5 @@ def handle_relay_control(data):
 # ==============================
 if __name__ == "__main__":
     print("🚀 Starting Flask-SocketIO Server...")
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
+    socketio.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+                 debug=os.environ.get("DEBUG", "1") == "1")
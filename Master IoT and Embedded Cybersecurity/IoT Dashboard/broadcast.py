@@ -0,0 +1,256 @@
+"""
+Coalesced, rate-limited Socket.IO broadcast for the real-time dashboard.
+
+MQTT callbacks only record each device's newest reading; a background
+task flushes them at most once per `interval` as one "update_batch" frame
+({device id: reading}) per client, however many messages arrived.
+
+Clients only get the devices they subscribed to. Each subscription is a
+room: "device:<id>", "group:<name>" for a configured group of devices, or
+"group:*" for every device. A tick walks the rooms of the devices that
+changed, so its cost follows the number of interested clients, not the
+number connected.
+
+With a `codec` (wire.BinaryCodec), frames are binary: each reading is
+encoded once per tick and the records are concatenated per client.
+
+The newest reading and a short history of every device are also kept,
+so a browser gets the current state of what it subscribes to in one
+"snapshot" frame right away instead of waiting for the next messages.
+
+Backpressure is per client: a frame is acknowledged by the browser, and
+until then that client gets no new frame. Readings that change meanwhile
+overwrite the stale ones waiting for it, so a slow consumer skips
+intermediate values instead of queueing them, and never holds up the
+others. A frame not acknowledged within `ack_timeout` is given up on.
+"""
+
+import time
+import threading
+from collections import deque
+
+ALL_DEVICES = "*"
+
+
+class ClientState:
+    __slots__ = ("pending", "rooms", "in_flight", "sent_at", "frames", "replaced")
+
+    def __init__(self):
+        self.pending = {}      # {device id: newest reading not yet sent to this client}
+        self.rooms = set()
+        self.in_flight = False
+        self.sent_at = 0.0
+        self.frames = 0
+        self.replaced = 0      # readings overwritten before this client got them
+
+
+class Broadcaster:
+    def __init__(self, socketio, interval=0.1, ack_timeout=5.0, groups=None, history_size=60, codec=None,
+                 event="update_batch"):
+        """`groups` maps group names to lists of device ids; `history_size` readings are kept per device."""
+        self.socketio = socketio
+        self.codec = codec
+        self.interval = interval
+        self.ack_timeout = ack_timeout
+        self.history_size = history_size
+        self.event = event
+        self.groups = dict(groups or {})
+        self.device_groups = {}  # {device id: rooms of the groups it belongs to}
+        for name, devices in self.groups.items():
+            for device_id in devices:
+                self.device_groups.setdefault(device_id, []).append(f"group:{name}")
+
+        self.lock = threading.Lock()  # update() runs on the MQTT thread with INGEST_MODE=thread
+        self.dirty = {}               # {device id: newest reading since the last tick}
+        self.last = {}                # {device id: newest reading}
+        self.history = {}             # {device id: deque of (ts, reading)}
+        self.ids = []                 # every device seen so far; the position is its index in binary frames
+        self.index = {}               # {device id: position in ids}
+        self.announced = 0            # devices browsers were told about
+        # Only touched by the server's own tasks:
+        self.clients = {}             # {sid: ClientState}
+        self.rooms = {}               # {room: set of sids}
+        self.waiting = set()          # sids with pending readings
+        self.task = None
+
+        self.received = 0
+        self.coalesced = 0
+        self.ticks = 0
+        self.frames = 0
+        self.skipped = 0  # ticks a client was still busy with its previous frame
+
+    # ---- ingest side ----
+    def update(self, device_id, data, ts=None):
+        """Records a reading, a JSON object; anything else is rejected with ValueError."""
+        if not isinstance(data, dict):
+            raise ValueError(f"reading for {device_id} is not a JSON object")
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            self.received += 1
+            if device_id in self.dirty:
+                self.coalesced += 1
+            self.dirty[device_id] = self.last[device_id] = data
+            history = self.history.get(device_id)
+            if history is None:
+                history = self.history[device_id] = deque(maxlen=self.history_size)
+                self.index[device_id] = len(self.ids)
+                self.ids.append(device_id)
+            history.append((ts, data))
+
+    def known(self, device_id):
+        """Whether `device_id` has sent at least one reading."""
+        with self.lock:
+            return device_id in self.index
+
+    def snapshot(self, devices):
+        """
+        Known devices plus the newest reading and history of `devices`, the latter as columns
+        ({"t": [...], "temperature": [...], "humidity": [...]}) to keep the frame small.
+        """
+        with self.lock:
+            known = list(self.ids)
+            state = {d: self.last[d] for d in devices if isinstance(self.last.get(d), dict)}
+            history = {d: [(ts, reading) for ts, reading in self.history[d] if isinstance(reading, dict)]
+                       for d in state}
+        return {
+            "devices": known,
+            "schemas": self.codec.all_schemas() if self.codec else {},
+            "state": state,
+            "history": {d: {
+                "t": [round(ts, 1) for ts, _ in rows],
+                "temperature": [reading.get("temperature") for _, reading in rows],
+                "humidity": [reading.get("humidity") for _, reading in rows],
+            } for d, rows in history.items()},
+        }
+
+    # ---- client side ----
+    def add_client(self, sid):
+        self.clients[sid] = ClientState()
+
+    def remove_client(self, sid):
+        client = self.clients.pop(sid, None)
+        if client:
+            self.leave(sid, client, list(client.rooms))
+        self.waiting.discard(sid)
+
+    def subscribe(self, sid, devices=(), groups=()):
+        """Joins the rooms of `devices` and `groups` ("*" for all devices); returns the client's rooms."""
+        unknown = [g for g in groups if g != ALL_DEVICES and g not in self.groups]
+        if unknown:
+            raise ValueError(f"unknown device groups: {', '.join(unknown)}")
+        client = self.clients[sid]
+        for room in [f"device:{d}" for d in devices] + [f"group:{g}" for g in groups]:
+            self.rooms.setdefault(room, set()).add(sid)
+            client.rooms.add(room)
+        return sorted(client.rooms)
+
+    def devices_in(self, devices=(), groups=()):
+        """Device ids covered by a subscription."""
+        if ALL_DEVICES in groups:
+            with self.lock:
+                return sorted(self.last)
+        ids = set(devices)
+        for group in groups:
+            ids.update(self.groups.get(group, ()))
+        return sorted(ids)
+
+    def unsubscribe(self, sid, devices=(), groups=()):
+        client = self.clients[sid]
+        self.leave(sid, client, [f"device:{d}" for d in devices] + [f"group:{g}" for g in groups])
+        return sorted(client.rooms)
+
+    def leave(self, sid, client, rooms):
+        for room in rooms:
+            members = self.rooms.get(room)
+            if members is not None:
+                members.discard(sid)
+                if not members:
+                    del self.rooms[room]
+            client.rooms.discard(room)
+
+    def rooms_for(self, device_id):
+        return [f"device:{device_id}", *self.device_groups.get(device_id, ()), f"group:{ALL_DEVICES}"]
+
+    def start(self):
+        if self.task is None:
+            self.task = self.socketio.start_background_task(self.run)
+
+    def run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print("⚠ Broadcast error:", e)
+
+    def tick(self):
+        with self.lock:
+            batch, self.dirty = self.dirty, {}
+            ids = list(self.ids) if len(self.ids) != self.announced else None
+        self.ticks += 1
+        now = time.monotonic()
+
+        # Encoded once here, shared by every client's frame
+        if self.codec:
+            batch = {device_id: self.codec.encode(self.index[device_id], data) for device_id, data in batch.items()}
+            schemas = self.codec.take_new_schemas()
+            if schemas:
+                self.socketio.emit("schemas", schemas)
+        # Sent before any frame that refers to the new devices
+        if ids:
+            self.announced = len(ids)
+            self.socketio.emit("devices", ids)
+
+        for device_id, data in batch.items():
+            for room in self.rooms_for(device_id):
+                for sid in self.rooms.get(room, ()):
+                    client = self.clients[sid]
+                    previous = client.pending.get(device_id)
+                    if previous is data:
+                        continue  # reached this client through another room already
+                    if previous is not None:
+                        client.replaced += 1
+                    client.pending[device_id] = data
+                    self.waiting.add(sid)
+
+        for sid in list(self.waiting):
+            client = self.clients[sid]
+            if client.in_flight and now - client.sent_at > self.ack_timeout:
+                client.in_flight = False  # acknowledgement lost; send the newest state again
+            if client.in_flight:
+                self.skipped += 1
+                continue
+            self.waiting.discard(sid)
+            self.send(sid, client, now)
+
+    def send(self, sid, client, now):
+        # pending is swapped out: the frame is never mutated after it was handed to emit()
+        frame, client.pending = client.pending, {}
+        if self.codec:
+            frame = self.codec.frame(list(frame.values()))
+        client.in_flight = True
+        client.sent_at = now
+        client.frames += 1
+        self.frames += 1
+        number = client.frames
+        self.socketio.emit(self.event, frame, to=sid, callback=lambda *args: self.acked(client, number))
+
+    def acked(self, client, number):
+        # What piled up meanwhile goes out on the next tick, keeping each client at one frame per tick.
+        # A late ack for a frame given up on must not release the one sent after it.
+        if number == client.frames:
+            client.in_flight = False
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "devices": len(self.ids),
+            "rooms": len(self.rooms),
+            "subscriptions": sum(len(members) for members in self.rooms.values()),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "ticks": self.ticks,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "replaced": sum(client.replaced for client in self.clients.values()),
+        }
@@ -0,0 +1,136 @@
+"""
+Greenlet-native MQTT client for the dashboard (INGEST_MODE=green).
+
+Runs as green threads inside the eventlet hub, on a green socket, so
+messages are handled, relay commands published and Socket.IO frames
+emitted all on the hub's own thread: nothing crosses an OS thread
+boundary and nothing blocks the websocket event loop.
+
+Packets come from the shared codec in common/mqtt_codec.py; this module
+only does the socket work. The socket is read in large chunks, which is
+what makes it faster than paho on green sockets (paho makes several small
+reads per packet). Lost connections are retried with exponential backoff.
+"""
+
+import os
+import random
+
+import eventlet
+from eventlet.green import socket
+
+from mqtt_codec import (PUBLISH, PacketReader, connect_packet, subscribe_packet, publish_packet, puback_packet,
+                        parse_publish, connack_code, packet_type, ProtocolError, PINGREQ_PACKET, DISCONNECT_PACKET)
+
+RECONNECT_MIN = 1    # seconds
+RECONNECT_MAX = 60
+CONNECT_TIMEOUT = 10
+READ_SIZE = 1 << 16
+
+
+class GreenMQTT:
+    def __init__(self, host, port, topics, on_message, on_status=None, keepalive=60):
+        """`on_message(topic, payload bytes)`; `on_status(connected, error)` on connect, failure and disconnect."""
+        self.host = host
+        self.port = port
+        self.topics = list(topics)
+        self.on_message = on_message
+        self.on_status = on_status or (lambda connected, error: None)
+        self.keepalive = keepalive
+        self.client_id = f"iot-dashboard-{os.getpid()}-{random.randrange(1 << 32):08x}"
+        self.sock = None
+        self.thread = None
+        self.received = 0
+        self.reconnects = 0
+
+    def start(self):
+        self.thread = eventlet.spawn(self.maintain_connection)
+
+    def publish(self, topic, payload):
+        """QoS 0 publish; logs and drops the message while disconnected."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if self.sock is None:
+            print(f"⚠ MQTT not connected, dropped publish to {topic}")
+            return
+        try:
+            self.sock.sendall(publish_packet(topic, payload))
+        except OSError as e:
+            print(f"⚠ MQTT publish to {topic} failed:", e)
+
+    def maintain_connection(self):
+        failures = 0
+        while True:
+            connected = False
+            try:
+                connected = self.session()
+            except Exception as e:
+                self.on_status(False, e)
+            failures = 0 if connected else failures + 1
+            self.reconnects += 1
+            delay = min(RECONNECT_MAX, RECONNECT_MIN * 2 ** failures)
+            eventlet.sleep(delay * random.uniform(0.5, 1.0))
+
+    def session(self):
+        """One connection, until it drops. Returns whether the broker accepted it."""
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        packets = PacketReader()
+        pinger = None
+        try:
+            sock.sendall(connect_packet(self.client_id, self.keepalive))
+            received = []
+            while not received:
+                data = sock.recv(READ_SIZE)
+                if not data:
+                    raise ConnectionError("connection closed before CONNACK")
+                received = packets.feed(data)
+            rc = connack_code(*received[0])
+            if rc != 0:
+                raise ConnectionError(f"broker refused connection, return code {rc}")
+
+            sock.sendall(subscribe_packet(self.topics))
+            # Twice the keepalive without even a PINGRESP means the link is dead
+            sock.settimeout(self.keepalive * 2)
+            self.sock = sock
+            self.on_status(True, None)
+            pinger = eventlet.spawn(self.ping, sock)
+            try:
+                self.read_loop(sock, packets, received[1:])
+            except (OSError, ConnectionError, ProtocolError) as e:
+                print("⚠ MQTT connection lost:", e)
+            self.sock = None
+            self.on_status(False, None)
+            return True
+        finally:
+            if pinger:
+                pinger.kill()
+            self.sock = None
+            try:
+                sock.sendall(DISCONNECT_PACKET)
+            except OSError:
+                pass
+            sock.close()
+
+    def ping(self, sock):
+        while True:
+            eventlet.sleep(self.keepalive / 2)
+            sock.sendall(PINGREQ_PACKET)
+
+    def read_loop(self, sock, packets, received):
+        while True:
+            for first, body in received:
+                if packet_type(first) != PUBLISH:
+                    continue  # SUBACK, PINGRESP
+                topic, payload, qos, packet_id = parse_publish(first, body)
+                if qos:
+                    sock.sendall(puback_packet(packet_id))
+                self.received += 1
+                try:
+                    self.on_message(topic, payload)
+                except Exception as e:
+                    print("⚠ Error handling MQTT message:", e)
+            # Let websocket greenlets run between large bursts
+            eventlet.sleep(0)
+            data = sock.recv(READ_SIZE)
+            if not data:
+                raise ConnectionError("closed by the broker")
+            received = packets.feed(data)
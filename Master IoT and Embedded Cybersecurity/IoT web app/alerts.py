@@ -0,0 +1,141 @@
+"""
+Declarative alert rules for the IoT web app.
+
+Rules are loaded once (from a JSON file or the built-in defaults) and
+compiled into per-metric lists. Each rule has:
+
+  name        unique id, e.g. "high_temperature"
+  metric      "temperature", "humidity" or "age" (seconds since the last sample)
+  op          ">" or "<"
+  threshold   the rule is breached when `value op threshold`
+  hysteresis  once firing, it only resolves after the value comes back
+              past the threshold by this much (default 0)
+  duration    seconds the breach must last before the alert fires (default 0)
+  severity    "info", "warning" or "critical"
+  message     text shown on the dashboard
+
+The ingest path evaluates a whole batch at once, one pass per rule over
+each metric's column of samples, and only the resulting state changes
+are passed on. The cost follows the message rate, not the number of
+dashboards watching.
+"""
+
+import json
+import operator
+import threading
+
+from metrics import Counter
+
+SEVERITIES = ("info", "warning", "critical")
+OPS = {">": operator.gt, "<": operator.lt}
+
+ALERTS_FIRED = Counter("alerts_fired_total", "Alerts that started firing.", ["rule", "severity"])
+
+
+# ======================================
+# RULES
+# ======================================
+class Rule:
+    def __init__(self, name, metric, op, threshold, hysteresis=0, duration=0, severity="warning", message=None):
+        if op not in OPS:
+            raise ValueError(f"Alert rule {name}: op must be one of {sorted(OPS)}")
+        if severity not in SEVERITIES:
+            raise ValueError(f"Alert rule {name}: severity must be one of {SEVERITIES}")
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.threshold = float(threshold)
+        self.hysteresis = float(hysteresis)
+        self.duration = float(duration)
+        self.severity = severity
+        self.message = message or name
+        self.rank = SEVERITIES.index(severity)
+
+        # Compiled once: the breach test and the value at which a firing alert resolves
+        self.breached = lambda value, cmp=OPS[op], t=self.threshold: cmp(value, t)
+        clear_at = self.threshold - self.hysteresis if op == ">" else self.threshold + self.hysteresis
+        self.cleared = lambda value, cmp=OPS[op], t=clear_at: not cmp(value, t)
+
+
+def load_rules(path=None, defaults=()):
+    """Rules from a JSON list of rule objects at `path`, or `defaults` (a list of dicts) when no path is given."""
+    specs = defaults
+    if path:
+        with open(path) as f:
+            specs = json.load(f)
+    rules = [Rule(**spec) for spec in specs]
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError("Alert rule names must be unique")
+    return rules
+
+
+# ======================================
+# ENGINE
+# ======================================
+class AlertEngine:
+    def __init__(self, rules, on_change=None):
+        """`on_change(event)` is called, outside the lock, for every alert that fires or resolves."""
+        self.rules = rules
+        self.by_metric = {}
+        for rule in rules:
+            self.by_metric.setdefault(rule.metric, []).append(rule)
+        self.on_change = on_change or (lambda event: None)
+        self.lock = threading.Lock()
+        self.firing = {}     # {(rule name, device): event that fired it}
+        self.breaching = {}  # {(rule name, device): ts the breach started}, not yet past its duration
+        self.versions = {}   # {device: bumped on every change}
+
+    def evaluate(self, devices, times, columns):
+        """
+        Feeds one batch of samples, oldest first: `devices` and `times` hold one entry per
+        sample and `columns` maps metric names to equally long value lists. Returns the changes.
+        """
+        changes = []
+        with self.lock:
+            for metric, values in columns.items():
+                for rule in self.by_metric.get(metric, ()):
+                    breached = list(map(rule.breached, values))
+                    for device, ts, value, hit in zip(devices, times, values, breached):
+                        key = (rule.name, device)
+                        if key in self.firing:
+                            if not hit and rule.cleared(value):
+                                del self.firing[key]
+                                changes.append(self._event(rule, device, ts, value, "resolved"))
+                        elif hit:
+                            since = self.breaching.setdefault(key, ts)
+                            if ts - since >= rule.duration:
+                                del self.breaching[key]
+                                self.firing[key] = event = self._event(rule, device, ts, value, "firing")
+                                changes.append(event)
+                        else:
+                            self.breaching.pop(key, None)
+            for event in changes:
+                self.versions[event["device"]] = self.versions.get(event["device"], 0) + 1
+
+        for event in changes:
+            if event["state"] == "firing":
+                ALERTS_FIRED.inc(event["rule"], event["severity"])
+            self.on_change(event)
+        return changes
+
+    def _event(self, rule, device, ts, value, state):
+        return {"rule": rule.name, "device": device, "metric": rule.metric, "severity": rule.severity,
+                "message": rule.message, "value": value, "ts": ts, "state": state, "rank": rule.rank}
+
+    def active(self, device=None):
+        """Firing alerts, most severe first, for one device or all of them."""
+        with self.lock:
+            events = [e for (_, d), e in self.firing.items() if device is None or d == device]
+        return sorted(events, key=lambda e: (-e["rank"], e["device"], e["rule"]))
+
+    def version(self, device):
+        with self.lock:
+            return self.versions.get(device, 0)
+
+    def firing_counts(self):
+        counts = dict.fromkeys(SEVERITIES, 0)
+        with self.lock:
+            for event in self.firing.values():
+                counts[event["severity"]] += 1
+        return [((severity,), n) for severity, n in counts.items()]
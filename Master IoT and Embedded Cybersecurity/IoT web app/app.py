@@ -1,18 +1,40 @@
 import os
+import sys
+import signal
 import logging
 import time
 import json
+import hashlib
+import atexit
+import tempfile
 import threading
-from collections import deque
+from datetime import datetime, timezone
 
-from flask import Flask, redirect, url_for, render_template, request, session, send_from_directory
+from flask import Flask, Response, redirect, url_for, render_template, request, session, jsonify
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch, no_update
+from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
 import paho.mqtt.client as mqtt
 
+from store import open_store, ROLLUP_PERIODS
+from stats import WINDOWS
+from devices import DeviceRegistry, valid_device_id
+from ingest import IngestPipeline, count_by_subscription
+from async_ingest import AsyncIngest
+from capture import CaptureWriter, replay
+from commands import RelayCommands
+from alerts import AlertEngine, load_rules
+from responses import Compressor, StaticAssets, FastJSONProvider
+from shared_state import SharedStateWriter, SharedStateReader, SharedAlerts, CommandClient, serve_commands
+from snapshot import SnapshotCache
+from push import EventHub
+from throttle import LoginThrottle
+from downsample import lttb
+import export
+import metrics
+
 # ======================================
 # LOGGER
 # ======================================
@@ -23,30 +45,135 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(me
 # ======================================
 MQTT_BROKER = os.environ.get("MQTT_BROKER", "broker.hivemq.com")
 MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
-MQTT_SUBSCRIBE_TOPIC = os.environ.get("MQTT_SUBSCRIBE_TOPIC", "pico/data")
+# Legacy single-Pico topic plus one "pico/<device_id>/data" topic per device
+MQTT_SUBSCRIBE_TOPICS = os.environ.get("MQTT_SUBSCRIBE_TOPICS", "pico/data,pico/+/data").split(",")
 MQTT_CONTROL_TOPIC = os.environ.get("MQTT_CONTROL_TOPIC", "pico/control")
 
+# ======================================
+# STORAGE CONFIG
+# ======================================
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "sqlite")  # "sqlite" or "memory"
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "data/sensor_data.db")
+HISTORY_WINDOW = int(os.environ.get("HISTORY_WINDOW", 3600))  # seconds shown in the history charts
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", 500))  # points per chart; longer windows are downsampled
+DEFAULT_DEVICE = os.environ.get("DEFAULT_DEVICE", "pico")  # device id used for the legacy "pico/data" topic
+DEVICE_BUFFER_SIZE = int(os.environ.get("DEVICE_BUFFER_SIZE", 1024))  # recent samples kept in memory per device
+# Devices tracked at most; the broker is public, so messages from further new ids are rejected
+MAX_DEVICES = int(os.environ.get("MAX_DEVICES", 256))
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 5000))  # samples per chunk streamed by /export
+
+# ======================================
+# INGEST CONFIG
+# ======================================
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))  # messages waiting to be parsed before new ones are dropped
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+# "thread": paho network thread + ingest worker thread; "asyncio": one event loop does both (async_ingest.py)
+INGEST_ENGINE = os.environ.get("INGEST_ENGINE", "thread")
+# Raw MQTT traffic can be recorded to a file and replayed later without a broker (capture.py)
+MQTT_CAPTURE_FILE = os.environ.get("MQTT_CAPTURE_FILE")
+MQTT_REPLAY_FILE = os.environ.get("MQTT_REPLAY_FILE")
+MQTT_REPLAY_SPEED = float(os.environ.get("MQTT_REPLAY_SPEED", 1))  # 1 = recorded pace, 10 = ten times faster, 0 = unbounded
+
+# ======================================
+# RELAY COMMANDS
+# ======================================
+RELAY_COMMAND_TIMEOUT = float(os.environ.get("RELAY_COMMAND_TIMEOUT", 15))  # seconds before resending; above the Pico's publish interval
+RELAY_COMMAND_RETRIES = int(os.environ.get("RELAY_COMMAND_RETRIES", 3))
+RELAY_COALESCE_WINDOW = float(os.environ.get("RELAY_COALESCE_WINDOW", 0.5))  # minimum seconds between commands to one device
+
+# ======================================
+# DASHBOARD CONFIG
+# ======================================
+# "push": browsers update only when the server signals new data over server-sent events
+# "poll": browsers poll every POLL_INTERVAL ms
+# Each open tab holds one /api/events request, so push needs a server that is not limited to one
+# request per worker; SHARED_STATE=reader workers default to poll (see MULTI-PROCESS CONFIG)
+DASHBOARD_UPDATES = os.environ.get("DASHBOARD_UPDATES", "poll" if os.environ.get("SHARED_STATE") == "reader" else "push")
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", 2000))
+SENSOR_OFFLINE_AFTER = 10  # seconds without data before a device is shown as offline
+# The statistics windows slide with the clock, not only with new samples: their cards are
+# recomputed once per bucket of the narrowest window (5 s), even for an idle device. Push
+# dashboards are told by a "stats" event when a window holding data slides (stats_rollover)
+STATS_REFRESH = min(window / buckets for window, buckets in WINDOWS.values())
+
+def stats_bucket():
+    return int(time.time() // STATS_REFRESH)
+
+# ======================================
+# ALERT RULES
+# ======================================
+# A JSON list of rules replaces the defaults below; see alerts.py for the fields
+ALERT_RULES_FILE = os.environ.get("ALERT_RULES_FILE")
+DEFAULT_ALERT_RULES = [
+    {"name": "high_temperature", "metric": "temperature", "op": ">", "threshold": 40,
+     "severity": "critical", "message": "High Temperature!"},
+    {"name": "high_humidity", "metric": "humidity", "op": ">", "threshold": 70,
+     "severity": "warning", "message": "High Humidity!"},
+    {"name": "sensor_offline", "metric": "age", "op": ">", "threshold": SENSOR_OFFLINE_AFTER,
+     "severity": "critical", "message": "Sensor offline!"},
+]
+SEVERITY_COLORS = {"info": "info", "warning": "warning", "critical": "danger"}
+
+# ======================================
+# METRICS CONFIG
+# ======================================
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, /metrics requires "Authorization: Bearer <token>"
+
+# ======================================
+# MULTI-PROCESS CONFIG
+# ======================================
+# "": one process does everything (default)
+# "writer": the single ingest process; also mirrors live state into shared memory and
+#           accepts relay commands from the web workers
+# "reader": a web worker, e.g. `SHARED_STATE=reader gunicorn -w 4 -b 0.0.0.0:8050 app:server`
+#           (without --preload); no MQTT connection, live state is read from shared memory
+#           and history from the writer's SQLite store. Readers poll by default: gunicorn's
+#           sync workers serve one request at a time and a push tab keeps one open for good.
+#           For push, use threaded workers with a thread per expected tab, e.g.
+#           `DASHBOARD_UPDATES=push SHARED_STATE=reader gunicorn -w 4 -k gthread --threads 32 ...`
+SHARED_STATE = os.environ.get("SHARED_STATE", "")
+SHARED_STATE_NAME = os.environ.get("SHARED_STATE_NAME", "pico_dashboard")
+SHARED_STATE_SOCKET = os.environ.get("SHARED_STATE_SOCKET", os.path.join(tempfile.gettempdir(), "pico_dashboard.sock"))
+SHARED_STATE_MAX_DEVICES = int(os.environ.get("SHARED_STATE_MAX_DEVICES", MAX_DEVICES))
+SHARED_STATE_INTERVAL = 0.1  # seconds between syncs (writer) and change checks (readers)
+
 # ======================================
 # FLASK CONFIG
 # ======================================
-server = Flask(__name__)
+server = Flask(__name__, static_folder=None)  # static/ is served by StaticAssets below
 server.secret_key = os.environ.get("SECRET_KEY", "supersecretkey")
+server.json = FastJSONProvider(server)
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))  # bytes; smaller responses are sent as is
 USER_CREDENTIALS = {"admin": "password123"}
 
 # ======================================
 # LOGIN SECURITY CONFIG
 # ======================================
 MAX_LOGIN_ATTEMPTS = 5
+MAX_LOGIN_ATTEMPTS_PER_IP = int(os.environ.get("MAX_LOGIN_ATTEMPTS_PER_IP", 20))
 LOCKOUT_TIME = 300  # 5 minutes (in seconds)
+THROTTLE_MAX_ENTRIES = int(os.environ.get("THROTTLE_MAX_ENTRIES", 10000))  # usernames + IPs tracked at most
 
-failed_attempts = {}  # {username: {"count": int, "lock_time": timestamp}}
+# Failed attempts per ("user", username) and ("ip", address), bounded and expiring
+login_throttle = LoginThrottle(LOCKOUT_TIME, max_entries=THROTTLE_MAX_ENTRIES)
 
 
 
-# Serve static images (like logo)
-@server.route('/static/<path:path>')
-def serve_static(path):
-    return send_from_directory('static', path)
+# Compress JSON/HTML/JS responses (Dash callbacks and bundles included) for clients that accept it
+server.after_request(Compressor(min_size=COMPRESS_MIN_SIZE))
+
+# Serve static images (like logo), fingerprinted and precompressed once at startup
+static_assets = StaticAssets(os.path.join(server.root_path, 'static'), min_size=COMPRESS_MIN_SIZE)
+
+@server.url_defaults
+def fingerprint_static(endpoint, values):
+    # url_for('static', filename='logo.jpg') -> /static/logo.<hash>.jpg, cacheable for a year
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = static_assets.url_for(values['filename'])
+
+@server.route('/static/<path:filename>', endpoint='static')
+def serve_static(filename):
+    return static_assets.serve(filename)
 
 @server.route('/')
 def home():
@@ -63,37 +190,42 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        user_record = failed_attempts.get(username, {"count": 0, "lock_time": None})
+        user_key = ("user", username)
+        ip_key = ("ip", request.remote_addr)
 
-        # Check if user is locked
-        if user_record["lock_time"]:
-            elapsed = time.time() - user_record["lock_time"]
-            if elapsed < LOCKOUT_TIME:
-                remaining = int(LOCKOUT_TIME - elapsed)
-                error = f"Account locked. Try again in {remaining} seconds."
-                return render_template("login.html", error=error)
-            else:
-                # Reset after lock period
-                failed_attempts[username] = {"count": 0, "lock_time": None}
+        # Too many lockouts to track any more: refuse every login until the oldest expires
+        remaining = login_throttle.full_for()
+        if remaining:
+            error = f"Too many failed logins. Try again in {remaining} seconds."
+            return render_template("login.html", error=error)
+
+        # Check if this address or user is locked
+        remaining = login_throttle.locked_for(ip_key)
+        if remaining:
+            error = f"Too many attempts from your address. Try again in {remaining} seconds."
+            return render_template("login.html", error=error)
+
+        remaining = login_throttle.locked_for(user_key)
+        if remaining:
+            error = f"Account locked. Try again in {remaining} seconds."
+            return render_template("login.html", error=error)
 
         # Validate credentials
         if USER_CREDENTIALS.get(username) == password:
             session['username'] = username
-            failed_attempts[username] = {"count": 0, "lock_time": None}
+            login_throttle.reset(user_key)
             return redirect('/dashboard/')
         else:
             # Increment failed attempts
-            user_record["count"] += 1
+            login_throttle.record_failure(ip_key, MAX_LOGIN_ATTEMPTS_PER_IP)
+            count, locked = login_throttle.record_failure(user_key, MAX_LOGIN_ATTEMPTS)
 
-            if user_record["count"] >= MAX_LOGIN_ATTEMPTS:
-                user_record["lock_time"] = time.time()
+            if locked:
                 error = f"Too many failed attempts. Account locked for {LOCKOUT_TIME // 60} minutes."
             else:
-                remaining_attempts = MAX_LOGIN_ATTEMPTS - user_record["count"]
+                remaining_attempts = MAX_LOGIN_ATTEMPTS - count
                 error = f"Incorrect username or password. {remaining_attempts} attempts remaining."
 
-            failed_attempts[username] = user_record
-
     return render_template("login.html", error=error)
 
 @server.route('/logout')
@@ -103,60 +235,257 @@ def logout():
 
 @server.before_request
 def protect_dashboard():
-    if request.path.startswith('/dashboard') and not session.get('username'):
+    if request.path.startswith(('/dashboard', '/export')) and not session.get('username'):
         return redirect(url_for('login'))
 
+@server.route('/api/rollups/<device>')
+def rollups(device):
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    period = request.args.get('period', 'hour')
+    if period not in ROLLUP_PERIODS:
+        return jsonify({"error": f"period must be one of {sorted(ROLLUP_PERIODS)}"}), 400
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    return jsonify(sensor_store.query_rollups(device, period, start, end))
+
+@server.route('/api/stats/<device>')
+def device_stats(device):
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    state = device_registry.get(device)
+    if state is None:
+        return jsonify({"error": f"unknown device {device}"}), 404
+    return jsonify(state.stats_snapshot())
+
+@server.route('/api/alerts')
+def active_alerts():
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(alert_engine.active(request.args.get('device')))
+
+@server.route('/export/<device>.<any(csv, ndjson, parquet):fmt>')
+def export_history(device, fmt):
+    # Streams start < ts <= end (epoch seconds, both optional) chunk by chunk; login enforced by protect_dashboard
+    if not export.available(fmt):
+        return jsonify({"error": f"{fmt} export needs the pyarrow package"}), 501
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    chunks = sensor_store.iter_query(device, start, end, chunk_size=EXPORT_CHUNK_SIZE)
+    return Response(export.export(device, chunks, fmt), mimetype=export.MIMETYPES[fmt],
+                    headers={'Content-Disposition': export.content_disposition(device, fmt),
+                             'X-Accel-Buffering': 'no'})
+
+@server.route('/api/ingest')
+def ingest_stats():
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(ingest.stats())
+
+@server.route('/api/replay')
+def replay_status():
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    if not MQTT_REPLAY_FILE:
+        return jsonify({"error": "not replaying a capture"}), 404
+    return jsonify(replay_report or {"state": "running"})
+
+@server.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@server.route('/api/events')
+def events():
+    # Server-sent events telling the dashboard when to refresh; see PUSH UPDATES below
+    if not session.get('username'):
+        return jsonify({"error": "unauthorized"}), 401
+    if DASHBOARD_UPDATES != "push":
+        # Polling dashboards never open this; don't let a stale tab hold a worker
+        return jsonify({"error": "push updates are disabled"}), 404
+
+    def stream():
+        sub = dashboard_events.subscribe()
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                pending = sub.wait(timeout=15)
+                if not pending:
+                    yield ": keepalive\n\n"
+                for event, data in pending:
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            dashboard_events.unsubscribe(sub)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ======================================
 # GLOBAL DATA
 # ======================================
-MAX_LEN = 50
-temperature_history = deque(maxlen=MAX_LEN)
-humidity_history = deque(maxlen=MAX_LEN)
+if SHARED_STATE == "reader" and STORAGE_ENGINE != "sqlite":
+    raise ValueError("SHARED_STATE=reader needs STORAGE_ENGINE=sqlite to share the writer's history")
+
+sensor_store = open_store(STORAGE_ENGINE, STORAGE_PATH)  # Full history lives here
+atexit.register(sensor_store.close)  # Registered first so it runs last, after ingest has stopped
+
+if SHARED_STATE == "reader":
+    # Web worker: a read-only view of the ingest process's live state
+    shared_state = SharedStateReader(SHARED_STATE_NAME)
+    device_registry = shared_state
+else:
+    # Live state per device, each with its own lock and ring buffer of recent samples
+    device_registry = DeviceRegistry(DEVICE_BUFFER_SIZE, max_devices=MAX_DEVICES)
+    device_registry.get_or_create(DEFAULT_DEVICE)
+
+if SHARED_STATE == "writer":
+    shared_writer = SharedStateWriter(SHARED_STATE_NAME, SHARED_STATE_MAX_DEVICES, DEVICE_BUFFER_SIZE)
+    atexit.register(shared_writer.close)
 
-current_temp = 0
-current_humidity = 0
-relay_status = "OFF"
-last_mqtt_update = time.time()
 mqtt_connected = False
-data_lock = threading.Lock()  # Thread-safe updates
+
+# Notifies connected dashboards of new data, device list and status changes
+dashboard_events = EventHub()
+
+# ======================================
+# ALERTS
+# ======================================
+def alert_changed(event):
+    if event["state"] == "firing":
+        logging.warning(f"Alert {event['rule']} on {event['device']}: {event['message']} ({event['value']:.1f})")
+    else:
+        logging.info(f"Alert {event['rule']} resolved on {event['device']}")
+    dashboard_events.publish("alert", event, key=f"{event['device']}/{event['rule']}")
+    dashboard_events.publish("data", {"device": event["device"]}, key=event["device"])
+
+if SHARED_STATE == "reader":
+    alert_engine = SharedAlerts(shared_state)
+else:
+    # Evaluated on ingest and by the offline watchdog, never per dashboard request
+    alert_engine = AlertEngine(load_rules(ALERT_RULES_FILE, DEFAULT_ALERT_RULES), on_change=alert_changed)
+
+# ======================================
+# METRICS
+# ======================================
+MQTT_CONNECTS = metrics.Counter("mqtt_connects_total", "MQTT connection attempts by result.", ["result"])
+MQTT_DISCONNECTS = metrics.Counter("mqtt_disconnects_total", "MQTT disconnections.")
+DEVICES_REFUSED = metrics.Counter("mqtt_messages_device_limit_total",
+                                  "MQTT messages from new devices rejected because MAX_DEVICES was reached.")
+ON_MESSAGE_SECONDS = metrics.Histogram("mqtt_on_message_seconds", "Time spent in on_message on the paho network thread.",
+                                       buckets=(0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.01))
+CALLBACK_SECONDS = metrics.Histogram("dash_callback_seconds", "Dash callback latency.", ["callback"])
+
+def sample_ages():
+    now = time.time()
+    for device_id in device_registry.ids():
+        yield (device_id,), round(now - device_registry.get(device_id).latest()[3], 3)
+
+def ingest_gauges():
+    stats = ingest.stats()
+    yield ("queue_depth",), stats["queue_depth"]
+    yield ("queue_capacity",), stats["queue_capacity"]
+
+metrics.Gauge("sensor_last_sample_age_seconds", "Seconds since the last sample from each device.", ["device"], sample_ages)
+metrics.Gauge("ingest_queue", "Ingest queue depth and capacity.", ["stat"], ingest_gauges)
+metrics.Gauge("mqtt_connected", "1 while connected to the MQTT broker.", [], lambda: [((), int(mqtt_connected))])
+metrics.Gauge("alerts_firing", "Alerts currently firing.", ["severity"], alert_engine.firing_counts)
+metrics.Gauge("dashboard_event_subscribers", "Open server-sent event streams.", [],
+              lambda: [((), dashboard_events.subscriber_count())])
 
 # ======================================
 # MQTT HANDLERS
 # ======================================
-def on_connect(client, userdata, flags, rc):
+def mqtt_status(connected, rc):
+    # Shared by both ingest engines: rc is 0 on connect, the CONNACK code when refused,
+    # the exception when the connection attempt failed, and None on disconnect
     global mqtt_connected
-    if rc == 0:
+    if connected:
         logging.info("Connected to MQTT Broker")
-        client.subscribe(MQTT_SUBSCRIBE_TOPIC)
-        mqtt_connected = True
-    else:
+        MQTT_CONNECTS.inc("success")
+    elif isinstance(rc, Exception):
+        logging.error(f"MQTT connection failed: {rc}")
+        MQTT_CONNECTS.inc("error")
+    elif rc is not None:
         logging.error(f"Failed to connect to MQTT Broker, return code {rc}")
-        mqtt_connected = False
+        MQTT_CONNECTS.inc("failure")
+    else:
+        logging.warning("MQTT Broker disconnected!")
+        MQTT_DISCONNECTS.inc()
+    mqtt_connected = connected
+    dashboard_events.publish("status", {"mqtt_connected": mqtt_connected})
+
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        client.subscribe([(topic, 0) for topic in MQTT_SUBSCRIBE_TOPICS])
+    mqtt_status(rc == 0, rc)
 
 def on_disconnect(client, userdata, rc):
-    global mqtt_connected
-    mqtt_connected = False
-    logging.warning("MQTT Broker disconnected!")
+    mqtt_status(False, None)
+
+def device_from_topic(topic):
+    # "pico/<device_id>/data" -> "<device_id>", legacy "pico/data" -> DEFAULT_DEVICE
+    parts = topic.split('/')
+    return parts[1] if len(parts) >= 3 else DEFAULT_DEVICE
+
+def control_topic(device_id):
+    # Ids come from browsers and web workers too: never build a topic from one that is not a plain id
+    if not valid_device_id(device_id):
+        raise ValueError(f"invalid device id {device_id!r}")
+    if device_id == DEFAULT_DEVICE:
+        return MQTT_CONTROL_TOPIC
+    return f"pico/{device_id}/control"
+
+def commit_batch(batch):
+    # Runs on the ingest worker: group the batch per device so each device lock is taken once.
+    # Returns the topics of rejected rows, which the ingest engine counts as failed
+    per_device = {}
+    rows = []
+    rejected = []
+    new_devices = False
+    for topic, payload, ts in batch:
+        try:
+            sample = (ts, float(payload.get("temperature", 0)), float(payload.get("humidity", 0)),
+                      str(payload.get("relay", "OFF")))
+        except (AttributeError, TypeError, ValueError) as e:
+            rejected.append(topic)
+            logging.error(f"MQTT message error on {topic}: {e}")
+            continue
+        device_id = device_from_topic(topic)
+        if not valid_device_id(device_id):
+            rejected.append(topic)
+            logging.error(f"MQTT message error on {topic}: invalid device id")
+            continue
+        if device_id not in per_device and device_registry.get(device_id) is None:
+            if device_registry.get_or_create(device_id) is None:
+                rejected.append(topic)
+                DEVICES_REFUSED.inc()
+                continue
+            new_devices = True
+        per_device.setdefault(device_id, []).append(sample)
+        rows.append((device_id, *sample))
+
+    for device_id, samples in per_device.items():
+        device = device_registry.get(device_id)
+        device.record_many(samples)
+        relay_commands.observe(device_id, samples[-1][3], samples[-1][0])
+    sensor_store.append_many(rows)
+    alert_engine.evaluate([r[0] for r in rows], [r[1] for r in rows],
+                          {"temperature": [r[2] for r in rows], "humidity": [r[3] for r in rows]})
+
+    for device_id in per_device:
+        dashboard_events.publish("data", {"device": device_id}, key=device_id)
+    if new_devices:
+        dashboard_events.publish("devices", {})
+    return rejected
 
+@ON_MESSAGE_SECONDS.time()
 def on_message(client, userdata, msg):
-    global current_temp, current_humidity, relay_status, last_mqtt_update
-    try:
-        payload = json.loads(msg.payload.decode('utf-8'))
-        with data_lock:
-            current_temp = payload.get("temperature", 0)
-            current_humidity = payload.get("humidity", 0)
-            relay_status = payload.get("relay", "OFF")
-            temperature_history.append(current_temp)
-            humidity_history.append(current_humidity)
-            last_mqtt_update = time.time()
-    except Exception as e:
-        logging.error(f"MQTT message error: {e}")
-
-# Persistent MQTT client
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_disconnect = on_disconnect
-mqtt_client.on_message = on_message
+    # Runs on paho's network thread: hand the raw bytes off and return immediately
+    ts = time.time()
+    if capture:
+        capture.record(msg.topic, msg.payload, ts)
+    ingest.submit(msg.topic, msg.payload, ts)
 
 def mqtt_loop():
     while True:
@@ -164,10 +493,222 @@ def mqtt_loop():
             mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
             mqtt_client.loop_forever()
         except Exception as e:
-            logging.error(f"MQTT connection failed: {e}")
+            mqtt_status(False, e)
             time.sleep(5)
 
-threading.Thread(target=mqtt_loop, daemon=True).start()
+def send_relay_command(device_id, state, qos):
+    mqtt_client.publish(control_topic(device_id), state, qos=qos)
+
+capture = None
+if MQTT_CAPTURE_FILE and SHARED_STATE != "reader":
+    capture = CaptureWriter(MQTT_CAPTURE_FILE)
+    atexit.register(capture.close)
+    logging.info(f"Capturing MQTT traffic to {MQTT_CAPTURE_FILE}")
+
+if SHARED_STATE == "reader":
+    # No MQTT connection here: relay commands are forwarded to the ingest process
+    ingest = shared_state
+    relay_commands = CommandClient(shared_state, SHARED_STATE_SOCKET)
+else:
+    # Relay commands are confirmed by the relay field of the device's next data message
+    relay_commands = RelayCommands(send_relay_command, timeout=RELAY_COMMAND_TIMEOUT,
+                                   retries=RELAY_COMMAND_RETRIES, coalesce_window=RELAY_COALESCE_WINDOW)
+
+    count_by_subscription(MQTT_SUBSCRIBE_TOPICS)  # ingest metrics labels
+
+    if INGEST_ENGINE == "asyncio":
+        # One event loop owns the connection, parsing, storage and push; also serves relay publishes
+        # A replay runs offline: no host, messages only come from the capture
+        ingest = mqtt_client = AsyncIngest(None if MQTT_REPLAY_FILE else MQTT_BROKER, MQTT_PORT,
+                                           MQTT_SUBSCRIBE_TOPICS, commit_batch, on_status=mqtt_status,
+                                           maxsize=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                                           tap=capture.record if capture else None)
+        mqtt_client.start()
+        atexit.register(mqtt_client.stop)
+    else:
+        ingest = IngestPipeline(commit_batch, maxsize=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE)
+
+        # Persistent MQTT client
+        mqtt_client = mqtt.Client()
+        mqtt_client.on_connect = on_connect
+        mqtt_client.on_disconnect = on_disconnect
+        mqtt_client.on_message = on_message
+        if not MQTT_REPLAY_FILE:
+            threading.Thread(target=mqtt_loop, daemon=True).start()
+
+# ======================================
+# CAPTURE REPLAY
+# ======================================
+replay_report = None
+replay_done = threading.Event()
+
+def replay_state(start):
+    # Dashboard state after a replay, with times relative to its start so runs can be compared.
+    # Devices without captured samples (the default one) are left out: their times are the wall clock's.
+    devices = {}
+    for device_id in device_registry.ids():
+        device = device_registry.get(device_id)
+        samples = device.samples_since(None)
+        if not samples:
+            continue
+        temperature, humidity, relay, last_update, _ = device.latest()
+        devices[device_id] = {
+            "temperature": temperature, "humidity": humidity, "relay": relay,
+            "last_sample_offset": round(last_update - start, 3),
+            "buffered_samples": len(samples),
+            # Windowed stats are left out: their bucket edges depend on the wall clock
+            "stats": {name: {"all": s["all"], "ewma": s["ewma"]} for name, s in device.stats_snapshot().items()},
+        }
+    alerts = sorted((e["device"], e["rule"], e["severity"]) for e in alert_engine.active())
+    digest = hashlib.sha256(json.dumps([devices, alerts], sort_keys=True).encode()).hexdigest()[:16]
+    return {"devices": devices, "alerts_firing": alerts, "state_digest": digest}
+
+def run_replay():
+    # Feeds the capture through ingest.submit, the call on_message makes, then waits for the engine to commit it all.
+    # Unlike live MQTT it waits for queue room instead of dropping, so both engines ingest the same messages.
+    global replay_report
+    logging.info(f"Replaying {MQTT_REPLAY_FILE} at {MQTT_REPLAY_SPEED or 'unbounded'}x into the {INGEST_ENGINE} engine")
+    start = time.time()
+    report = replay(MQTT_REPLAY_FILE, lambda topic, payload, ts: ingest.submit(topic, payload, ts, block=True),
+                    MQTT_REPLAY_SPEED)
+    while True:
+        stats = ingest.stats()
+        if stats["parsed"] + stats["failed"] + stats["dropped"] >= report["messages"]:
+            break
+        time.sleep(0.005)
+    processed = time.time() - start
+    handled = stats["parsed"] + stats["failed"]  # dropped messages were never processed
+    report.update({
+        "engine": INGEST_ENGINE,
+        "processed_seconds": round(processed, 3),
+        "processed_messages": handled,
+        "processed_per_second": round(handled / processed, 1) if processed else None,
+        "dropped": stats["dropped"],
+        "ingest": stats,
+        **replay_state(start),
+    })
+    replay_report = report
+    replay_done.set()
+    logging.info(f"Replay done: {report['messages']} messages in {processed:.2f}s "
+                 f"({report['processed_per_second']} msg/s), {stats['dropped']} dropped, "
+                 f"state {report['state_digest']}")
+
+if MQTT_REPLAY_FILE and SHARED_STATE != "reader":
+    threading.Thread(target=run_replay, daemon=True).start()
+
+# ======================================
+# PUSH UPDATES
+# ======================================
+# Devices go offline without sending anything, so a watchdog feeds every device's
+# sample age to the "age" alert rules; alert_changed announces the transitions
+def offline_watchdog():
+    while True:
+        time.sleep(1)
+        now = time.time()
+        ids = device_registry.ids()
+        ages = [now - device_registry.get(device_id).latest()[3] for device_id in ids]
+        alert_engine.evaluate(ids, [now] * len(ids), {"age": ages})
+
+# Sends coalesced relay commands and retries unconfirmed ones
+def relay_command_watchdog():
+    while True:
+        time.sleep(0.25)
+        for device_id in relay_commands.tick():
+            dashboard_events.publish("data", {"device": device_id}, key=device_id)
+
+# Windowed stats change as their buckets roll over, without new data. At each rollover, devices
+# with samples still inside a window that slid get a "stats" event, so push pages send no
+# requests of their own while idle
+def stats_rollover():
+    previous = time.time()
+    while True:
+        time.sleep(STATS_REFRESH - time.time() % STATS_REFRESH)
+        now = time.time()
+        # How far back data reaches into the windows that just slid
+        horizon = max((window + window / buckets for window, buckets in WINDOWS.values()
+                       if int(now // (window / buckets)) != int(previous // (window / buckets))), default=None)
+        previous = now
+        if horizon is None:
+            continue
+        for device_id in device_registry.ids():
+            if now - device_registry.get(device_id).latest()[3] <= horizon:
+                dashboard_events.publish("stats", {"device": device_id}, key=device_id)
+
+if SHARED_STATE != "reader":
+    threading.Thread(target=offline_watchdog, daemon=True).start()
+    threading.Thread(target=relay_command_watchdog, daemon=True).start()
+if DASHBOARD_UPDATES == "push":
+    threading.Thread(target=stats_rollover, daemon=True).start()
+
+# ======================================
+# SHARED STATE (multi-process mode)
+# ======================================
+def shared_state_sync():
+    # Writer: mirrors every device that changed since the last pass into shared memory
+    synced = {}  # {device_id: (newest mirrored ts, data version, alert version, command, stats bucket)}
+    while True:
+        time.sleep(SHARED_STATE_INTERVAL)
+        for device_id in device_registry.ids():
+            device = device_registry.get(device_id)
+            latest = device.latest()
+            alert_version = alert_engine.version(device_id)
+            command = relay_commands.status(device_id)
+            bucket = stats_bucket()  # windowed stats change with time alone
+            last_ts, *previous = synced.get(device_id, (None, None, None, None, None))
+            if previous == [latest[4], alert_version, command, bucket]:
+                continue
+
+            samples = device.samples_since(last_ts)
+            reset = samples is None  # more than a ring's worth arrived since the last pass
+            if reset:
+                samples = device.samples_since(None)
+            info = {"stats": device.stats_snapshot(), "alerts": alert_engine.active(device_id),
+                    "alert_version": alert_version, "command": command}
+            try:
+                shared_writer.write_device(device_id, latest, samples, info, reset=reset)
+            except ValueError as e:
+                logging.error(f"Shared state not updated for {device_id}: {e}")
+            synced[device_id] = (samples[-1][0] if samples else last_ts, latest[4], alert_version, command, bucket)
+
+        shared_writer.write_header({
+            "mqtt_connected": mqtt_connected,
+            "ingest": ingest.stats(),
+            "alerts_firing": {severity: n for (severity,), n in alert_engine.firing_counts()},
+        })
+
+def shared_state_watcher():
+    # Reader: turns changes in shared memory into this worker's dashboard events
+    global mqtt_connected
+    revisions = {}
+    while True:
+        time.sleep(SHARED_STATE_INTERVAL)
+        if shared_state.refresh():
+            logging.info("Attached to the ingest process's shared state")
+            revisions = {}
+        ids = shared_state.ids()
+        if len(ids) != len(revisions):
+            dashboard_events.publish("devices", {})
+        for device_id in ids:
+            revision = shared_state.get(device_id).latest()[4]
+            if revisions.get(device_id) != revision:
+                revisions[device_id] = revision
+                dashboard_events.publish("data", {"device": device_id}, key=device_id)
+        connected = bool(shared_state.header()[1].get("mqtt_connected"))
+        if connected != mqtt_connected:
+            mqtt_connected = connected
+            dashboard_events.publish("status", {"mqtt_connected": mqtt_connected})
+
+def worker_relay_request(device_id, state):
+    # Same checks as the relay buttons: web workers only forward what a browser sent them
+    if state not in ("ON", "OFF") or not valid_device_id(device_id) or device_registry.get(device_id) is None:
+        raise ValueError(f"rejected relay command {state!r} for device {device_id!r}")
+    relay_commands.request(device_id, state)
+
+if SHARED_STATE == "writer":
+    threading.Thread(target=shared_state_sync, daemon=True).start()
+    threading.Thread(target=serve_commands, args=(SHARED_STATE_SOCKET, worker_relay_request), daemon=True).start()
+elif SHARED_STATE == "reader":
+    threading.Thread(target=shared_state_watcher, daemon=True).start()
 
 # ======================================
 # DASH SETUP
@@ -182,8 +723,11 @@ app = dash.Dash(
 # ======================================
 # GAUGE GENERATOR
 # ======================================
+def gauge_bar_color(value):
+    return "#FF4136" if value > 40 else "#2ECC40"
+
 def generate_gauge(value, title, unit, max_val):
-    color = "#FF4136" if value > 40 else "#2ECC40"
+    color = gauge_bar_color(value)
     fig = go.Figure(go.Indicator(
         mode="gauge+number+delta",
         value=value,
@@ -198,24 +742,39 @@ def generate_gauge(value, title, unit, max_val):
     fig.update_layout(title={'text': title, 'x': 0.5})
     return fig
 
+# ======================================
+# HISTORY CHART GENERATOR
+# ======================================
+# Charts are built once in the layout; the update callback only appends new points via extendData
+def generate_history_chart(title, name, color):
+    fig = go.Figure(go.Scatter(x=[], y=[], mode="lines+markers", line={'color': color}, name=name))
+    fig.update_layout(title=title, template="plotly_dark", xaxis={'type': 'date'})
+    return fig
+
 # ======================================
 # DASH LAYOUT
 # ======================================
 app.layout = dbc.Container([
     # Header with logo
     dbc.Row([
-        dbc.Col(html.Img(src='/static/maaun_logo.jpg', height='60px'), width=2),
+        dbc.Col(html.Img(src=f"/static/{static_assets.url_for('maaun_logo.jpg')}", height='60px'), width=2),
         dbc.Col(html.H3("       IoT Monitoring Dashboard", className="fw-bold text-info"), width=8),
         dbc.Col(html.A(dbc.Button("Logout", color="danger"), href="/logout"), width=2, className="text-end")
     ], className="my-3 align-items-center"),
 
+    # Device selector
+    dbc.Row([
+        dbc.Col(html.H6("Device:", className="fw-bold"), width="auto"),
+        dbc.Col(dcc.Dropdown(id="device-select", options=[DEFAULT_DEVICE], value=DEFAULT_DEVICE, clearable=False), md=3)
+    ], className="mb-3 align-items-center"),
+
     # Gauges and relay control
     dbc.Row([
         # Temperature
         dbc.Col(dbc.Card([
             dbc.CardHeader("Temperature"),
             dbc.CardBody([
-                dcc.Graph(id='temp-gauge', config={'displayModeBar': False}),
+                dcc.Graph(id='temp-gauge', figure=generate_gauge(0, "Temperature", "°C", 50), config={'displayModeBar': False}),
                 dbc.Badge(id="temp-alert", className="mt-2", color="secondary"),
                 html.Div(id="temp-last-update", className="mt-1 text-muted")
             ])
@@ -225,7 +784,7 @@ app.layout = dbc.Container([
         dbc.Col(dbc.Card([
             dbc.CardHeader("Humidity"),
             dbc.CardBody([
-                dcc.Graph(id='humidity-gauge', config={'displayModeBar': False}),
+                dcc.Graph(id='humidity-gauge', figure=generate_gauge(0, "Humidity", "%", 100), config={'displayModeBar': False}),
                 dbc.Badge(id="humidity-alert", className="mt-2", color="secondary"),
                 html.Div(id="humidity-last-update", className="mt-1 text-muted")
             ])
@@ -239,7 +798,8 @@ app.layout = dbc.Container([
                 dbc.Row([
                     dbc.Col(html.H6("Relay Status:", className="fw-bold"), width=5),
                     dbc.Col(dbc.Badge(id="relay-badge", color="secondary", className="text-white"), width=7)
-                ], className="mb-3 align-items-center"),
+                ], className="mb-1 align-items-center"),
+                html.Div(html.Small(id="relay-ack", className="text-muted"), className="mb-3"),
 
                 # ON/OFF Buttons
                 dbc.Row([
@@ -258,53 +818,261 @@ app.layout = dbc.Container([
 
     # Historical charts
     dbc.Row([
-        dbc.Col(dbc.Card([dbc.CardHeader("Temperature History"), dbc.CardBody([dcc.Graph(id="temp-chart")])], className="shadow-lg"), md=6),
-        dbc.Col(dbc.Card([dbc.CardHeader("Humidity History"), dbc.CardBody([dcc.Graph(id="humidity-chart")])], className="shadow-lg"), md=6)
+        dbc.Col(dbc.Card([dbc.CardHeader("Temperature History"), dbc.CardBody([dcc.Graph(id="temp-chart", figure=generate_history_chart("Temperature History", "Temperature", '#FF851B'))])], className="shadow-lg"), md=6),
+        dbc.Col(dbc.Card([dbc.CardHeader("Humidity History"), dbc.CardBody([dcc.Graph(id="humidity-chart", figure=generate_history_chart("Humidity History", "Humidity", '#0074D9'))])], className="shadow-lg"), md=6)
+    ], className="mb-4"),
+
+    # Streaming statistics
+    dbc.Row([
+        dbc.Col(dbc.Card([dbc.CardHeader("Temperature Statistics"), dbc.CardBody(id="temp-stats")], className="shadow-lg"), md=6),
+        dbc.Col(dbc.Card([dbc.CardHeader("Humidity Statistics"), dbc.CardBody(id="humidity-stats")], className="shadow-lg"), md=6)
     ], className="mb-4"),
 
-    # Interval for updates
-    dcc.Interval(id="interval", interval=2000, n_intervals=0)
+    # Interval for updates (only used when DASHBOARD_UPDATES is "poll")
+    dcc.Interval(id="interval", interval=POLL_INTERVAL, n_intervals=0, disabled=DASHBOARD_UPDATES != "poll"),
+
+    # Poll mode only, when polls are further apart than the stats buckets; push pages get "stats" events
+    dcc.Interval(id="stats-interval", interval=int(STATS_REFRESH * 1000), n_intervals=0,
+                 disabled=DASHBOARD_UPDATES != "poll" or POLL_INTERVAL <= STATS_REFRESH * 1000),
+
+    # Bumped by the server-sent events listener below
+    dcc.Store(id="push-signal"),
+    dcc.Store(id="devices-signal"),
+    dcc.Store(id="push-listener"),
+
+    # What this browser has already rendered, so each tick only sends what changed
+    dcc.Store(id="render-state")
 ], fluid=True)
 
 # ======================================
 # RELAY BUTTON CALLBACK
 # ======================================
+def relay_ack_text(cmd):
+    if cmd is None:
+        return ""
+    label = f"Command #{cmd['id']} ({cmd['state']})"
+    if cmd['status'] == "confirmed":
+        return f"{label} confirmed in {cmd['latency']:.1f} s"
+    if cmd['status'] == "failed":
+        return f"{label} not confirmed after {cmd['attempts']} attempts"
+    if cmd['status'] == "queued":
+        return f"{label} queued"
+    return f"{label} waiting for device (attempt {cmd['attempts']})"
+
 @app.callback(
     Output('relay-badge', 'children'),
     Output('relay-badge', 'color'),
+    Output('relay-ack', 'children'),
     Input('relay-on', 'n_clicks'),
-    Input('relay-off', 'n_clicks')
+    Input('relay-off', 'n_clicks'),
+    Input('device-select', 'value'),
+    Input('push-signal', 'data'),
+    Input('interval', 'n_intervals')
 )
-def relay_control(on_clicks, off_clicks):
-    global relay_status
+@CALLBACK_SECONDS.time("relay_control")
+def relay_control(on_clicks, off_clicks, device_id, signal, n):
+    # Only devices that have reported in can be controlled; the id comes from the browser
+    device = device_registry.get(device_id) if valid_device_id(device_id) else None
+    if device is None:
+        return "Unknown device", "secondary", ""
     ctx = dash.callback_context
-    if not ctx.triggered:
-        color = "success" if relay_status == "ON" else "danger"
-        return relay_status, color
-
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    if button_id == "relay-on":
-        relay_status = "ON"
-    elif button_id == "relay-off":
-        relay_status = "OFF"
-
-    try:
-        mqtt_client.publish(MQTT_CONTROL_TOPIC, relay_status)
-        logging.info(f"Relay state published: {relay_status}")
-    except Exception as e:
-        logging.error(f"Failed to publish relay: {e}")
+    button_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
+    if button_id in ("relay-on", "relay-off"):
+        relay_commands.request(device_id, "ON" if button_id == "relay-on" else "OFF")
 
+    # The badge shows what the device reports; a command in flight is shown next to it
+    relay_status = device.latest()[2]
     color = "success" if relay_status == "ON" else "danger"
-    return relay_status, color
+    cmd = relay_commands.status(device_id)
+    if cmd and cmd['status'] in ("queued", "pending") and cmd['state'] != relay_status:
+        relay_status, color = f"{relay_status} → {cmd['state']}", "warning"
+    return relay_status, color, relay_ack_text(cmd)
+
+# ======================================
+# SERVER-SENT EVENTS LISTENER
+# ======================================
+# Opens one EventSource per page and turns server events into Dash inputs, so an idle
+# dashboard sends no requests at all. Reconnects are handled by the browser; after one,
+# both signals fire to catch up on anything missed.
+if DASHBOARD_UPDATES == "push":
+    app.clientside_callback(
+        """
+        function(deviceId) {
+            var push = window.dashboardPush = window.dashboardPush || {count: 0};
+            push.device = deviceId;
+            if (!push.source) {
+                var signal = function(id) {
+                    push.count += 1;
+                    window.dash_clientside.set_props(id, {data: push.count});
+                };
+                push.source = new EventSource('/api/events');
+                push.source.addEventListener('data', function(e) {
+                    if (JSON.parse(e.data).device === push.device) { signal('push-signal'); }
+                });
+                push.source.addEventListener('stats', function(e) {
+                    if (JSON.parse(e.data).device === push.device) { signal('push-signal'); }
+                });
+                push.source.addEventListener('status', function() { signal('push-signal'); });
+                push.source.addEventListener('devices', function() { signal('devices-signal'); });
+                push.source.onopen = function() { signal('push-signal'); signal('devices-signal'); };
+            }
+            return window.dash_clientside.no_update;
+        }
+        """,
+        Output('push-listener', 'data'),
+        Input('device-select', 'value')
+    )
+
+# ======================================
+# DEVICE SELECTOR CALLBACK
+# ======================================
+@app.callback(
+    Output('device-select', 'options'),
+    Input('interval', 'n_intervals'),
+    Input('devices-signal', 'data'),
+    State('device-select', 'options')
+)
+def update_device_options(n, signal, options):
+    device_ids = device_registry.ids()
+    return device_ids if device_ids != options else no_update
 
 # ======================================
 # DASH UPDATE CALLBACK (GAUGES + CHARTS + ALERTS + TIMESTAMP)
 # ======================================
+# Partial-update rendering: gauges are patched, charts are extended with only the new
+# points and unchanged badges/timestamps return no_update, so the payload per tick
+# stays small no matter how long the page has been open.
+#
+# The rendered values are computed once per device and data version in a shared
+# snapshot; every browser session polling the same device reuses it.
+dashboard_snapshots = SnapshotCache()
+
+def patch_chart(times, values):
+    # Replaces the whole trace, used on first load and when the browser switches device
+    fig = Patch()
+    fig['data'][0]['x'] = times
+    fig['data'][0]['y'] = values
+    return fig
+
+def patch_gauge(value):
+    fig = Patch()
+    fig['data'][0]['value'] = value
+    fig['data'][0]['gauge']['bar']['color'] = gauge_bar_color(value)
+    return fig
+
+TEMP_COLUMN, HUMIDITY_COLUMN = 1, 2  # positions in a (ts, temperature, humidity, relay) sample
+
+def window_series(device_id, start, end=None, columns=(TEMP_COLUMN, HUMIDITY_COLUMN)):
+    """([(times in epoch ms, values)] per column, each downsampled to HISTORY_MAX_POINTS, newest ts)."""
+    samples = sensor_store.query(device_id, start=start, end=end)
+    times = [s[0] * 1000 for s in samples]
+    series = [lttb(times, [s[column] for s in samples], HISTORY_MAX_POINTS) for column in columns]
+    return series, samples[-1][0] if samples else None
+
+def history_update(times, temps, humidity):
+    return (({'x': [times], 'y': [temps]}, [0], HISTORY_MAX_POINTS),
+            ({'x': [times], 'y': [humidity]}, [0], HISTORY_MAX_POINTS))
+
+STATS_ROWS = [("Last 1 min", "1m"), ("Last 1 h", "1h"), ("Last 24 h", "24h")]
+
+def stats_table(stream, unit):
+    def fmt(value):
+        return "–" if value is None else f"{value:.1f}{unit}"
+
+    def row(label, s):
+        return html.Tr([html.Td(label), html.Td(fmt(s['min'])), html.Td(fmt(s['mean'])),
+                        html.Td(fmt(s['max'])), html.Td(fmt(s['std'])), html.Td(s['count'])])
+
+    header = html.Thead(html.Tr([html.Th(h) for h in ("", "Min", "Mean", "Max", "Std dev", "Samples")]))
+    rows = [row(label, stream['windows'][key]) for label, key in STATS_ROWS]
+    rows.append(row("All time", stream['all']))
+    return [
+        dbc.Table([header, html.Tbody(rows)], size="sm", bordered=False, className="mb-1 text-center"),
+        html.Small(f"EWMA: {fmt(stream['ewma'])}", className="text-muted")
+    ]
+
+def render_snapshot(device, version, bucket, previous):
+    temp, humidity, _, last_update, data_version = device.latest()
+    stats = device.stats_snapshot()
+    connected = mqtt_connected
+
+    # Alerts, most severe first per metric, as last evaluated on ingest
+    alerts = {}
+    for alert in alert_engine.active(device.device_id):
+        alerts.setdefault(alert['metric'], alert)
+
+    def badge(metric):
+        alert = alerts.get(metric)
+        return (alert['message'], SEVERITY_COLORS[alert['severity']]) if alert else ("Normal", "success")
+
+    temp_alert, temp_color = badge('temperature')
+    humidity_alert, humidity_color = badge('humidity')
+
+    mqtt_text = "MQTT Connected" if connected else "MQTT Disconnected!"
+    mqtt_color = "success" if connected else "danger"
+
+    # Last updated timestamp & offline warning
+    last_update_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_update))
+    if 'age' in alerts:
+        timestamp_color = "text-danger"
+        offline_warning = f" ⚠ {alerts['age']['message']}"
+    else:
+        timestamp_color = "text-muted"
+        offline_warning = ""
+    last_update_text = f"Last Updated: {last_update_str}{offline_warning}"
+
+    # Points added since the previous snapshot, shared by every browser that rendered it
+    newest = device.samples_since(None, 1)
+    last_ts = newest[-1][0] if newest else None
+    prev_last_ts = previous['last_ts'] if previous else None
+    delta = None
+    if previous and last_ts != prev_last_ts:
+        samples = device.samples_since(prev_last_ts, HISTORY_MAX_POINTS)
+        if samples:
+            delta = history_update([s[0] * 1000 for s in samples], [s[1] for s in samples], [s[2] for s in samples])
+
+    return {
+        'version': version,
+        'last_ts': last_ts,
+        'prev_last_ts': prev_last_ts,
+        'delta': delta,
+        'state': {
+            'version': version,
+            'temp': temp,
+            'humidity': humidity,
+            'temp_alert': [temp_alert, temp_color],
+            'humidity_alert': [humidity_alert, humidity_color],
+            'mqtt': [mqtt_text, mqtt_color],
+            'last_update': [last_update_text, timestamp_color],
+            'stats': f"{data_version}:{bucket}",
+        },
+        'temp_fig': patch_gauge(temp),
+        'humidity_fig': patch_gauge(humidity),
+        'last_update_span': html.Span(last_update_text, className=timestamp_color),
+        'temp_stats': stats_table(stats['temperature'], "°C"),
+        'humidity_stats': stats_table(stats['humidity'], "%"),
+    }
+
+def dashboard_snapshot(device_id):
+    # (None, None) for a device that never reported; browsers cannot create devices
+    device = device_registry.get(device_id) if valid_device_id(device_id) else None
+    if device is None:
+        return None, None
+    data_version = device.latest()[4]
+    bucket = stats_bucket()
+    version = f"{data_version}:{int(mqtt_connected)}:{alert_engine.version(device_id)}:{bucket}"
+    return device, dashboard_snapshots.get(
+        device_id, version, lambda previous: render_snapshot(device, version, bucket, previous))
+
+DASHBOARD_OUTPUTS = 17
+
 @app.callback(
     Output('temp-gauge', 'figure'),
     Output('humidity-gauge', 'figure'),
     Output('temp-chart', 'figure'),
     Output('humidity-chart', 'figure'),
+    Output('temp-chart', 'extendData'),
+    Output('humidity-chart', 'extendData'),
     Output('temp-alert', 'children'),
     Output('temp-alert', 'color'),
     Output('humidity-alert', 'children'),
@@ -313,48 +1081,136 @@ def relay_control(on_clicks, off_clicks):
     Output('mqtt-status', 'color'),
     Output('temp-last-update', 'children'),
     Output('humidity-last-update', 'children'),
-    Input('interval', 'n_intervals')
+    Output('temp-stats', 'children'),
+    Output('humidity-stats', 'children'),
+    Output('render-state', 'data'),
+    Input('interval', 'n_intervals'),
+    Input('push-signal', 'data'),
+    Input('stats-interval', 'n_intervals'),
+    Input('device-select', 'value'),
+    State('render-state', 'data')
 )
-def update_dashboard(n):
-    with data_lock:
-        # Gauges
-        temp_fig = generate_gauge(current_temp, "Temperature", "°C", 50)
-        humidity_fig = generate_gauge(current_humidity, "Humidity", "%", 100)
-
-        # Charts
-        temp_chart = go.Figure(go.Scatter(y=list(temperature_history), mode="lines+markers", line={'color': '#FF851B'}, name="Temperature"))
-        temp_chart.update_layout(title="Temperature History", template="plotly_dark")
-
-        humidity_chart = go.Figure(go.Scatter(y=list(humidity_history), mode="lines+markers", line={'color': '#0074D9'}, name="Humidity"))
-        humidity_chart.update_layout(title="Humidity History", template="plotly_dark")
-
-        # Alerts
-        temp_alert = "Normal" if current_temp <= 40 else "High Temperature!"
-        temp_color = "success" if current_temp <= 40 else "danger"
-
-        humidity_alert = "Normal" if current_humidity <= 70 else "High Humidity!"
-        humidity_color = "success" if current_humidity <= 70 else "warning"
-
-        mqtt_text = "MQTT Connected" if mqtt_connected else "MQTT Disconnected!"
-        mqtt_color = "success" if mqtt_connected else "danger"
-
-        # Last updated timestamp & offline warning if >10s
-        elapsed = time.time() - last_mqtt_update
-        last_update_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_mqtt_update))
-        if elapsed > 10:
-            timestamp_color = "text-danger"
-            offline_warning = " ⚠ Sensor offline!"
-        else:
-            timestamp_color = "text-muted"
-            offline_warning = ""
+@CALLBACK_SECONDS.time("update_dashboard")
+def update_dashboard(n, signal, stats_tick, device_id, rendered):
+    rendered = rendered or {}
+    if rendered.get('device') != device_id:
+        rendered = {}  # Different device: everything is redrawn
+
+    device, snap = dashboard_snapshot(device_id)
+    if snap is None or rendered.get('version') == snap['version']:
+        return (no_update,) * DASHBOARD_OUTPUTS
+
+    # History charts
+    temp_chart = humidity_chart = temp_extend = humidity_extend = no_update
+    last_ts = rendered.get('last_ts')
+    if last_ts is not None and last_ts == snap['last_ts']:
+        pass  # Nothing new for this browser
+    elif last_ts is not None and last_ts == snap['prev_last_ts'] and snap['delta']:
+        temp_extend, humidity_extend = snap['delta']
+        last_ts = snap['last_ts']
+    elif not rendered:
+        # First load: the whole window from the store, downsampled
+        (temp_series, humidity_series), last_ts = window_series(device_id, time.time() - HISTORY_WINDOW)
+        temp_chart, humidity_chart = patch_chart(*temp_series), patch_chart(*humidity_series)
+    else:
+        # A browser that fell behind: the points it missed, from the device's
+        # ring buffer or the store if the buffer no longer reaches back far enough
+        samples = device.samples_since(last_ts, HISTORY_MAX_POINTS)
+        if samples is None:
+            samples = sensor_store.query(device_id, start=last_ts, limit=HISTORY_MAX_POINTS)
+        if samples:
+            last_ts = samples[-1][0]
+            times = [s[0] * 1000 for s in samples]  # epoch ms for the date axis
+            temp_extend, humidity_extend = history_update(times, [s[1] for s in samples], [s[2] for s in samples])
+
+    state = dict(snap['state'], device=device_id, last_ts=last_ts)
 
-        temp_last_update = html.Span(f"Last Updated: {last_update_str}{offline_warning}", className=timestamp_color)
-        humidity_last_update = html.Span(f"Last Updated: {last_update_str}{offline_warning}", className=timestamp_color)
+    def changed(key):
+        return rendered.get(key) != state[key]
 
-        return temp_fig, humidity_fig, temp_chart, humidity_chart, temp_alert, temp_color, humidity_alert, humidity_color, mqtt_text, mqtt_color, temp_last_update, humidity_last_update
+    temp_fig = snap['temp_fig'] if changed('temp') else no_update
+    humidity_fig = snap['humidity_fig'] if changed('humidity') else no_update
+
+    if changed('temp_alert'):
+        temp_alert_out, temp_color_out = state['temp_alert']
+    else:
+        temp_alert_out = temp_color_out = no_update
+
+    if changed('humidity_alert'):
+        humidity_alert_out, humidity_color_out = state['humidity_alert']
+    else:
+        humidity_alert_out = humidity_color_out = no_update
+
+    if changed('mqtt'):
+        mqtt_text_out, mqtt_color_out = state['mqtt']
+    else:
+        mqtt_text_out = mqtt_color_out = no_update
+
+    if changed('last_update'):
+        temp_last_update = humidity_last_update = snap['last_update_span']
+    else:
+        temp_last_update = humidity_last_update = no_update
+
+    # Redrawn on new samples and whenever the windows slid into a new bucket
+    if changed('stats'):
+        temp_stats, humidity_stats = snap['temp_stats'], snap['humidity_stats']
+    else:
+        temp_stats = humidity_stats = no_update
+
+    return (temp_fig, humidity_fig, temp_chart, humidity_chart, temp_extend, humidity_extend,
+            temp_alert_out, temp_color_out, humidity_alert_out, humidity_color_out,
+            mqtt_text_out, mqtt_color_out, temp_last_update, humidity_last_update,
+            temp_stats, humidity_stats, state)
+
+# ======================================
+# CHART ZOOM CALLBACKS
+# ======================================
+# Zooming a history chart reloads the visible range at full detail (again downsampled
+# to HISTORY_MAX_POINTS); resetting the zoom reloads the whole window.
+def parse_axis_time(value):
+    if isinstance(value, (int, float)):
+        return value / 1000
+    # Plotly reports date axis ranges as UTC strings, e.g. "2026-02-16 10:15:30.25"
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+def zoomed_series(relayout, device_id, column):
+    if not relayout:
+        return no_update
+    if relayout.get('xaxis.autorange'):
+        start, end = time.time() - HISTORY_WINDOW, None
+    elif 'xaxis.range[0]' in relayout:
+        start, end = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        start, end = relayout['xaxis.range']
+    else:
+        return no_update
+    if end is not None:
+        start, end = parse_axis_time(start), parse_axis_time(end)
+    (series,), _ = window_series(device_id, start, end, columns=(column,))
+    return patch_chart(*series)
+
+@app.callback(
+    Output('temp-chart', 'figure', allow_duplicate=True),
+    Input('temp-chart', 'relayoutData'),
+    State('device-select', 'value'),
+    prevent_initial_call=True
+)
+def zoom_temp_chart(relayout, device_id):
+    return zoomed_series(relayout, device_id, TEMP_COLUMN)
+
+@app.callback(
+    Output('humidity-chart', 'figure', allow_duplicate=True),
+    Input('humidity-chart', 'relayoutData'),
+    State('device-select', 'value'),
+    prevent_initial_call=True
+)
+def zoom_humidity_chart(relayout, device_id):
+    return zoomed_series(relayout, device_id, HUMIDITY_COLUMN)
 
 # ======================================
 # RUN
 # ======================================
 if __name__ == "__main__":
-    server.run(debug=False, host="0.0.0.0", port=8050)
+    # Exit through atexit on SIGTERM too, so the store is flushed and shared memory released
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.run(debug=False, host="0.0.0.0", port=int(os.environ.get("PORT", 8050)))
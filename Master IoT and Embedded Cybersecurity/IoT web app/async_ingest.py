@@ -0,0 +1,257 @@
+"""
+asyncio ingest engine for the IoT web app (INGEST_ENGINE=asyncio).
+
+One event loop, on its own thread, owns the MQTT connection, parsing,
+storage and push notification. Packets are built and parsed by the shared
+codec in common/mqtt_codec.py; the socket is read in large chunks and every
+complete packet in them is handled before the next read.
+
+  - Backpressure: the socket reader awaits a bounded queue, so when
+    commits fall behind it stops reading and TCP flow control pushes back
+    on the broker instead of messages being dropped.
+  - Reconnects back off exponentially, with jitter, up to RECONNECT_MAX.
+  - stop() sends DISCONNECT, commits everything still queued and joins
+    the loop thread.
+  - With no host it stays offline and only takes messages from submit(),
+    which is how captures are replayed.
+
+Same `publish()` and `stats()` as the paho client and IngestPipeline, so
+the rest of the app does not care which engine is running.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from ingest import MESSAGES_RECEIVED, process_batch, topic_label
+
+from mqtt_codec import (PUBLISH, PacketReader, connect_packet, subscribe_packet, publish_packet, puback_packet,
+                        parse_publish, connack_code, packet_type, PINGREQ_PACKET, DISCONNECT_PACKET)
+
+RECONNECT_MIN = 1    # seconds before the first reconnect attempt
+RECONNECT_MAX = 60   # backoff ceiling
+CONNECT_TIMEOUT = 10
+READ_SIZE = 1 << 16
+
+
+class ConnackError(ConnectionError):
+    def __init__(self, rc):
+        super().__init__(f"broker refused connection, return code {rc}")
+        self.rc = rc
+
+
+# ======================================
+# ENGINE
+# ======================================
+class AsyncIngest:
+    def __init__(self, host, port, topics, commit, on_status=None, maxsize=10000, batch_size=500, keepalive=60,
+                 tap=None):
+        """
+        `commit(batch)` receives a list of (topic, payload dict, receive timestamp), as with IngestPipeline.
+        `on_status(connected, rc)` is called on connect (rc 0), refusal (CONNACK code), connection
+        errors (the exception) and disconnects (rc None). `tap(topic, payload bytes, ts)`, if given,
+        sees every message received from the broker before it is queued.
+        """
+        self.host = host
+        self.port = port
+        self.topics = list(topics)
+        self.commit = commit
+        self.on_status = on_status or (lambda connected, rc: None)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.keepalive = keepalive
+        self.tap = tap
+        self.client_id = f"iot-web-{os.getpid()}-{random.randrange(1 << 32):08x}"
+
+        self.loop = None
+        self.queue = None
+        self.writer = None
+        self.connected = False
+        self.packet_id = 1  # SUBSCRIBE uses 1, outgoing QoS 1 publishes count on from there
+        self.stopping = None
+        self.ready = threading.Event()
+        self.thread = None
+
+        self.received = 0
+        self.submitted = 0  # by submit(), counted on the caller's thread
+        self.parsed = 0
+        self.failed = 0
+        self.batches = 0
+        self.reconnects = 0
+
+    # ---- called from other threads ----
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.main(),), daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def stop(self, timeout=10):
+        if self.thread and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join(timeout)
+
+    def publish(self, topic, payload, qos=0):
+        """Thread-safe publish; logs and drops the message while disconnected. QoS 1 is sent once, PUBACK is not awaited."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.loop.call_soon_threadsafe(self.send_publish, topic, payload, qos)
+
+    def submit(self, topic, payload, ts, block=True):
+        """
+        Counterpart of a received PUBLISH for one other thread (replays). Messages are handed to the
+        loop without waiting while the queue plus those still in transit fit, otherwise it waits for room
+        whatever `block` says: this engine never drops.
+        """
+        self.submitted += 1
+        if self.submitted - self.received + self.queue.qsize() < self.maxsize:
+            self.loop.call_soon_threadsafe(self.enqueue_nowait, topic, payload, ts)
+        else:
+            asyncio.run_coroutine_threadsafe(self.enqueue(topic, payload, ts), self.loop).result()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_capacity": self.maxsize,
+            "received": self.received,
+            "dropped": 0,  # the reader waits for room instead of dropping
+            "parsed": self.parsed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "reconnects": self.reconnects,
+        }
+
+    # ---- event loop ----
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.maxsize)
+        self.stopping = asyncio.Event()
+        self.ready.set()
+
+        connection = asyncio.create_task(self.maintain_connection()) if self.host else None
+        consumer = asyncio.create_task(self.consume())
+        await self.stopping.wait()
+
+        if connection:
+            connection.cancel()
+            await asyncio.gather(connection, return_exceptions=True)
+        await self.queue.put(None)  # consumer commits what is left, then exits
+        await consumer
+        logging.info("Async ingest stopped")
+
+    def send_publish(self, topic, payload, qos=0):
+        if self.writer is None or self.writer.is_closing():
+            logging.warning(f"MQTT not connected, dropped publish to {topic}")
+            return
+        qos = min(qos, 1)
+        if qos:
+            self.packet_id = self.packet_id % 0xFFFF + 1
+        self.writer.write(publish_packet(topic, payload, qos, self.packet_id))
+
+    async def maintain_connection(self):
+        failures = 0
+        while True:
+            self.connected = False
+            try:
+                await self.session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.connected:
+                    self.on_status(False, e.rc if isinstance(e, ConnackError) else e)
+                else:
+                    logging.warning(f"MQTT connection lost: {e}")  # includes a broker breaking the protocol
+            # A session that got as far as CONNACK starts the backoff over
+            failures = 0 if self.connected else failures + 1
+            self.reconnects += 1
+            delay = min(RECONNECT_MAX, RECONNECT_MIN * 2 ** failures)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def session(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        try:
+            writer.write(connect_packet(self.client_id, self.keepalive))
+            packets = PacketReader()
+            received = []
+            while not received:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), CONNECT_TIMEOUT)
+                if not data:
+                    raise ConnectionError("connection closed before CONNACK")
+                received = packets.feed(data)
+            rc = connack_code(*received[0])
+            if rc != 0:
+                raise ConnackError(rc)
+
+            writer.write(subscribe_packet(self.topics))
+            self.writer = writer
+            self.connected = True
+            self.on_status(True, 0)
+
+            pinger = asyncio.create_task(self.ping(writer))
+            try:
+                await self.read_loop(reader, writer, packets, received[1:])
+            finally:
+                pinger.cancel()
+        finally:
+            was_connected = self.writer is writer
+            self.writer = None
+            if not writer.is_closing():
+                writer.write(DISCONNECT_PACKET)  # harmless if the broker already went away
+                writer.close()
+            if was_connected:
+                self.on_status(False, None)
+
+    async def ping(self, writer):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            writer.write(PINGREQ_PACKET)
+
+    async def read_loop(self, reader, writer, packets, received):
+        # Reads whatever the socket has and handles every complete packet in it
+        while True:
+            for first, body in received:
+                if packet_type(first) != PUBLISH:
+                    continue  # SUBACK, PINGRESP, PUBACK
+                ts = time.time()
+                topic, payload, qos, packet_id = parse_publish(first, body)
+                if qos:
+                    writer.write(puback_packet(packet_id))
+                if self.tap:
+                    self.tap(topic, payload, ts)
+                await self.enqueue(topic, payload, ts)
+            if writer.transport.get_write_buffer_size() > 1 << 16:
+                await writer.drain()
+            # Twice the keepalive without even a PINGRESP means the link is dead
+            data = await asyncio.wait_for(reader.read(READ_SIZE), self.keepalive * 2)
+            if not data:
+                raise ConnectionError("connection closed by the broker")
+            received = packets.feed(data)
+
+    async def enqueue(self, topic, payload, ts):
+        self.received += 1
+        MESSAGES_RECEIVED.inc(topic_label(topic))
+        await self.queue.put((topic, payload, ts))
+
+    def enqueue_nowait(self, topic, payload, ts):
+        self.received += 1
+        MESSAGES_RECEIVED.inc(topic_label(topic))
+        self.queue.put_nowait((topic, payload, ts))
+
+    async def consume(self):
+        while True:
+            items = [await self.queue.get()]
+            while len(items) < self.batch_size and not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            done = items[-1] is None
+            items = [item for item in items if item is not None]
+
+            if items:
+                parsed, failed = process_batch(items, self.commit)
+                self.parsed += parsed
+                self.failed += failed
+                self.batches += 1
+            if done:
+                return
+            await asyncio.sleep(0)  # let the reader refill the queue between batches
@@ -0,0 +1,165 @@
+"""
+MQTT capture and replay for the IoT web app.
+
+With MQTT_CAPTURE_FILE set, every raw message the ingest engine receives
+(topic, payload bytes, receive timestamp) is appended to a compact binary
+file. With MQTT_REPLAY_FILE set, the app makes no broker connection and
+feeds a capture through the same path on_message uses, at MQTT_REPLAY_SPEED
+times the recorded pace (0 = as fast as the engine accepts it), then
+reports the throughput and the resulting dashboard state.
+
+File format, little endian: the 8 byte magic b"PICOCAP\\x01", then records
+  b"T" topic id (u16), length (u16), topic        declares a topic id
+  b"M" ts (f64), topic id (u16), length (u32), payload
+Topic ids are declared on first use by each capture session, so sessions
+appended to the same file each carry their own topic table.
+
+Command line:
+  python capture.py info FILE
+  python capture.py replay FILE [--speed N] [--engine thread|asyncio]
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import logging
+import argparse
+import threading
+
+MAGIC = b"PICOCAP\x01"
+TOPIC = struct.Struct("<HH")
+MESSAGE = struct.Struct("<dHI")
+FLUSH_INTERVAL = 1.0  # seconds between flushes of the capture file
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab", buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.topics = {}  # {topic: id} declared in this session
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.messages = 0
+
+    def record(self, topic, payload, ts):
+        with self.lock:
+            if self.file.closed:
+                return
+            topic_id = self.topics.get(topic)
+            if topic_id is None:
+                topic_id = self.topics[topic] = len(self.topics)
+                name = topic.encode()
+                self.file.write(b"T" + TOPIC.pack(topic_id, len(name)) + name)
+            self.file.write(b"M" + MESSAGE.pack(ts, topic_id, len(payload)) + payload)
+            self.messages += 1
+            now = time.monotonic()
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_capture(path):
+    """Yields (topic, payload bytes, ts) in recorded order; a truncated last record is ignored."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an MQTT capture file")
+        topics = {}
+        while True:
+            kind = f.read(1)
+            if kind == b"M":
+                head = f.read(MESSAGE.size)
+                if len(head) < MESSAGE.size:
+                    return
+                ts, topic_id, length = MESSAGE.unpack(head)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield topics[topic_id], payload, ts
+            elif kind == b"T":
+                head = f.read(TOPIC.size)
+                if len(head) < TOPIC.size:
+                    return
+                topic_id, length = TOPIC.unpack(head)
+                topics[topic_id] = f.read(length).decode()
+            elif not kind:
+                return
+            else:
+                raise ValueError(f"{path}: corrupt record at offset {f.tell() - 1}")
+
+
+def replay(path, deliver, speed=1.0):
+    """
+    Calls `deliver(topic, payload, ts)` for each captured message; `speed` 0 means unbounded.
+    Timestamps keep their recorded spacing but are shifted so the capture starts now, so
+    every speed produces the same samples. Returns throughput figures.
+    """
+    start = time.time()
+    first = None
+    messages = size = 0
+    for topic, payload, ts in read_capture(path):
+        if first is None:
+            first = ts
+        offset = ts - first
+        if speed:
+            delay = offset / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+        deliver(topic, payload, start + offset)
+        messages += 1
+        size += len(payload)
+    elapsed = time.time() - start
+    return {
+        "messages": messages,
+        "payload_bytes": size,
+        "captured_seconds": round(offset, 3) if messages else 0,
+        "speed": speed,
+        "elapsed": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1) if elapsed else None,
+    }
+
+
+def info(path):
+    topics = {}
+    first = last = None
+    for topic, _, ts in read_capture(path):
+        topics[topic] = topics.get(topic, 0) + 1
+        first = ts if first is None else first
+        last = ts
+    return {"messages": sum(topics.values()), "topics": topics, "first": first, "last": last,
+            "seconds": round(last - first, 3) if first is not None else 0,
+            "file_bytes": os.path.getsize(path)}
+
+
+# ======================================
+# COMMAND LINE
+# ======================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or replay an MQTT capture file.")
+    parser.add_argument("command", choices=["info", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 10 = ten times faster, 0 = unbounded")
+    parser.add_argument("--engine", choices=["thread", "asyncio"], help="ingest engine (default: INGEST_ENGINE)")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(info(args.path), indent=2))
+        sys.exit(0)
+
+    # Importing the app starts it in replay mode: no broker, the capture is fed to the ingest path
+    os.environ["MQTT_REPLAY_FILE"] = args.path
+    os.environ["MQTT_REPLAY_SPEED"] = str(args.speed)
+    if args.engine:
+        os.environ["INGEST_ENGINE"] = args.engine
+    logging.disable(logging.WARNING)  # keep per-message alert logs out of the measurement
+    import app
+    app.replay_done.wait()
+    print(json.dumps(app.replay_report, indent=2))
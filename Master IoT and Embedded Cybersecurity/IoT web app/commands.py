@@ -0,0 +1,139 @@
+"""
+Acknowledged relay commands for the IoT web app.
+
+The Pico only understands a bare "ON"/"OFF" on its control topic and has
+no reply channel, so each command gets an id here and counts as confirmed
+once the device's own data messages report the commanded relay state.
+
+  - Coalescing: repeating the pending state is a no-op, a different state
+    supersedes the pending command, and commands to one device are sent
+    at most once per coalesce window; only the newest is sent after it.
+  - Pending commands are resent with QoS 1 after `timeout` seconds, up to
+    `retries` times, then marked failed.
+  - Command-to-actuation latency (issued -> confirmed) is recorded in a
+    histogram.
+"""
+
+import time
+import logging
+import threading
+from itertools import count
+
+from metrics import Counter, Histogram
+
+RELAY_COMMANDS = Counter("relay_commands_total", "Relay commands by outcome.", ["outcome"])
+RELAY_LATENCY_SECONDS = Histogram("relay_command_latency_seconds", "Time from a relay command to the device reporting it.",
+                                  buckets=(0.25, 0.5, 1, 2.5, 5, 7.5, 10, 15, 30, 60))
+
+ACTIVE = ("queued", "pending")
+
+
+class RelayCommand:
+    __slots__ = ("id", "device", "state", "issued", "sent", "attempts", "status", "latency")
+
+    def __init__(self, command_id, device, state, issued):
+        self.id = command_id
+        self.device = device
+        self.state = state
+        self.issued = issued
+        self.sent = None
+        self.attempts = 0
+        self.status = "queued"  # queued -> pending -> confirmed | failed | superseded
+        self.latency = None
+
+    def as_dict(self):
+        return {"id": self.id, "device": self.device, "state": self.state, "status": self.status,
+                "attempts": self.attempts, "issued": self.issued, "latency": self.latency}
+
+
+class RelayCommands:
+    def __init__(self, send, timeout=15, retries=3, coalesce_window=0.5):
+        """`send(device_id, state, qos)` publishes one command; called without the lock held."""
+        self.send = send
+        self.timeout = timeout
+        self.retries = retries
+        self.coalesce_window = coalesce_window
+        self.lock = threading.Lock()
+        self.commands = {}   # {device id: latest RelayCommand}
+        self.last_sent = {}  # {device id: time of the last publish}
+        self.ids = count(1)
+
+    def _send(self, cmd, now):
+        # Caller holds the lock and publishes cmd afterwards, at the QoS it picked
+        cmd.status = "pending"
+        cmd.sent = now
+        cmd.attempts += 1
+        self.last_sent[cmd.device] = now
+
+    def request(self, device_id, state):
+        """Issues (or coalesces into) a command setting the device's relay to `state`."""
+        now = time.time()
+        with self.lock:
+            current = self.commands.get(device_id)
+            if current is not None and current.status in ACTIVE:
+                if current.state == state:
+                    RELAY_COMMANDS.inc("coalesced")
+                    return current
+                current.status = "superseded"
+                RELAY_COMMANDS.inc("superseded")
+
+            cmd = self.commands[device_id] = RelayCommand(next(self.ids), device_id, state, now)
+            send_now = now - self.last_sent.get(device_id, 0) >= self.coalesce_window
+            if send_now:
+                self._send(cmd, now)
+
+        if send_now:
+            self.publish(cmd, 0)
+        return cmd
+
+    def publish(self, cmd, qos):
+        RELAY_COMMANDS.inc("sent" if cmd.attempts == 1 else "retried")
+        logging.info(f"Relay command #{cmd.id} to {cmd.device}: {cmd.state} (attempt {cmd.attempts}, QoS {qos})")
+        try:
+            self.send(cmd.device, cmd.state, qos)
+        except Exception as e:
+            logging.error(f"Failed to publish relay command #{cmd.id}: {e}")
+
+    def observe(self, device_id, relay, ts):
+        """Called with each device's newest reported relay state; returns the command it confirms, if any."""
+        with self.lock:
+            cmd = self.commands.get(device_id)
+            if cmd is None or cmd.status != "pending" or relay != cmd.state:
+                return None
+            cmd.status = "confirmed"
+            cmd.latency = max(ts - cmd.issued, 0.0)
+        RELAY_COMMANDS.inc("confirmed")
+        RELAY_LATENCY_SECONDS.observe(cmd.latency)
+        logging.info(f"Relay command #{cmd.id} confirmed by {device_id} after {cmd.latency:.2f}s")
+        return cmd
+
+    def tick(self, now=None):
+        """Sends deferred commands and retries or fails timed-out ones. Returns the device ids that changed."""
+        now = time.time() if now is None else now
+        to_send, changed = [], []
+        with self.lock:
+            for cmd in self.commands.values():
+                if cmd.status == "queued" and now - self.last_sent.get(cmd.device, 0) >= self.coalesce_window:
+                    self._send(cmd, now)
+                    to_send.append((cmd, 0))
+                elif cmd.status == "pending" and now - cmd.sent > self.timeout:
+                    if cmd.attempts > self.retries:
+                        cmd.status = "failed"
+                        RELAY_COMMANDS.inc("failed")
+                        logging.warning(f"Relay command #{cmd.id} to {cmd.device} failed after {cmd.attempts} attempts")
+                    else:
+                        self._send(cmd, now)
+                        to_send.append((cmd, 1))
+                else:
+                    continue
+                changed.append(cmd.device)
+
+        for cmd, qos in to_send:
+            self.publish(cmd, qos)
+        return changed
+
+    def status(self, device_id):
+        """The device's latest command as a dict, or None."""
+        with self.lock:
+            cmd = self.commands.get(device_id)
+            return cmd.as_dict() if cmd else None
@@ -0,0 +1,165 @@
+"""
+Per-device live state for the IoT web app.
+
+Each Pico gets its own DeviceState with its own lock and a fixed-size,
+array-backed ring buffer of recent samples, so a busy device never blocks
+readers of another. The registry that maps device ids to their state is
+split into shards, each with its own lock, and is only locked when a
+device is looked up or first seen. It holds at most `max_devices`, so ids
+made up by anyone who can publish to the broker cannot grow it without
+bound.
+"""
+
+import re
+import time
+import threading
+import zlib
+from array import array
+
+from metrics import TimedLock
+from stats import StreamStats
+
+# Device ids end up in MQTT topics ("pico/<id>/control") and shared-memory slots (64 bytes)
+DEVICE_ID = re.compile(r"[A-Za-z0-9_.:-]{1,64}")
+
+
+def valid_device_id(device_id):
+    return isinstance(device_id, str) and DEVICE_ID.fullmatch(device_id) is not None
+
+
+# ======================================
+# RING BUFFER
+# ======================================
+class RingBuffer:
+    """Fixed-capacity (timestamp, temperature, humidity, relay) samples stored column-wise in flat arrays."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = array('d', bytes(8 * capacity))
+        self.temperature = array('d', bytes(8 * capacity))
+        self.humidity = array('d', bytes(8 * capacity))
+        self.relay = array('b', bytes(capacity))  # 1 = ON, 0 = OFF
+        self.head = 0   # index of the next write
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, temp, humidity, relay):
+        i = self.head
+        self.ts[i] = ts
+        self.temperature[i] = temp
+        self.humidity[i] = humidity
+        self.relay[i] = 1 if relay == "ON" else 0
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def oldest_ts(self):
+        if not self.count:
+            return None
+        return self.ts[(self.head - self.count) % self.capacity]
+
+    def since(self, start=None, limit=None):
+        """Samples with ts > start, oldest first. Walks back from the newest sample only."""
+        rows = []
+        i = self.head
+        for _ in range(min(self.count, limit or self.count)):
+            i = (i - 1) % self.capacity
+            if start is not None and self.ts[i] <= start:
+                break
+            rows.append((self.ts[i], self.temperature[i], self.humidity[i],
+                         "ON" if self.relay[i] else "OFF"))
+        rows.reverse()
+        return rows
+
+
+# ======================================
+# DEVICE STATE
+# ======================================
+class DeviceState:
+    def __init__(self, device_id, capacity):
+        self.device_id = device_id
+        self.lock = TimedLock("device")
+        self.buffer = RingBuffer(capacity)
+        self.temperature = 0
+        self.humidity = 0
+        self.relay = "OFF"
+        self.last_update = time.time()
+        self.version = 0  # bumped on every recorded batch
+        self.stats = {"temperature": StreamStats(), "humidity": StreamStats()}
+
+    def record(self, ts, temp, humidity, relay):
+        self.record_many([(ts, temp, humidity, relay)])
+
+    def record_many(self, samples):
+        """Appends (ts, temp, humidity, relay) samples, oldest first, under one lock acquisition."""
+        if not samples:
+            return
+        with self.lock:
+            temp_stats, humidity_stats = self.stats["temperature"], self.stats["humidity"]
+            for sample in samples:
+                self.buffer.append(*sample)
+                temp_stats.add(sample[0], sample[1])
+                humidity_stats.add(sample[0], sample[2])
+            self.last_update, self.temperature, self.humidity, self.relay = samples[-1]
+            self.version += 1
+
+    def latest(self):
+        """(temperature, humidity, relay, last_update, version) read under the device lock."""
+        with self.lock:
+            return self.temperature, self.humidity, self.relay, self.last_update, self.version
+
+    def stats_snapshot(self, now=None):
+        """Streaming statistics for each sensor, read under the device lock."""
+        now = time.time() if now is None else now
+        with self.lock:
+            return {name: stream.read(now) for name, stream in self.stats.items()}
+
+    def samples_since(self, start, limit=None):
+        """Buffered samples newer than `start`, or None if the buffer has already dropped some of them."""
+        with self.lock:
+            buf = self.buffer
+            if buf.count == buf.capacity and start is not None and buf.oldest_ts() > start:
+                return None
+            return buf.since(start, limit)
+
+
+# ======================================
+# SHARDED REGISTRY
+# ======================================
+class DeviceRegistry:
+    def __init__(self, capacity, shards=16, max_devices=None):
+        self.capacity = capacity
+        self.max_devices = max_devices
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+        self.count = 0
+        self.count_lock = threading.Lock()
+
+    def shard(self, device_id):
+        return self.shards[zlib.crc32(device_id.encode()) % len(self.shards)]
+
+    def get(self, device_id):
+        devices, lock = self.shard(device_id)
+        with lock:
+            return devices.get(device_id)
+
+    def get_or_create(self, device_id):
+        """The device's state, created on first sight; None for a new device once the registry is full."""
+        devices, lock = self.shard(device_id)
+        with lock:
+            state = devices.get(device_id)
+            if state is None:
+                with self.count_lock:
+                    if self.max_devices is not None and self.count >= self.max_devices:
+                        return None
+                    self.count += 1
+                state = devices[device_id] = DeviceState(device_id, self.capacity)
+            return state
+
+    def ids(self):
+        ids = []
+        for devices, lock in self.shards:
+            with lock:
+                ids.extend(devices)
+        return sorted(ids)
@@ -0,0 +1,85 @@
+"""
+Largest-Triangle-Three-Buckets downsampling for the history charts.
+
+Reduces a series to a fixed number of points that keep its visual shape:
+the first and last points are always kept, the rest are split into equal
+buckets and from each bucket the point forming the largest triangle with
+the previously kept point and the next bucket's average is kept. Uses
+numpy when it is installed, a pure-Python loop otherwise.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def bucket_edges(n, n_out):
+    # n_out - 2 buckets over points 1 .. n-2; bucket i spans [edges[i], edges[i + 1])
+    step = (n - 2) / (n_out - 2)
+    return [1 + int(i * step) for i in range(n_out - 2)] + [n - 1]
+
+
+def _lttb_numpy(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    edges = np.array(bucket_edges(n, n_out))
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            cx, cy = avg_x[i + 1], avg_y[i + 1]
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected.tolist()
+
+
+def _lttb_python(x, y, n_out):
+    n = len(x)
+    edges = bucket_edges(n, n_out)
+
+    selected = [0]
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            cx = sum(x[nlo:nhi]) / (nhi - nlo)
+            cy = sum(y[nlo:nhi]) / (nhi - nlo)
+        else:
+            cx, cy = x[-1], y[-1]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((x[a] - cx) * (y[j] - y[a]) - (x[a] - x[j]) * (cy - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+def lttb_indices(x, y, n_out):
+    """Indices (ascending) of the points to keep so that at most `n_out` remain."""
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return list(range(n))
+    if np is not None:
+        return _lttb_numpy(x, y, n_out)
+    return _lttb_python(x, y, n_out)
+
+
+def lttb(x, y, n_out):
+    """Downsampled (x, y) lists with at most `n_out` points."""
+    indices = lttb_indices(x, y, n_out)
+    return [x[i] for i in indices], [y[i] for i in indices]
@@ -0,0 +1,120 @@
+"""
+Streaming history export for the IoT web app (/export/<device>.<format>).
+
+Each format is a generator over the chunks yielded by the store's
+iter_query(), so an export holds one chunk in memory however long the
+range is, and Flask sends it with chunked transfer encoding.
+
+  - csv:      header line, then one row per sample
+  - ndjson:   one JSON object per sample and line
+  - parquet:  one row group per chunk; needs the optional `pyarrow` package
+"""
+
+import io
+import re
+import csv
+import json
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa  # Optional, only needed for Parquet exports
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COLUMNS = ("device", "timestamp", "iso_time", "temperature", "humidity", "relay")  # in every format
+MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def available(fmt):
+    return fmt in MIMETYPES and (fmt != "parquet" or pq is not None)
+
+
+def iso_time(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds")
+
+
+def content_disposition(device, fmt):
+    """Attachment header for an export; `device` comes from the URL, so it is never put in quotes as is."""
+    name = f"{device}.{fmt}"
+    fallback = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def export_csv(device, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows((device, ts, iso_time(ts), t, h, relay) for ts, t, h, relay in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # header only: no samples in the range
+
+
+def export_ndjson(device, chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(COLUMNS, (device, ts, iso_time(ts), t, h, relay)))) + "\n"
+                      for ts, t, h, relay in rows)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file for ParquetWriter; take() hands over what was written since the last call."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data, self.parts = b"".join(self.parts), []
+        return data
+
+
+def export_parquet(device, chunks):
+    # Same column names as CSV and NDJSON; iso_time is a native timestamp here
+    schema = pa.schema(list(zip(COLUMNS, (pa.string(), pa.float64(), pa.timestamp("ms", tz="UTC"),
+                                         pa.float64(), pa.float64(), pa.string()))))
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in chunks:
+            ts, t, h, relay = zip(*rows)
+            writer.write_table(pa.table({
+                "device": [device] * len(rows),
+                "timestamp": ts,
+                "iso_time": [int(x * 1000) for x in ts],
+                "temperature": t,
+                "humidity": h,
+                "relay": relay,
+            }, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()  # writes the footer
+    yield sink.take()
+
+
+EXPORTERS = {"csv": export_csv, "ndjson": export_ndjson, "parquet": export_parquet}
+
+
+def export(device, chunks, fmt):
+    """Generator of the export body; `chunks` is store.iter_query(...)."""
+    return EXPORTERS[fmt](device, chunks)
@@ -0,0 +1,158 @@
+"""
+Batched MQTT ingest pipeline for the IoT web app.
+
+paho's network thread only timestamps the raw payload and drops it into a
+bounded queue, so keepalives are never delayed by parsing or locking. A
+worker thread drains the queue in batches, decodes them and hands each
+batch to a commit function in one call. When the queue is full, new
+messages are dropped and counted instead of blocking the network thread.
+"""
+
+import json
+import queue
+import logging
+import threading
+import functools
+import time
+
+from metrics import Counter, Histogram
+from mqtt_codec import topic_matches
+
+MESSAGES_RECEIVED = Counter("mqtt_messages_received_total", "MQTT messages received.", ["subscription"])
+MESSAGES_PARSED = Counter("mqtt_messages_parsed_total", "MQTT messages decoded from JSON.", ["subscription"])
+MESSAGES_FAILED = Counter("mqtt_messages_failed_total", "MQTT messages rejected as malformed.", ["subscription"])
+MESSAGES_DROPPED = Counter("mqtt_messages_dropped_total", "MQTT messages dropped because the ingest queue was full.")
+BATCH_SECONDS = Histogram("ingest_batch_seconds", "Time to decode and commit one ingest batch.")
+BATCH_SIZE = Histogram("ingest_batch_size", "Messages per ingest batch.", buckets=(1, 10, 50, 100, 250, 500, 1000))
+
+try:
+    import orjson  # Optional, much faster JSON decoder
+    decode_json = orjson.loads
+except ImportError:
+    def decode_json(payload):
+        return json.loads(payload.decode('utf-8'))
+
+
+# Counters are labelled by the subscription a topic matched ("pico/+/data"), never by the topic
+# itself: anyone can publish to a public broker, and every label value is a series of its own
+subscriptions = []
+
+
+def count_by_subscription(topic_filters):
+    """Sets the subscriptions used as labels; topics matching none of them count as "other"."""
+    subscriptions[:] = topic_filters
+    topic_label.cache_clear()
+
+
+@functools.lru_cache(maxsize=1024)
+def topic_label(topic):
+    for topic_filter in subscriptions:
+        if topic_matches(topic_filter, topic):
+            return topic_filter
+    return "other"
+
+
+def process_batch(items, commit):
+    """
+    Decodes raw (topic, payload bytes, ts) items and commits the JSON objects. Returns (parsed, failed):
+    a message only counts as parsed once commit() accepted it. commit() returns the topics of the rows
+    it rejected; if it raises, the whole batch counts as failed.
+    """
+    start = time.perf_counter()
+    batch = []
+    rejected = []
+    for topic, payload, ts in items:
+        try:
+            data = decode_json(payload)
+        except Exception as e:
+            rejected.append(topic)
+            logging.error(f"MQTT message error on {topic}: {e}")
+            continue
+        if not isinstance(data, dict):
+            rejected.append(topic)
+            logging.error(f"MQTT message error on {topic}: payload is not a JSON object")
+            continue
+        batch.append((topic, data, ts))
+
+    refused = []
+    if batch:
+        try:
+            refused = list(commit(batch) or ())
+        except Exception as e:
+            logging.error(f"Ingest commit failed: {e}")
+            refused = [topic for topic, _, _ in batch]
+
+    per_label = {}
+    for topic, _, _ in batch:
+        label = topic_label(topic)
+        per_label[label] = per_label.get(label, 0) + 1
+    for topic in refused:
+        per_label[topic_label(topic)] -= 1  # decoded, then rejected by commit()
+    rejected.extend(refused)
+    for topic in rejected:
+        MESSAGES_FAILED.inc(topic_label(topic))
+    for label, count in per_label.items():
+        if count:
+            MESSAGES_PARSED.inc(label, amount=count)
+
+    BATCH_SECONDS.observe(time.perf_counter() - start)
+    BATCH_SIZE.observe(len(items))
+    return len(items) - len(rejected), len(rejected)
+
+
+class IngestPipeline:
+    def __init__(self, commit, maxsize=10000, batch_size=500):
+        """
+        `commit(batch)` receives a list of (topic, payload dict, receive timestamp) and returns
+        the topics of the rows it rejected, if any.
+        """
+        self.commit = commit
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=maxsize)
+
+        # Counters are only written by one thread each, so they need no lock
+        self.received = 0
+        self.dropped = 0
+        self.parsed = 0
+        self.failed = 0
+        self.batches = 0
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def submit(self, topic, payload, ts, block=False):
+        """
+        Called from the MQTT network thread; never blocks and drops when the queue is full.
+        With `block`, waits for room instead (replays, which must ingest every message).
+        """
+        self.received += 1
+        MESSAGES_RECEIVED.inc(topic_label(topic))
+        try:
+            self.queue.put((topic, payload, ts), block=block)
+        except queue.Full:
+            self.dropped += 1
+            MESSAGES_DROPPED.inc()
+
+    def worker(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            parsed, failed = process_batch(items, self.commit)
+            self.parsed += parsed
+            self.failed += failed
+            self.batches += 1
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "received": self.received,
+            "dropped": self.dropped,
+            "parsed": self.parsed,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,163 @@
+"""
+Minimal Prometheus metrics for the IoT web app.
+
+Counters and histograms are module-level objects registered in REGISTRY
+and rendered in the Prometheus text exposition format by `render()`.
+Recording a value costs one short lock acquisition, cheap enough to
+leave on in production. Gauges are computed by a callback at scrape time.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# ======================================
+# COUNTER
+# ======================================
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # {label values: count}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def collect(self):
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+# ======================================
+# HISTOGRAM
+# ======================================
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # {label values: [bucket counts..., +Inf count, sum]}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Decorator recording the wrapped function's duration."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def collect(self):
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# ======================================
+# GAUGE (computed at scrape time)
+# ======================================
+class Gauge:
+    def __init__(self, name, documentation, labelnames, collect):
+        """`collect()` returns an iterable of (label values tuple, value)."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = collect
+        REGISTRY.append(self)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.callback():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+# ======================================
+# TIMED LOCK
+# ======================================
+class TimedLock:
+    """A threading.Lock that records how long callers wait for it and hold it."""
+
+    def __init__(self, name):
+        self.lock = threading.Lock()
+        self.name = name
+        self.acquired_at = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.acquired_at = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(self.acquired_at - start, self.name)
+        return self
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        LOCK_HOLD_SECONDS.observe(held, self.name)
+
+
+# Shared by every TimedLock, labelled with the lock's name
+LOCK_WAIT_SECONDS = Histogram("lock_wait_seconds", "Time spent waiting to acquire a shared-state lock.", ["lock"],
+                              buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1))
+LOCK_HOLD_SECONDS = Histogram("lock_hold_seconds", "Time a shared-state lock was held.", ["lock"],
+                              buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
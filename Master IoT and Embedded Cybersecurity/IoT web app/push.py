@@ -0,0 +1,52 @@
+"""
+In-process event hub behind the dashboard's server-sent events stream.
+
+Each connected browser holds a Subscription. Publishing never blocks:
+events are coalesced per (event, key) until the subscriber's stream picks
+them up, so a slow browser only ever sees the latest event of each kind.
+"""
+
+import threading
+
+
+class Subscription:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = {}  # {(event, key): data}, insertion ordered
+
+    def wait(self, timeout):
+        """Pending (event, data) pairs, waiting up to `timeout` seconds; [] on timeout."""
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            events = [(event, data) for (event, _), data in self.pending.items()]
+            self.pending.clear()
+        return events
+
+
+class EventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self):
+        sub = Subscription()
+        with self.lock:
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def publish(self, event, data, key=None):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            with sub.cond:
+                sub.pending[(event, key)] = data
+                sub.cond.notify()
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
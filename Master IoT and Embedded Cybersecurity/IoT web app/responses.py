@@ -0,0 +1,182 @@
+"""
+Response pipeline for the IoT web app: compression, static assets, JSON.
+
+  - Compressor: an after_request hook that gzips (or brotli-compresses,
+    if the optional `brotli` package is installed) JSON, HTML, JS, CSS
+    and text responses above a size threshold. Compressed bodies of
+    responses that carry an ETag (Dash's JS bundles) are cached, so each
+    bundle is only compressed once.
+  - StaticAssets: files under static/ are read, fingerprinted and
+    precompressed once at startup. url_for('static', ...) yields the
+    fingerprinted name, served with a one-year immutable Cache-Control;
+    plain names are served with `no-cache` and revalidated by ETag (304).
+  - FastJSONProvider: Flask's JSON (jsonify, request.get_json) through the
+    optional `orjson` package. Plotly, and so the Dash callback payloads,
+    already picks orjson up by itself when it is installed.
+"""
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from flask import Response, request, abort
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli  # Optional, smaller than gzip
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # Optional, much faster JSON encoder
+except ImportError:
+    orjson = None
+
+COMPRESSIBLE = {"application/json", "text/html", "text/css", "text/plain", "text/javascript",
+                "application/javascript", "image/svg+xml"}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # close to gzip -6 in speed, noticeably smaller
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def choose_encoding(accept_encoding):
+    """"br", "gzip" or None for an Accept-Encoding header."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# ======================================
+# DYNAMIC RESPONSES
+# ======================================
+class Compressor:
+    def __init__(self, min_size=1024, cache_size=64):
+        self.min_size = min_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # {(path, ETag, encoding): compressed body}
+        self.lock = threading.Lock()
+
+    def __call__(self, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding is None or (response.content_length or 0) < self.min_size:
+            return response
+
+        etag = response.headers.get("ETag")
+        key = (request.path, etag, encoding)
+        body = None
+        if etag:
+            with self.lock:
+                body = self.cache.get(key)
+                if body is not None:
+                    self.cache.move_to_end(key)
+        if body is None:
+            body = compress(response.get_data(), encoding)
+            if etag:
+                with self.lock:
+                    self.cache[key] = body
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+# ======================================
+# STATIC ASSETS
+# ======================================
+class StaticAssets:
+    def __init__(self, directory, min_size=1024):
+        self.files = {}     # {served name: (bodies by encoding, mimetype, digest, immutable)}
+        self.manifest = {}  # {original name: fingerprinted name}
+        if not os.path.isdir(directory):
+            return
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, directory).replace(os.sep, "/")
+                self.add(filename, path, min_size)
+
+    def add(self, filename, path, min_size):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        bodies = {None: data}
+        if mimetype in COMPRESSIBLE and len(data) >= min_size:
+            bodies["gzip"] = compress(data, "gzip")
+            if brotli is not None:
+                bodies["br"] = compress(data, "br")
+
+        stem, ext = os.path.splitext(filename)
+        fingerprinted = f"{stem}.{digest}{ext}"
+        self.manifest[filename] = fingerprinted
+        self.files[filename] = (bodies, mimetype, digest, False)
+        self.files[fingerprinted] = (bodies, mimetype, digest, True)
+
+    def url_for(self, filename):
+        return self.manifest.get(filename, filename)
+
+    def serve(self, filename):
+        entry = self.files.get(filename)
+        if entry is None:
+            abort(404)
+        bodies, mimetype, digest, immutable = entry
+        headers = {"ETag": f'"{digest}"', "Cache-Control": IMMUTABLE if immutable else "no-cache",
+                   "Vary": "Accept-Encoding"}
+        if f'"{digest}"' in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers=headers)
+
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding not in bodies:
+            encoding = None
+        response = Response(bodies[encoding], mimetype=mimetype, headers=headers)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+# ======================================
+# JSON
+# ======================================
+# json.dumps arguments orjson can honour. jsonify always passes `separators` (orjson's output
+# is compact already) or, for pretty responses, `indent`; anything else falls back to json.
+ORJSON_ARGS = {"separators", "indent", "sort_keys", "default"}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if orjson is None or not kwargs.keys() <= ORJSON_ARGS:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
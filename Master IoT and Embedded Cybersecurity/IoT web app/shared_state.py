@@ -0,0 +1,373 @@
+"""
+Shared-memory live state for multi-process deployments of the IoT web app.
+
+One ingest process (SHARED_STATE=writer) mirrors every device's latest
+values, recent samples and derived state (statistics, firing alerts, last
+relay command) into a fixed-layout shared-memory segment. Any number of
+web worker processes (SHARED_STATE=reader, e.g. under gunicorn) map it
+read-only, so they need no MQTT connection of their own.
+
+Layout (little endian):
+
+    header   magic, layout version, max devices, ring capacity,
+             seq, device count, JSON length, then a JSON area
+             (MQTT status, ingest stats)
+    slot[i]  seq, device id, revision, ring head, ring count,
+             last update, temperature, humidity, relay,
+             JSON length, JSON area (stats, alerts, command),
+             then `capacity` (ts, temperature, humidity, relay) samples
+
+The header and each slot are seqlock-protected: the single writer makes
+the sequence number odd, writes, then makes it even again. Readers copy
+what they need and retry if the number was odd or changed meanwhile, so
+readers never block the writer or each other.
+
+Readers map /dev/shm directly with a read-only mmap, so this mode is
+Linux only. Relay commands, the one thing workers need to send, go to
+the writer over a Unix datagram socket (`CommandClient` / `serve_commands`).
+"""
+
+import os
+import json
+import mmap
+import time
+import socket
+import struct
+import logging
+import threading
+from multiprocessing import shared_memory
+
+from stats import StreamStats
+
+MAGIC = b"PICO"
+LAYOUT_VERSION = 1
+JSON_SIZE = 8192
+
+HEADER = struct.Struct("<4sIIIQQI")
+HEADER_SIZE = 64   # HEADER padded
+HEADER_SEQ = 16    # offset of the header's seq
+HEADER_COUNT = struct.Struct("<QI")  # device count and JSON length, right after seq
+SLOT_META = struct.Struct("<Q64sQQQddddI")
+SLOT_META_SIZE = 136  # SLOT_META padded to 8 bytes
+SAMPLE = struct.Struct("<dddd")
+SEQ = struct.Struct("<Q")
+
+
+def slot_size(capacity):
+    return SLOT_META_SIZE + JSON_SIZE + capacity * SAMPLE.size
+
+
+def slot_offset(index, capacity):
+    return HEADER_SIZE + JSON_SIZE + index * slot_size(capacity)
+
+
+def encode_json(info):
+    data = json.dumps(info, separators=(",", ":")).encode()
+    if len(data) > JSON_SIZE:
+        raise ValueError(f"shared state JSON too large ({len(data)} > {JSON_SIZE} bytes)")
+    return data
+
+
+# ======================================
+# WRITER (ingest process)
+# ======================================
+class SharedStateWriter:
+    def __init__(self, name, max_devices, capacity):
+        self.name = name
+        self.max_devices = max_devices
+        self.capacity = capacity
+        size = slot_offset(max_devices, capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over from an ingest process that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, MAGIC, LAYOUT_VERSION, max_devices, capacity, 0, 0, 0)
+        self.header_length = 0
+        self.slots = {}  # {device id: slot index}
+        self.rings = {}  # {slot index: (head, count, revision)}
+
+    def _begin(self, offset):
+        seq = SEQ.unpack_from(self.buf, offset)[0] + 1
+        SEQ.pack_into(self.buf, offset, seq)  # odd: write in progress
+        return seq
+
+    def _end(self, offset, seq):
+        SEQ.pack_into(self.buf, offset, seq + 1)
+
+    def write_header(self, info):
+        data = encode_json(info)
+        seq = self._begin(HEADER_SEQ)
+        HEADER_COUNT.pack_into(self.buf, HEADER_SEQ + 8, len(self.slots), len(data))
+        self.buf[HEADER_SIZE:HEADER_SIZE + len(data)] = data
+        self._end(HEADER_SEQ, seq)
+        self.header_length = len(data)
+
+    def slot(self, device_id):
+        index = self.slots.get(device_id)
+        if index is None:
+            if len(self.slots) >= self.max_devices:
+                raise ValueError(f"shared state is full ({self.max_devices} devices)")
+            index = self.slots[device_id] = len(self.slots)
+            self.rings[index] = (0, 0, 0)
+
+            # Name the empty slot, then make it visible to readers
+            offset = slot_offset(index, self.capacity)
+            seq = self._begin(offset)
+            SLOT_META.pack_into(self.buf, offset, seq, device_id.encode()[:64], 0, 0, 0, 0, 0, 0, 0, 0)
+            self._end(offset, seq)
+            seq = self._begin(HEADER_SEQ)
+            HEADER_COUNT.pack_into(self.buf, HEADER_SEQ + 8, len(self.slots), self.header_length)
+            self._end(HEADER_SEQ, seq)
+        return index
+
+    def write_device(self, device_id, latest, samples, info, reset=False):
+        """
+        Publishes one device: `latest` is DeviceState.latest(), `samples` the (ts, temp, humidity,
+        relay) samples since the last call, oldest first (with `reset`, the whole ring instead), and
+        `info` a JSON-able dict. Every call bumps the slot's revision, which readers see as the version.
+        """
+        index = self.slot(device_id)
+        offset = slot_offset(index, self.capacity)
+        data = encode_json(info)
+        temperature, humidity, relay, last_update, _ = latest
+        head, count, revision = self.rings[index]
+        if reset:
+            head = count = 0
+        revision += 1
+
+        seq = self._begin(offset)
+        ring = offset + SLOT_META_SIZE + JSON_SIZE
+        for ts, temp, hum, sample_relay in samples[-self.capacity:]:
+            SAMPLE.pack_into(self.buf, ring + head * SAMPLE.size, ts, temp, hum, 1.0 if sample_relay == "ON" else 0.0)
+            head = (head + 1) % self.capacity
+            count = min(count + 1, self.capacity)
+        SLOT_META.pack_into(self.buf, offset, seq, device_id.encode()[:64], revision, head, count,
+                            last_update, temperature, humidity, 1.0 if relay == "ON" else 0.0, len(data))
+        self.buf[offset + SLOT_META_SIZE:offset + SLOT_META_SIZE + len(data)] = data
+        self._end(offset, seq)
+        self.rings[index] = (head, count, revision)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def serve_commands(path, handler):
+    """Receives relay commands from web workers; runs forever, call it on its own thread."""
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    while True:
+        data = sock.recv(4096)
+        try:
+            command = json.loads(data)
+            handler(command["device"], command["state"])
+        except Exception as e:
+            logging.error(f"Bad relay command from a web worker: {e}")
+
+
+# ======================================
+# READER (web workers)
+# ======================================
+class SharedDevice:
+    """Read-only view of one device with the same read methods as devices.DeviceState."""
+
+    def __init__(self, reader, device_id, index):
+        self.reader = reader
+        self.device_id = device_id
+        self.index = index
+
+    def _meta(self):
+        buf, offset = self.reader.buf, slot_offset(self.index, self.reader.capacity)
+        return self.reader.read(offset, lambda: SLOT_META.unpack_from(buf, offset))
+
+    def latest(self):
+        """(temperature, humidity, relay, last_update, version)."""
+        _, _, version, _, _, last_update, temperature, humidity, relay, _ = self._meta()
+        return temperature, humidity, "ON" if relay else "OFF", last_update, version
+
+    def info(self):
+        buf, offset = self.reader.buf, slot_offset(self.index, self.reader.capacity)
+
+        def copy():
+            length = SLOT_META.unpack_from(buf, offset)[-1]
+            return bytes(buf[offset + SLOT_META_SIZE:offset + SLOT_META_SIZE + length])
+        data = self.reader.read(offset, copy)
+        return json.loads(data) if data else {}
+
+    def stats_snapshot(self):
+        stats = self.info().get("stats")
+        if stats is None:
+            now = time.time()
+            stats = {"temperature": StreamStats().read(now), "humidity": StreamStats().read(now)}
+        return stats
+
+    def samples_since(self, start, limit=None):
+        """Samples newer than `start`, oldest first, or None if the ring has already dropped some of them."""
+        capacity = self.reader.capacity
+        buf, offset = self.reader.buf, slot_offset(self.index, capacity)
+        ring = offset + SLOT_META_SIZE + JSON_SIZE
+
+        def copy():
+            head, count = SLOT_META.unpack_from(buf, offset)[3:5]
+            return head, count, bytes(buf[ring:ring + capacity * SAMPLE.size])
+        head, count, data = self.reader.read(offset, copy)
+
+        if count == capacity and start is not None and SAMPLE.unpack_from(data, head * SAMPLE.size)[0] > start:
+            return None
+        rows = []
+        i = head
+        for _ in range(min(count, limit or count)):
+            i = (i - 1) % capacity
+            ts, temp, humidity, relay = SAMPLE.unpack_from(data, i * SAMPLE.size)
+            if start is not None and ts <= start:
+                break
+            rows.append((ts, temp, humidity, "ON" if relay else "OFF"))
+        rows.reverse()
+        return rows
+
+
+class SharedStateReader:
+    """
+    Until the ingest process has created its segment, a reader is detached: it shows no
+    devices and a disconnected header, and refresh() attaches once the segment appears.
+    """
+
+    def __init__(self, name):
+        self.path = os.path.join("/dev/shm", name)
+        self.buf = None
+        self.inode = None
+        self.devices = {}  # {device id: SharedDevice}
+        self.lock = threading.Lock()
+        if not self.attach():
+            logging.warning(f"No shared state at {self.path} yet, waiting for the ingest process")
+
+    def attach(self):
+        """Maps the segment; False if it does not exist or the writer has not initialised it yet."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER_SIZE:
+                return False  # created but not sized yet
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, max_devices, capacity = HEADER.unpack_from(buf, 0)[:4]
+        if magic == bytes(len(MAGIC)):
+            buf.close()
+            return False  # header not written yet
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            buf.close()
+            raise ValueError(f"{self.path} is not a layout {LAYOUT_VERSION} shared state segment")
+        with self.lock:
+            self.buf, self.inode = buf, stat.st_ino
+            self.max_devices, self.capacity = max_devices, capacity
+            self.devices = {}
+        return True
+
+    def refresh(self):
+        """Maps the segment once it appears, and re-maps it if the ingest process was restarted."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+        if inode != self.inode:
+            return self.attach()
+        return False
+
+    def read(self, offset, copy):
+        """Runs `copy()` until it sees a consistent snapshot of the seqlock-protected region at `offset`."""
+        buf = self.buf
+        for attempt in range(10000):
+            before = SEQ.unpack_from(buf, offset)[0]
+            if not before & 1:
+                value = copy()
+                if SEQ.unpack_from(buf, offset)[0] == before:
+                    return value
+            if attempt > 100:
+                time.sleep(0.0001)
+        raise TimeoutError("shared state writer did not finish an update")
+
+    def header(self):
+        """(device count, header info dict); (0, {}) while detached."""
+        buf = self.buf
+        if buf is None:
+            return 0, {}
+
+        def copy():
+            count, length = HEADER_COUNT.unpack_from(buf, HEADER_SEQ + 8)
+            return count, bytes(buf[HEADER_SIZE:HEADER_SIZE + length])
+        count, data = self.read(HEADER_SEQ, copy)
+        return count, json.loads(data) if data else {}
+
+    def stats(self):
+        """The writer's ingest stats, same keys as IngestPipeline.stats()."""
+        return self.header()[1].get("ingest", {"queue_depth": 0, "queue_capacity": 0})
+
+    def _load_ids(self, count):
+        # Caller holds self.lock
+        for index in range(len(self.devices), count):
+            offset = slot_offset(index, self.capacity)
+            raw = self.read(offset, lambda: SLOT_META.unpack_from(self.buf, offset)[1])
+            device_id = raw.rstrip(b"\0").decode()
+            self.devices[device_id] = SharedDevice(self, device_id, index)
+
+    def ids(self):
+        count = self.header()[0]
+        with self.lock:
+            if count != len(self.devices):
+                self._load_ids(count)
+            return sorted(self.devices)
+
+    def get(self, device_id):
+        device = self.devices.get(device_id)
+        if device is None and device_id not in self.ids():
+            return None
+        return self.devices[device_id]
+
+
+class SharedAlerts:
+    """The read side of alerts.AlertEngine, backed by the writer's per-device info."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def active(self, device=None):
+        ids = [device] if device is not None else self.reader.ids()
+        events = []
+        for device_id in ids:
+            state = self.reader.get(device_id)
+            if state is not None:
+                events.extend(state.info().get("alerts", []))
+        return sorted(events, key=lambda e: (-e["rank"], e["device"], e["rule"]))
+
+    def version(self, device):
+        state = self.reader.get(device)
+        return state.info().get("alert_version", 0) if state is not None else 0
+
+    def firing_counts(self):
+        return [((severity,), n) for severity, n in self.reader.header()[1].get("alerts_firing", {}).items()]
+
+
+class CommandClient:
+    """The side of commands.RelayCommands a web worker needs: requests go to the writer, status comes back via shared memory."""
+
+    def __init__(self, reader, path):
+        self.reader = reader
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def request(self, device_id, state):
+        self.sock.sendto(json.dumps({"device": device_id, "state": state}).encode(), self.path)
+
+    def status(self, device_id):
+        state = self.reader.get(device_id)
+        return state.info().get("command") if state is not None else None
@@ -0,0 +1,61 @@
+"""
+Single-flight snapshot cache for the IoT web app.
+
+Holds one computed value per key (e.g. per device) together with the
+version it was computed for. The first caller that asks for a new version
+computes it; callers arriving while that computation is running wait for
+its result instead of repeating the work.
+"""
+
+import threading
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}   # {key: (version, value)}
+        self.flights = {}   # {(key, version): _Flight}
+        self.computed = 0   # how many times compute() actually ran
+
+    def get(self, key, version, compute):
+        """
+        Value for `key` at `version`. `compute(previous)` builds it from the
+        previous cached value (None the first time) and runs at most once
+        per (key, version).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+            flight = self.flights.get((key, version))
+            leader = flight is None
+            if leader:
+                flight = self.flights[(key, version)] = _Flight()
+                previous = entry[1] if entry is not None else None
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute(previous)
+            with self.lock:
+                self.entries[key] = (version, flight.value)
+                self.computed += 1
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[(key, version)]
+            flight.done.set()
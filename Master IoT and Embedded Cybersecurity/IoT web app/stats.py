@@ -0,0 +1,105 @@
+"""
+Streaming statistics per sensor stream for the IoT web app.
+
+Every update is O(1):
+  - all-time count, min, max, mean and variance (Welford's algorithm)
+  - an exponentially weighted moving average (EWMA)
+  - 1 min / 1 h / 24 h windows, each a ring of fixed-width buckets that
+    are reset as the window slides past them
+
+Reading a window sums its buckets (at most a few dozen), so no raw
+history is ever rescanned.
+"""
+
+import math
+
+EWMA_ALPHA = 0.1
+
+# name: (window seconds, number of buckets)
+WINDOWS = {"1m": (60, 12), "1h": (3600, 60), "24h": (86400, 96)}
+
+
+def summary(count, total, total_sq, lo, hi):
+    if not count:
+        return {"count": 0, "min": None, "max": None, "mean": None, "std": None}
+    mean = total / count
+    variance = max(total_sq / count - mean * mean, 0.0)
+    return {"count": count, "min": lo, "max": hi, "mean": mean, "std": math.sqrt(variance)}
+
+
+# ======================================
+# WINDOWED ACCUMULATOR
+# ======================================
+class WindowedStats:
+    def __init__(self, window, buckets):
+        self.width = window / buckets
+        self.ids = [None] * buckets  # which time slot each bucket currently holds
+        self.count = [0] * buckets
+        self.total = [0.0] * buckets
+        self.total_sq = [0.0] * buckets
+        self.min = [0.0] * buckets
+        self.max = [0.0] * buckets
+
+    def add(self, ts, value):
+        slot_id = int(ts // self.width)
+        i = slot_id % len(self.ids)
+        if self.ids[i] != slot_id:
+            self.ids[i] = slot_id
+            self.count[i] = 0
+            self.total[i] = self.total_sq[i] = 0.0
+            self.min[i] = self.max[i] = value
+        self.count[i] += 1
+        self.total[i] += value
+        self.total_sq[i] += value * value
+        self.min[i] = min(self.min[i], value)
+        self.max[i] = max(self.max[i], value)
+
+    def read(self, now):
+        oldest = int(now // self.width) - len(self.ids) + 1
+        count, total, total_sq, lo, hi = 0, 0.0, 0.0, math.inf, -math.inf
+        for i, slot_id in enumerate(self.ids):
+            if slot_id is None or slot_id < oldest:
+                continue
+            count += self.count[i]
+            total += self.total[i]
+            total_sq += self.total_sq[i]
+            lo = min(lo, self.min[i])
+            hi = max(hi, self.max[i])
+        return summary(count, total, total_sq, lo, hi)
+
+
+# ======================================
+# STREAM STATISTICS
+# ======================================
+class StreamStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean (Welford)
+        self.min = math.inf
+        self.max = -math.inf
+        self.ewma = None
+        self.windows = {name: WindowedStats(*spec) for name, spec in WINDOWS.items()}
+
+    def add(self, ts, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.ewma = value if self.ewma is None else self.ewma + EWMA_ALPHA * (value - self.ewma)
+        for window in self.windows.values():
+            window.add(ts, value)
+
+    def read(self, now):
+        if self.count:
+            overall = {"count": self.count, "min": self.min, "max": self.max, "mean": self.mean,
+                       "std": math.sqrt(self.m2 / self.count)}
+        else:
+            overall = summary(0, 0, 0, None, None)
+        return {
+            "all": overall,
+            "ewma": self.ewma,
+            "windows": {name: window.read(now) for name, window in self.windows.items()},
+        }
@@ -0,0 +1,327 @@
+"""
+Time-series storage engines for the IoT web app.
+
+Samples are (device, timestamp, temperature, humidity, relay). Every engine
+supports range queries by device and time, plus hourly/daily rollups that
+are updated as samples arrive, so nothing has to rescan raw history.
+
+    SQLiteStore - durable append log (SQLite in WAL mode, batched inserts)
+    MemoryStore - bounded in-memory store, nothing survives a restart
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+
+from metrics import TimedLock
+
+# ======================================
+# ROLLUPS
+# ======================================
+ROLLUP_PERIODS = {"hour": 3600, "day": 86400}
+
+
+def new_rollup():
+    # [count, temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max]
+    return [0, 0.0, float("inf"), float("-inf"), 0.0, float("inf"), float("-inf")]
+
+
+def add_to_rollup(acc, temp, humidity):
+    acc[0] += 1
+    acc[1] += temp
+    acc[2] = min(acc[2], temp)
+    acc[3] = max(acc[3], temp)
+    acc[4] += humidity
+    acc[5] = min(acc[5], humidity)
+    acc[6] = max(acc[6], humidity)
+
+
+def rollup_row(bucket, acc):
+    count = acc[0]
+    return {
+        "bucket": bucket,
+        "count": count,
+        "temp_avg": acc[1] / count,
+        "temp_min": acc[2],
+        "temp_max": acc[3],
+        "humidity_avg": acc[4] / count,
+        "humidity_min": acc[5],
+        "humidity_max": acc[6],
+    }
+
+
+# ======================================
+# IN-MEMORY ENGINE
+# ======================================
+class MemoryStore:
+    """Keeps the last `max_samples` samples per device; lost on restart."""
+
+    def __init__(self, max_samples=5000):
+        self.max_samples = max_samples
+        self.samples = {}   # {device: deque of (ts, temp, humidity, relay)}
+        self.rollups = {}   # {(device, period, bucket): accumulator}
+        self.lock = threading.Lock()
+
+    def append(self, device, ts, temp, humidity, relay):
+        self.append_many([(device, ts, temp, humidity, relay)])
+
+    def append_many(self, rows):
+        """Appends (device, ts, temp, humidity, relay) rows under one lock acquisition."""
+        with self.lock:
+            for device, ts, temp, humidity, relay in rows:
+                history = self.samples.get(device)
+                if history is None:
+                    history = self.samples[device] = deque(maxlen=self.max_samples)
+                history.append((ts, temp, humidity, relay))
+                for period, size in ROLLUP_PERIODS.items():
+                    key = (device, period, int(ts // size) * size)
+                    acc = self.rollups.get(key)
+                    if acc is None:
+                        acc = self.rollups[key] = new_rollup()
+                    add_to_rollup(acc, temp, humidity)
+
+    def query(self, device, start=None, end=None, limit=None):
+        """Samples for `device` with start < ts <= end, oldest first."""
+        with self.lock:
+            history = list(self.samples.get(device, ()))
+        rows = [s for s in history
+                if (start is None or s[0] > start) and (end is None or s[0] <= end)]
+        return rows[-limit:] if limit else rows
+
+    def iter_query(self, device, start=None, end=None, chunk_size=1000):
+        """Like query(), as lists of at most `chunk_size` samples."""
+        rows = self.query(device, start, end)  # bounded by max_samples
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+    def query_rollups(self, device, period, start=None, end=None):
+        with self.lock:
+            items = [(key[2], list(acc)) for key, acc in self.rollups.items()
+                     if key[0] == device and key[1] == period]
+        return [rollup_row(bucket, acc) for bucket, acc in sorted(items)
+                if (start is None or bucket >= start) and (end is None or bucket <= end)]
+
+    def devices(self):
+        with self.lock:
+            return sorted(self.samples)
+
+    def close(self):
+        pass
+
+
+# ======================================
+# SQLITE ENGINE
+# ======================================
+class SQLiteStore:
+    """
+    Durable append log. `append` only buffers the sample and updates the
+    in-memory rollup deltas (O(1)); a writer thread commits the buffer in one
+    transaction every `flush_interval` seconds or once `batch_size` samples
+    are waiting. Readers use their own connections, which WAL mode lets run
+    alongside the writer.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pending = []          # samples not yet committed
+        self.inflight = []         # samples the writer is committing right now
+        self.pending_rollups = {}  # {(device, period, bucket): accumulator delta}
+        self.lock = TimedLock("store")
+        self.wakeup = threading.Event()
+        self.local = threading.local()
+        self.closed = False
+
+        self.writer = self.connect()
+        self.writer.executescript("""
+            CREATE TABLE IF NOT EXISTS samples (
+                device TEXT NOT NULL,
+                ts REAL NOT NULL,
+                temperature REAL,
+                humidity REAL,
+                relay TEXT
+            );
+            CREATE INDEX IF NOT EXISTS samples_device_ts ON samples (device, ts);
+            CREATE TABLE IF NOT EXISTS rollups (
+                device TEXT NOT NULL,
+                period TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                temp_sum REAL, temp_min REAL, temp_max REAL,
+                hum_sum REAL, hum_min REAL, hum_max REAL,
+                PRIMARY KEY (device, period, bucket)
+            );
+        """)
+
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def reader(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        return conn
+
+    # ---------- ingest ----------
+    def append(self, device, ts, temp, humidity, relay):
+        self.append_many([(device, ts, temp, humidity, relay)])
+
+    def append_many(self, rows):
+        """Buffers (device, ts, temp, humidity, relay) rows under one lock acquisition."""
+        with self.lock:
+            self.pending.extend(rows)
+            for device, ts, temp, humidity, relay in rows:
+                for period, size in ROLLUP_PERIODS.items():
+                    key = (device, period, int(ts // size) * size)
+                    acc = self.pending_rollups.get(key)
+                    if acc is None:
+                        acc = self.pending_rollups[key] = new_rollup()
+                    add_to_rollup(acc, temp, humidity)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def writer_loop(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Store flush failed: {e}")
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, []
+            rollups, self.pending_rollups = self.pending_rollups, {}
+            self.inflight = rows
+        if not rows:
+            return
+
+        try:
+            self.commit(rows, rollups)
+        finally:
+            with self.lock:
+                self.inflight = []
+
+    def commit(self, rows, rollups):
+        with self.writer:
+            self.writer.executemany(
+                "INSERT INTO samples (device, ts, temperature, humidity, relay) VALUES (?, ?, ?, ?, ?)", rows)
+            self.writer.executemany("""
+                INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (device, period, bucket) DO UPDATE SET
+                    count = count + excluded.count,
+                    temp_sum = temp_sum + excluded.temp_sum,
+                    temp_min = MIN(temp_min, excluded.temp_min),
+                    temp_max = MAX(temp_max, excluded.temp_max),
+                    hum_sum = hum_sum + excluded.hum_sum,
+                    hum_min = MIN(hum_min, excluded.hum_min),
+                    hum_max = MAX(hum_max, excluded.hum_max)
+            """, [(*key, *acc) for key, acc in rollups.items()])
+
+    # ---------- queries ----------
+    def query(self, device, start=None, end=None, limit=None):
+        """Samples for `device` with start < ts <= end, oldest first."""
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+
+        # Samples still waiting for the writer are newer than anything on disk. They are
+        # copied before reading the database, so a flush finishing in between can only
+        # cause overlap, which is dropped below, never a gap.
+        with self.lock:
+            buffered = [row[1:] for row in self.inflight + self.pending
+                        if row[0] == device and start < row[1] <= end]
+
+        sql = "SELECT ts, temperature, humidity, relay FROM samples WHERE device = ? AND ts > ? AND ts <= ? ORDER BY ts DESC"
+        params = [device, start, end]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self.reader().execute(sql, params).fetchall()
+        rows.reverse()
+        newest = rows[-1][0] if rows else float("-inf")
+        rows.extend(row for row in buffered if row[0] > newest)
+        return rows[-limit:] if limit else rows
+
+    def iter_query(self, device, start=None, end=None, chunk_size=1000):
+        """
+        Like query(), as lists of at most `chunk_size` samples, for exports of any size. Pages by
+        timestamp with a fresh query per chunk, so no read transaction stays open between chunks.
+        """
+        start = float("-inf") if start is None else start
+        end = float("inf") if end is None else end
+        # (ts, rowid) keyset, so samples sharing a timestamp are not split or lost at a page boundary
+        sql = ("SELECT rowid, ts, temperature, humidity, relay FROM samples "
+               "WHERE device = ? AND (ts, rowid) > (?, ?) AND ts <= ? ORDER BY ts, rowid LIMIT ?")
+        position = [start, -1]
+        conn = self.connect()
+
+        def pages():
+            while True:
+                rows = conn.execute(sql, (device, *position, end, chunk_size)).fetchall()
+                if not rows:
+                    return
+                position[:] = rows[-1][1], rows[-1][0]
+                yield [row[1:] for row in rows]
+
+        try:
+            yield from pages()
+            # Then what the writer has not committed yet. As in query(), it is copied before
+            # a last pass over the database picks up anything flushed in the meantime.
+            with self.lock:
+                buffered = sorted(row[1:] for row in self.inflight + self.pending
+                                  if row[0] == device and position[0] < row[1] <= end)
+            yield from pages()
+        finally:
+            conn.close()
+
+        buffered = [row for row in buffered if row[0] > position[0]]
+        for i in range(0, len(buffered), chunk_size):
+            yield buffered[i:i + chunk_size]
+
+    def query_rollups(self, device, period, start=None, end=None):
+        rows = self.reader().execute("""
+            SELECT bucket, count, temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max
+            FROM rollups WHERE device = ? AND period = ? AND bucket >= ? AND bucket <= ?
+            ORDER BY bucket
+        """, (device, period, start if start is not None else 0,
+              end if end is not None else time.time())).fetchall()
+        return [rollup_row(row[0], list(row[1:])) for row in rows]
+
+    def devices(self):
+        with self.lock:
+            buffered = {row[0] for row in self.inflight + self.pending}
+        rows = self.reader().execute("SELECT DISTINCT device FROM samples").fetchall()
+        return sorted(buffered.union(row[0] for row in rows))
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.flush()
+        self.writer.close()
+
+
+# ======================================
+# FACTORY
+# ======================================
+def open_store(engine, path):
+    if engine == "sqlite":
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteStore(path)
+    if engine == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown storage engine: {engine}")
@@ -0,0 +1,100 @@
+"""
+Bounded login throttling for the IoT web app.
+
+Failed attempts are counted per key (a username or a client IP) in an
+OrderedDict kept in least-recently-updated order. Every operation is O(1):
+entries expire `ttl` seconds after their last failure, expired entries are
+pruned from the old end as new ones arrive, and once `max_entries` is
+reached the least recently updated entry is evicted, so memory stays
+constant under a flood of distinct usernames.
+
+A key that reaches its limit moves to a separate map of lockouts, in lock
+time order, also capped at `max_entries`. Lockouts are never evicted to
+make room, only dropped once they expire, so a flood of other usernames
+cannot lift one. When that map is full the throttle fails closed:
+full_for() reports how long until the oldest lockout expires, and logins
+are refused until then.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LoginThrottle:
+    def __init__(self, lockout_time, max_entries=10000):
+        self.lockout_time = lockout_time
+        self.ttl = lockout_time
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # {key: [count, updated]} for keys not locked
+        self.lockouts = OrderedDict()  # {key: lock_time}, oldest first
+        self.lock = threading.Lock()
+
+    def prune(self, now):
+        # Oldest entries sit at the front of both maps; stop at the first one still alive
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry[1] < self.ttl:
+                break
+            self.entries.popitem(last=False)
+        while self.lockouts:
+            key, lock_time = next(iter(self.lockouts.items()))
+            if now - lock_time < self.lockout_time:
+                break
+            self.lockouts.popitem(last=False)
+
+    def full_for(self):
+        """Seconds until the lockout map has room again, 0 if it is not full."""
+        now = time.time()
+        with self.lock:
+            self.prune(now)
+            if len(self.lockouts) < self.max_entries:
+                return 0
+            oldest = next(iter(self.lockouts.values()))
+            return max(1, int(self.lockout_time - (now - oldest)))
+
+    def locked_for(self, key):
+        """Seconds left on the lockout for `key`, 0 if it is not locked."""
+        now = time.time()
+        with self.lock:
+            lock_time = self.lockouts.get(key)
+            if lock_time is None:
+                return 0
+            remaining = self.lockout_time - (now - lock_time)
+            if remaining <= 0:
+                del self.lockouts[key]
+                return 0
+            return int(remaining)
+
+    def record_failure(self, key, max_attempts):
+        """Counts a failed attempt; returns (attempts, locked)."""
+        now = time.time()
+        with self.lock:
+            self.prune(now)
+            if key in self.lockouts:
+                return max_attempts, True  # already locked; the lockout is not extended
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = [0, now]
+                while len(self.entries) >= self.max_entries:
+                    self.entries.popitem(last=False)
+            entry[0] += 1
+            entry[1] = now
+            if entry[0] >= max_attempts:
+                if len(self.lockouts) < self.max_entries:
+                    self.lockouts[key] = now
+                    return entry[0], True
+                entry[0] = max_attempts  # no room to lock it: kept at the limit, full_for() refuses logins
+                self.entries[key] = entry
+                return entry[0], True
+            self.entries[key] = entry
+            return entry[0], False
+
+    def reset(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.lockouts.pop(key, None)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries) + len(self.lockouts)
@@ -0,0 +1,485 @@
+"""
+Fan-out benchmark for the Socket.IO dashboard in "IoT Dashboard/app.py".
+
+For every combination of --clients and --rates it starts the app (eventlet)
+against the local MQTT broker stand-in (mqtt_broker.py), connects that many
+simulated browsers over WebSocket, publishes readings for --devices devices
+at the given total rate for --duration seconds, and reports:
+
+  - readings and frames delivered per second, across all clients
+  - per-reading delivery latency, publish -> browser (p50/p90/p99/max)
+  - hub CPU (% of one core, and ms per 1000 delivered readings)
+  - hub memory per connection (RSS growth while connecting / clients)
+  - the broadcaster's own counters (coalesced, skipped, ...)
+
+The simulated browsers behave like index.html: they subscribe while
+connecting, acknowledge every update_batch frame and decode the binary
+wire format. They are spread over --workers processes so the load
+generator is not the bottleneck. Everything runs on localhost.
+
+    ./run.sh bench/dashboard_fanout.py --clients 100,1000,3000 --rates 50,500 --devices 50 --duration 15
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import resource
+import subprocess
+import http.client
+import multiprocessing
+
+from mqtt_broker import Broker
+from mqtt_codec import connect_packet, publish_packet
+
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IoT Dashboard")
+LATENCY_SAMPLES = 100000  # per worker; reservoir sampled beyond that
+
+
+# ======================================
+# HELPERS
+# ======================================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("GET", path)
+    return json.loads(conn.getresponse().read())
+
+
+def raise_fd_limit():
+    # Thousands of sockets on both ends; the app inherits the limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ======================================
+# MINIMAL WEBSOCKET CLIENT
+# ======================================
+async def ws_connect(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in head.split(b"\r\n", 1)[0]:
+        raise ConnectionError(head.split(b"\r\n", 1)[0].decode())
+    return reader, writer
+
+
+def ws_send(writer, data, opcode=1):
+    if isinstance(data, str):
+        data = data.encode()
+    mask = os.urandom(4)
+    n = len(data)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, 0x80 | n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, n)
+    masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    writer.write(header + mask + masked)
+
+
+async def ws_recv(reader):
+    """(opcode, payload) of the next complete message."""
+    payload, opcode = b"", None
+    while True:
+        b1, b2 = await reader.readexactly(2)
+        n = b2 & 0x7F
+        if n == 126:
+            n = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack("!Q", await reader.readexactly(8))[0]
+        data = await reader.readexactly(n)
+        if b1 & 0x0F == 8:
+            raise ConnectionError("WebSocket closed by the server")
+        if b1 & 0x0F:
+            opcode = b1 & 0x0F
+        payload += data
+        if b1 & 0x80:
+            return opcode, payload
+
+
+# ======================================
+# SIMULATED BROWSERS
+# ======================================
+def decode_binary(buffer, device_ids, schemas):
+    """Mirror of wire.py / index.html's decodeBatch."""
+    count = struct.unpack_from("<H", buffer, 1)[0]
+    pos, batch = 3, {}
+    for _ in range(count):
+        index, schema_id = struct.unpack_from("<HH", buffer, pos)
+        pos += 4
+        reading = {}
+        for name, kind in schemas[str(schema_id)]:
+            if kind == "?":
+                reading[name] = buffer[pos] == 1
+                pos += 1
+            elif kind == "i":
+                reading[name] = struct.unpack_from("<i", buffer, pos)[0]
+                pos += 4
+            elif kind == "f":
+                reading[name] = struct.unpack_from("<f", buffer, pos)[0]
+                pos += 4
+            elif kind == "s":
+                n = buffer[pos]
+                reading[name] = buffer[pos + 1:pos + 1 + n].decode()
+                pos += 1 + n
+            else:
+                n = struct.unpack_from("<H", buffer, pos)[0]
+                reading[name] = json.loads(buffer[pos + 2:pos + 2 + n])
+                pos += 2 + n
+        batch[device_ids[index]] = reading
+    return batch
+
+
+class SimulatedBrowser:
+    def __init__(self, port, auth, epoch, results):
+        self.port = port
+        self.auth = auth
+        self.epoch = epoch
+        self.results = results
+        self.device_ids = []
+        self.schemas = {}
+
+    async def run(self, connected, stop):
+        reader, writer = await ws_connect(self.port, "/socket.io/?EIO=4&transport=websocket")
+        try:
+            opcode, data = await ws_recv(reader)  # Engine.IO open
+            ws_send(writer, "40" + json.dumps(self.auth))
+            binary_event = None  # (ack id, event name, attachments expected, attachments so far)
+            while not stop.is_set():
+                opcode, data = await ws_recv(reader)
+                if opcode == 2:
+                    ack_id, event, expected, parts = binary_event
+                    parts.append(data)
+                    if len(parts) == expected:
+                        self.handle(event, parts[0])  # the dashboard only sends single-attachment frames
+                        self.ack(writer, ack_id)
+                        binary_event = None
+                    continue
+                text = data.decode()
+                if text == "2":
+                    ws_send(writer, "3")  # ping -> pong
+                elif text.startswith("40"):
+                    connected()
+                elif text.startswith("42"):
+                    ack_id, args = split_ack(text[2:])
+                    self.handle(args[0], args[1] if len(args) > 1 else None)
+                    self.ack(writer, ack_id)
+                elif text.startswith("45"):
+                    expected, rest = text[2:].split("-", 1)
+                    ack_id, args = split_ack(rest)
+                    binary_event = (ack_id, args[0], int(expected), [])
+                elif text.startswith("1"):
+                    return
+        finally:
+            writer.close()
+
+    def ack(self, writer, ack_id):
+        if ack_id is not None:
+            ws_send(writer, f"43{ack_id}[]")
+
+    def handle(self, event, data):
+        if event == "snapshot":
+            self.device_ids = data["devices"]
+            self.schemas.update(data["schemas"])
+        elif event == "devices":
+            self.device_ids = data
+        elif event == "schemas":
+            self.schemas.update(data)
+        elif event == "update_batch":
+            if isinstance(data, bytes):
+                size = len(data)
+                data = decode_binary(data, self.device_ids, self.schemas)
+            else:
+                size = len(json.dumps(data))
+            self.results.frame(data, size, (time.time() - self.epoch) * 1000)
+
+
+def split_ack(text):
+    """("123", [...]) for '123["event", ...]', (None, [...]) without an ack id."""
+    i = 0
+    while i < len(text) and text[i].isdigit():
+        i += 1
+    return (text[:i] or None), json.loads(text[i:])
+
+
+class Results:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.readings = 0
+        self.bytes = 0
+        self.latencies = []
+        self.seen = 0
+
+    def frame(self, batch, size, now_ms):
+        self.frames += 1
+        self.bytes += size
+        for reading in batch.values():
+            if not isinstance(reading, dict) or "sent_ms" not in reading:
+                continue
+            self.readings += 1
+            self.seen += 1
+            latency = now_ms - reading["sent_ms"]
+            if len(self.latencies) < LATENCY_SAMPLES:
+                self.latencies.append(latency)
+            else:
+                slot = random.randrange(self.seen)
+                if slot < LATENCY_SAMPLES:
+                    self.latencies[slot] = latency
+
+
+def client_worker(port, auths, epoch, connected, measuring, stop, out):
+    # One process's share of the browsers, all on one event loop
+    raise_fd_limit()
+
+    async def main():
+        results = Results()
+        stopping = asyncio.Event()
+        failures = 0
+
+        def mark_connected():
+            with connected.get_lock():
+                connected.value += 1
+
+        async def browser(auth):
+            nonlocal failures
+            try:
+                await SimulatedBrowser(port, auth, epoch, results).run(mark_connected, stopping)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                failures += 1
+
+        tasks = []
+        for i, auth in enumerate(auths):
+            tasks.append(asyncio.create_task(browser(auth)))
+            if i % 50 == 49:
+                await asyncio.sleep(0.05)  # don't flood the accept backlog
+        while not measuring.is_set():
+            await asyncio.sleep(0.05)
+        results.reset()  # only count what arrives while publishing
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+        stopping.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        out.put({"frames": results.frames, "readings": results.readings, "bytes": results.bytes,
+                 "latencies": results.latencies, "failures": failures})
+
+    asyncio.run(main())
+
+
+# ======================================
+# SIMULATED PICOS
+# ======================================
+async def publish(port, devices, rate, duration, epoch):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(connect_packet("fanout-bench"))
+    await reader.readexactly(4)  # CONNACK
+
+    sent = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < duration:
+        due = int(elapsed * rate) + 1
+        while sent < due:
+            device_id = devices[sent % len(devices)]
+            # relay_dht_mqtt_robust.py's payload plus the publish time, for the latency
+            payload = {"temperature": round(random.uniform(18, 45), 1), "humidity": round(random.uniform(30, 90), 1),
+                       "relay": random.choice(("ON", "OFF")), "sent_ms": int((time.time() - epoch) * 1000)}
+            writer.write(publish_packet(f"pico/{device_id}/data", json.dumps(payload).encode()))
+            sent += 1
+        await writer.drain()
+        await asyncio.sleep(min(0.01, max(0.0, (sent / rate) - (time.perf_counter() - start))))
+    writer.close()
+    return sent
+
+
+# ======================================
+# RUN
+# ======================================
+def wait_for_http(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"App exited early with code {proc.returncode}")
+        try:
+            return get_json(port, "/stats")
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("App did not start listening in time")
+
+
+async def scenario(args, clients, rate):
+    broker = Broker()
+    mqtt_port = await broker.start()
+    http_port = free_port()
+    env = dict(os.environ, MQTT_BROKER="127.0.0.1", MQTT_PORT=str(mqtt_port), PORT=str(http_port), DEBUG="0",
+               WIRE_FORMAT=args.wire, BROADCAST_INTERVAL=str(args.interval), INGEST_MODE=args.ingest)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [COMMON_DIR, env.get("PYTHONPATH")]))
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=APP_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    workers = []
+    try:
+        await asyncio.to_thread(wait_for_http, http_port, proc)
+        while not broker.subscriptions:
+            await asyncio.sleep(0.1)
+        devices = [f"bench{i:04d}" for i in range(args.devices)]
+        epoch = time.time()
+
+        # Every device once, so browsers subscribing to single devices have something to subscribe to
+        await publish(mqtt_port, devices, len(devices) * 10, 0.1, epoch)
+        await asyncio.sleep(0.5)
+        rss_base = rss_mb(proc.pid)
+
+        if args.subscribe == "all":
+            auths = [{"groups": ["*"]}] * clients
+        else:
+            auths = [{"devices": [random.choice(devices)]} for _ in range(clients)]
+        ctx = multiprocessing.get_context("spawn")
+        connected, measuring, stop, out = ctx.Value("i", 0), ctx.Event(), ctx.Event(), ctx.Queue()
+        n = max(1, min(args.workers, clients))
+        for i in range(n):
+            worker = ctx.Process(target=client_worker, daemon=True,
+                                 args=(http_port, auths[i::n], epoch, connected, measuring, stop, out))
+            worker.start()
+            workers.append(worker)
+
+        deadline = time.time() + args.connect_timeout
+        while connected.value < clients and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        connect_time = args.connect_timeout - max(0.0, deadline - time.time())
+        await asyncio.sleep(0.5)
+        rss_connected = rss_mb(proc.pid)
+
+        before = get_json(http_port, "/stats")
+        cpu_start = cpu_seconds(proc.pid)
+        measuring.set()
+        started = time.perf_counter()
+        published = await publish(mqtt_port, devices, rate, args.duration, epoch)
+        await asyncio.sleep(max(1.0, 3 * args.interval))  # last ticks and acks
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(proc.pid) - cpu_start
+        after = get_json(http_port, "/stats")
+        rss_peak = rss_mb(proc.pid)
+
+        stop.set()
+        results = [await asyncio.to_thread(out.get, True, 60) for _ in workers]
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        proc.terminate()
+        proc.wait(timeout=10)
+        await broker.stop()
+
+    latencies = [x for r in results for x in r["latencies"]]
+    readings = sum(r["readings"] for r in results)
+    frames = sum(r["frames"] for r in results)
+    connected_clients = connected.value
+    return {
+        "clients": clients,
+        "connected": connected_clients,
+        "connect_s": round(connect_time, 2),
+        "rate": rate,
+        "published": published,
+        "delivered_per_s": round(readings / elapsed, 1),
+        "frames_per_s": round(frames / elapsed, 1),
+        "kb_per_s": round(sum(r["bytes"] for r in results) / elapsed / 1024, 1),
+        "offered_per_s": round(published / elapsed * (connected_clients if args.subscribe == "all"
+                                                       else connected_clients / args.devices), 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p90_ms": round(percentile(latencies, 90), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies, default=0), 1),
+        "hub_cpu_pct": round(cpu / elapsed * 100, 1),
+        "cpu_ms_per_1k": round(cpu * 1e6 / readings, 2) if readings else None,
+        "kb_per_conn": round((rss_connected - rss_base) * 1024 / connected_clients, 1) if connected_clients else None,
+        "rss_peak_mb": round(rss_peak, 1),
+        "coalesced": after["coalesced"] - before["coalesced"],
+        "skipped": after["skipped"] - before["skipped"],
+        "failures": sum(r["failures"] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="100,1000", help="comma-separated simulated browser counts")
+    parser.add_argument("--rates", default="50,500", help="comma-separated total publish rates (messages/s)")
+    parser.add_argument("--devices", type=int, default=20, help="simulated Picos the messages are spread over")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to publish for, per scenario")
+    parser.add_argument("--subscribe", default="all", choices=["all", "one"],
+                        help="each browser subscribes to every device, or to one random device")
+    parser.add_argument("--wire", default="json", choices=["json", "binary"], help="the app's WIRE_FORMAT")
+    parser.add_argument("--ingest", default="green", choices=["green", "thread"], help="the app's INGEST_MODE")
+    parser.add_argument("--interval", type=float, default=0.1, help="the app's BROADCAST_INTERVAL")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="client processes")
+    parser.add_argument("--connect-timeout", type=float, default=120)
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log output")
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    reports = []
+    for clients in [int(x) for x in args.clients.split(",")]:
+        for rate in [float(x) for x in args.rates.split(",")]:
+            report = asyncio.run(scenario(args, clients, rate))
+            reports.append(report)
+            print(json.dumps(report), flush=True)
+
+    columns = list(reports[0])
+    widths = {c: max(len(c), *(len(str(r[c])) for r in reports)) for c in columns}
+    print()
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for report in reports:
+        print("  ".join(str(report[c]).rjust(widths[c]) for c in columns))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "reports": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
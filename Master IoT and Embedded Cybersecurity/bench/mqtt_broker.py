@@ -0,0 +1,110 @@
+"""
+Minimal MQTT 3.1.1 broker stand-in for offline benchmarks.
+
+Supports just what the Pico apps use: CONNECT, SUBSCRIBE/UNSUBSCRIBE with
+'+' and '#' wildcards, PUBLISH at QoS 0/1 (delivered to subscribers at
+QoS 0), PINGREQ and DISCONNECT. No persistence, retained messages, auth
+or TLS. Run standalone with:
+
+    ./run.sh bench/mqtt_broker.py --port 1883
+"""
+
+import argparse
+import asyncio
+
+from mqtt_codec import (CONNECT, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, PINGREQ, DISCONNECT, SUBACK, UNSUBACK,
+                        CONNACK, PacketReader, packet, packet_type, parse_publish, parse_subscribe,
+                        parse_unsubscribe, puback_packet, publish_packet, topic_matches, PINGRESP_PACKET)
+
+READ_SIZE = 1 << 16
+
+
+# ======================================
+# BROKER
+# ======================================
+class Broker:
+    def __init__(self):
+        self.subscriptions = {}  # {writer: set of topic filters}
+        self.published = 0
+        self.delivered = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.subscriptions):
+            writer.close()
+        await self.server.wait_closed()
+
+    def route(self, topic, payload):
+        self.published += 1
+        frame = None
+        for writer, filters in self.subscriptions.items():
+            if any(topic_matches(f, topic) for f in filters):
+                frame = frame or publish_packet(topic, payload)
+                writer.write(frame)
+                self.delivered += 1
+
+    async def handle(self, reader, writer):
+        packets = PacketReader()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                for first, body in packets.feed(data):
+                    if not self.handle_packet(first, body, writer):
+                        return
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+    def handle_packet(self, first, body, writer):
+        """Handles one client packet; False once the client sent DISCONNECT."""
+        kind = packet_type(first)
+        if kind == CONNECT:
+            writer.write(packet(CONNACK << 4, b"\x00\x00"))
+        elif kind == PUBLISH:
+            topic, payload, qos, packet_id = parse_publish(first, body)
+            if qos:
+                writer.write(puback_packet(packet_id))
+            self.route(topic, payload)
+        elif kind == SUBSCRIBE:
+            packet_id, filters = parse_subscribe(body)
+            self.subscriptions.setdefault(writer, set()).update(f for f, _ in filters)
+            writer.write(packet(SUBACK << 4, packet_id.to_bytes(2, "big") + bytes(len(filters))))  # all granted QoS 0
+        elif kind == UNSUBSCRIBE:
+            packet_id, filters = parse_unsubscribe(body)
+            self.subscriptions.get(writer, set()).difference_update(filters)
+            writer.write(packet(UNSUBACK << 4, packet_id.to_bytes(2, "big")))
+        elif kind == PINGREQ:
+            writer.write(PINGRESP_PACKET)
+        elif kind == DISCONNECT:
+            return False
+        return True
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    broker = Broker()
+    port = await broker.start(args.host, args.port)
+    print(f"MQTT broker stand-in listening on {args.host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
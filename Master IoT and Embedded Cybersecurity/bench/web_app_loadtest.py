@@ -0,0 +1,306 @@
+"""
+Load test for the Dash web app in "IoT web app/app.py".
+
+Starts the app as a subprocess against the local MQTT broker stand-in
+(mqtt_broker.py), then for --duration seconds:
+  - N simulated Picos publish the same JSON payload as
+    relay_dht_mqtt_robust.py to pico/<id>/data at --rate messages/s each
+  - M headless viewers log in and call the dashboard's update callback
+    every --viewer-interval seconds, carrying their render-state along
+    like a browser does
+
+and reports ingest throughput, drop rate, callback latency (p50/p99) and
+the app's memory (RSS). Everything runs on localhost, no network needed.
+
+    ./run.sh bench/web_app_loadtest.py --publishers 50 --rate 5 --viewers 20 --duration 30
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+from mqtt_broker import Broker
+from mqtt_codec import connect_packet, publish_packet
+
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "IoT web app")
+
+
+# ======================================
+# HELPERS
+# ======================================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def login(conn):
+    """Logs in on an open connection and returns the session cookie."""
+    conn.request("POST", "/login", urllib.parse.urlencode({"username": "admin", "password": "password123"}),
+                 {"Content-Type": "application/x-www-form-urlencoded"})
+    response = conn.getresponse()
+    response.read()
+    return response.getheader("Set-Cookie", "").split(";")[0]
+
+
+def scrape_metrics(port):
+    """Sums of the app's Prometheus series, keyed by metric name and label string."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    totals = {}
+    for line in text.splitlines():
+        if line.startswith("#") or not line:
+            continue
+        match = re.match(r"([a-zA-Z_:]+)(\{[^}]*\})? (\S+)", line)
+        if match:
+            name, labels, value = match.groups()
+            totals[name] = totals.get(name, 0) + float(value)
+            totals[name + (labels or "")] = float(value)
+    return totals
+
+
+# ======================================
+# SIMULATED PICOS
+# ======================================
+async def publisher(port, device_id, rate, stop, counter):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(connect_packet(f"bench-{device_id}"))
+    await reader.readexactly(4)  # CONNACK
+
+    topic = f"pico/{device_id}/data"
+    relay = "OFF"
+    interval = 1 / rate
+    next_send = time.perf_counter() + random.random() * interval
+    while not stop.is_set():
+        # Same shape as relay_dht_mqtt_robust.py's payload
+        payload = json.dumps({"temperature": random.randint(18, 45), "humidity": random.randint(30, 90), "relay": relay})
+        writer.write(publish_packet(topic, payload.encode()))
+        counter[0] += 1
+        if random.random() < 0.01:
+            relay = "ON" if relay == "OFF" else "OFF"
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif counter[0] % 100 == 0:
+            await writer.drain()
+            await asyncio.sleep(0)
+    writer.close()
+
+
+# ======================================
+# HEADLESS VIEWERS
+# ======================================
+class Viewer(threading.Thread):
+    def __init__(self, port, dependency, device_id, interval, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.dependency = dependency
+        self.device_id = device_id
+        self.interval = interval
+        self.stop = stop
+        self.latencies = []
+        self.errors = 0
+
+    def request_body(self, n, state):
+        dep = self.dependency
+        outputs = [dict(zip(("id", "property"), o.split("."))) for o in dep["output"].strip(".").split("...")]
+        inputs = []
+        for item in dep["inputs"]:
+            value = self.device_id if item["id"] == "device-select" else n
+            inputs.append(dict(item, value=value))
+        states = [dict(item, value=state) for item in dep["state"]]
+        return json.dumps({
+            "output": dep["output"], "outputs": outputs, "inputs": inputs, "state": states,
+            "changedPropIds": [f"{inputs[0]['id']}.{inputs[0]['property']}"],
+        })
+
+    def run(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        headers = {"Content-Type": "application/json", "Cookie": login(conn)}
+
+        state, n = None, 0
+        while not self.stop.is_set():
+            n += 1
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/dashboard/_dash-update-component", self.request_body(n, state), headers)
+                response = conn.getresponse()
+                data = response.read()
+                self.latencies.append(time.perf_counter() - start)
+                if response.status == 200:
+                    state = json.loads(data)["response"].get("render-state", {}).get("data", state)
+                elif response.status != 204:
+                    self.errors += 1
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            self.stop.wait(self.interval)
+
+
+# ======================================
+# RUN
+# ======================================
+def wait_for_http(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"App exited early with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/login")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("App did not start listening in time")
+
+
+def dashboard_dependency(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    cookie = login(conn)
+    conn.request("GET", "/dashboard/_dash-dependencies", headers={"Cookie": cookie})
+    for dep in json.loads(conn.getresponse().read()):
+        if "render-state.data" in dep["output"]:
+            return dep
+    sys.exit("Dashboard update callback not found")
+
+
+async def run(args):
+    broker = Broker()
+    mqtt_port = await broker.start()
+    http_port = free_port()
+
+    tmpdir = tempfile.mkdtemp(prefix="loadtest-")
+    env = dict(os.environ, MQTT_BROKER="127.0.0.1", MQTT_PORT=str(mqtt_port), PORT=str(http_port),
+               STORAGE_ENGINE=args.storage, STORAGE_PATH=os.path.join(tmpdir, "bench.db"),
+               DASHBOARD_UPDATES="poll", METRICS_TOKEN="")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [COMMON_DIR, env.get("PYTHONPATH")]))
+    proc = subprocess.Popen([sys.executable, "app.py"], cwd=APP_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        await asyncio.to_thread(wait_for_http, http_port, proc)
+        while not broker.subscriptions:
+            await asyncio.sleep(0.1)
+        dependency = await asyncio.to_thread(dashboard_dependency, http_port)
+        before = await asyncio.to_thread(scrape_metrics, http_port)
+        rss_start = rss_mb(proc.pid)
+
+        stop_publishers = asyncio.Event()
+        stop_viewers = threading.Event()
+        published = [0]
+        device_ids = [f"bench{i:04d}" for i in range(args.publishers)]
+        viewers = [Viewer(http_port, dependency, random.choice(device_ids), args.viewer_interval, stop_viewers)
+                   for _ in range(args.viewers)]
+        for viewer in viewers:
+            viewer.start()
+        tasks = [asyncio.create_task(publisher(mqtt_port, d, args.rate, stop_publishers, published)) for d in device_ids]
+
+        started = time.perf_counter()
+        rss_peak = rss_start
+        while time.perf_counter() - started < args.duration:
+            await asyncio.sleep(1)
+            rss_peak = max(rss_peak, rss_mb(proc.pid))
+        stop_publishers.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        publish_time = time.perf_counter() - started
+
+        # Let the app drain its ingest queue before the final reading
+        for _ in range(50):
+            after = await asyncio.to_thread(scrape_metrics, http_port)
+            if not after.get('ingest_queue{stat="queue_depth"}'):
+                break
+            await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        stop_viewers.set()
+        for viewer in viewers:
+            viewer.join(timeout=10)
+
+        def delta(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        latencies = [x for v in viewers for x in v.latencies]
+        received = delta("mqtt_messages_received_total")
+        report = {
+            "publishers": args.publishers,
+            "rate_per_publisher": args.rate,
+            "viewers": args.viewers,
+            "duration_s": round(elapsed, 2),
+            "published": published[0],
+            "publish_rate": round(published[0] / publish_time, 1),
+            "received": int(received),
+            "parsed": int(delta("mqtt_messages_parsed_total")),
+            "dropped": int(delta("mqtt_messages_dropped_total")),
+            "ingest_throughput": round(delta("mqtt_messages_parsed_total") / elapsed, 1),
+            "drop_rate": round(delta("mqtt_messages_dropped_total") / received, 4) if received else 0.0,
+            "callback_requests": len(latencies),
+            "callback_errors": sum(v.errors for v in viewers),
+            "callback_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "callback_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "rss_start_mb": round(rss_start, 1),
+            "rss_peak_mb": round(rss_peak, 1),
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        await broker.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--publishers", type=int, default=10, help="simulated Picos")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per Pico")
+    parser.add_argument("--viewers", type=int, default=10, help="headless dashboard clients")
+    parser.add_argument("--viewer-interval", type=float, default=2.0, help="seconds between a viewer's callbacks")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to publish for")
+    parser.add_argument("--storage", default="sqlite", choices=["sqlite", "memory"])
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log output")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key:<{width}}  {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
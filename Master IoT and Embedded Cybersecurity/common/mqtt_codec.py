@@ -0,0 +1,196 @@
+"""
+Minimal MQTT 3.1.1 packet codec shared by the apps and the benchmarks.
+
+It does no I/O: packets are built as bytes and received bytes are split
+into packets, so the asyncio engine (IoT web app/async_ingest.py), the
+eventlet client (IoT Dashboard/green_mqtt.py) and the broker stand-in
+(bench/mqtt_broker.py) each only deal with their own sockets. It covers
+what those need: CONNECT/CONNACK, SUBSCRIBE/SUBACK, UNSUBSCRIBE/UNSUBACK,
+PUBLISH at QoS 0 and 1 with PUBACK, PINGREQ/PINGRESP and DISCONNECT.
+
+QoS 2 is not implemented: subscriptions are capped at QoS 1, so a broker
+never has a reason to send it, and a QoS 2 PUBLISH is rejected with
+ProtocolError rather than acknowledged with a PUBACK it does not expect.
+The caller drops the connection.
+
+It is found through PYTHONPATH, which run.sh sets, since the apps are run
+from their own directories rather than installed:
+
+    ./run.sh "IoT web app/app.py"
+"""
+
+import struct
+
+# Control packet types (the high nibble of the first byte)
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+MAX_LENGTH = 268435455  # largest remaining length four bytes can encode
+MAX_QOS = 1  # no PUBREC/PUBREL/PUBCOMP handshake
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+# ======================================
+# ENCODING
+# ======================================
+def encode_length(n):
+    if not 0 <= n <= MAX_LENGTH:
+        raise ProtocolError(f"remaining length {n} out of range")
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def encode_string(s):
+    data = s.encode() if isinstance(s, str) else s
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(first_byte, body=b""):
+    return bytes([first_byte]) + encode_length(len(body)) + body
+
+
+def connect_packet(client_id, keepalive=60):
+    """CONNECT with a clean session."""
+    body = encode_string("MQTT") + bytes([4, 0x02]) + struct.pack("!H", keepalive) + encode_string(client_id)
+    return packet(CONNECT << 4, body)
+
+
+def subscribe_packet(topic_filters, packet_id=1, qos=0):
+    """SUBSCRIBE to one filter or a list of them, all at `qos`."""
+    if not 0 <= qos <= MAX_QOS:
+        raise ProtocolError(f"subscribing at QoS {qos} is not supported")
+    if isinstance(topic_filters, (str, bytes)):
+        topic_filters = [topic_filters]
+    body = b"".join(encode_string(f) + bytes([qos]) for f in topic_filters)
+    return packet(SUBSCRIBE << 4 | 0x02, struct.pack("!H", packet_id) + body)
+
+
+def publish_packet(topic, payload, qos=0, packet_id=1):
+    if not 0 <= qos <= MAX_QOS:
+        raise ProtocolError(f"publishing at QoS {qos} is not supported")
+    body = encode_string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return packet(PUBLISH << 4 | qos << 1, body + payload)
+
+
+def puback_packet(packet_id):
+    return packet(PUBACK << 4, struct.pack("!H", packet_id))
+
+
+PINGREQ_PACKET = packet(PINGREQ << 4)
+PINGRESP_PACKET = packet(PINGRESP << 4)
+DISCONNECT_PACKET = packet(DISCONNECT << 4)
+
+
+# ======================================
+# DECODING
+# ======================================
+def decode_length(buffer, pos):
+    """(remaining length, offset of the body) of the packet starting at `pos`; None until its header is complete."""
+    length, multiplier = 0, 1
+    for i in range(pos + 1, min(pos + 5, len(buffer))):
+        byte = buffer[i]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return length, i + 1
+        multiplier *= 128
+    if len(buffer) >= pos + 5:
+        raise ProtocolError("remaining length longer than four bytes")
+    return None
+
+
+class PacketReader:
+    """
+    Splits a byte stream into packets. feed() takes whatever the socket returned,
+    however it is cut, and returns every (first byte, body) completed by it.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        packets, pos = [], 0
+        while True:
+            header = decode_length(buffer, pos)
+            if header is None:
+                break
+            length, start = header
+            if start + length > len(buffer):
+                break
+            packets.append((buffer[pos], bytes(buffer[start:start + length])))
+            pos = start + length
+        del buffer[:pos]
+        return packets
+
+
+def packet_type(first_byte):
+    return first_byte >> 4
+
+
+def parse_publish(first_byte, body):
+    """(topic, payload, qos, packet id or None) of a PUBLISH at QoS 0 or 1."""
+    qos = (first_byte >> 1) & 3
+    if qos > MAX_QOS:
+        raise ProtocolError(f"PUBLISH at QoS {qos} is not supported" if qos == 2 else "PUBLISH with QoS 3")
+    if len(body) < 2:
+        raise ProtocolError("PUBLISH too short")
+    topic_len = struct.unpack_from("!H", body)[0]
+    offset = 2 + topic_len
+    if len(body) < offset:
+        raise ProtocolError("PUBLISH topic runs past the packet")
+    packet_id = None
+    if qos:
+        if len(body) < offset + 2:
+            raise ProtocolError("PUBLISH too short")
+        packet_id = struct.unpack_from("!H", body, offset)[0]
+        offset += 2
+    return body[2:2 + topic_len].decode(), body[offset:], qos, packet_id
+
+
+def connack_code(first_byte, body):
+    """The CONNACK return code, 0 when accepted; -1 if the packet is not a CONNACK."""
+    if packet_type(first_byte) != CONNACK or len(body) < 2:
+        return -1
+    return body[1]
+
+
+def parse_subscribe(body):
+    """(packet id, [(topic filter, requested qos)]) of a SUBSCRIBE."""
+    packet_id, offset, filters = struct.unpack_from("!H", body)[0], 2, []
+    while offset < len(body):
+        n = struct.unpack_from("!H", body, offset)[0]
+        filters.append((body[offset + 2:offset + 2 + n].decode(), body[offset + 2 + n]))
+        offset += 3 + n
+    return packet_id, filters
+
+
+def topic_matches(topic_filter, topic):
+    """Whether `topic` matches a subscription filter, with '+' and '#' wildcards."""
+    f_parts, t_parts = topic_filter.split("/"), topic.split("/")
+    for i, part in enumerate(f_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+def parse_unsubscribe(body):
+    """(packet id, [topic filter]) of an UNSUBSCRIBE."""
+    packet_id, offset, filters = struct.unpack_from("!H", body)[0], 2, []
+    while offset < len(body):
+        n = struct.unpack_from("!H", body, offset)[0]
+        filters.append(body[offset + 2:offset + 2 + n].decode())
+        offset += 2 + n
+    return packet_id, filters
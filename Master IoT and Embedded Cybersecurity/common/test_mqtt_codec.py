@@ -0,0 +1,134 @@
+"""Unit tests for the shared MQTT codec: run with `python -m pytest` from this directory."""
+
+import pytest
+
+from mqtt_codec import (PUBLISH, PUBACK, SUBSCRIBE, MAX_LENGTH, PacketReader, ProtocolError, connack_code,
+                        decode_length, encode_length, packet, packet_type, parse_publish, parse_subscribe,
+                        puback_packet, publish_packet, subscribe_packet, topic_matches)
+
+
+# ======================================
+# REMAINING LENGTH
+# ======================================
+@pytest.mark.parametrize("length, size", [
+    (0, 1), (127, 1),
+    (128, 2), (16383, 2),
+    (16384, 3), (2097151, 3),
+    (2097152, 4), (MAX_LENGTH, 4),
+])
+def test_remaining_length_boundaries(length, size):
+    encoded = encode_length(length)
+    assert len(encoded) == size
+    assert decode_length(b"\x30" + encoded, 0) == (length, 1 + size)
+
+
+@pytest.mark.parametrize("length", [-1, MAX_LENGTH + 1])
+def test_remaining_length_out_of_range(length):
+    with pytest.raises(ProtocolError):
+        encode_length(length)
+
+
+def test_remaining_length_longer_than_four_bytes():
+    with pytest.raises(ProtocolError):
+        decode_length(b"\x30\xff\xff\xff\xff\x01", 0)
+
+
+def test_incomplete_remaining_length():
+    assert decode_length(b"\x30", 0) is None
+    assert decode_length(b"\x30\xff\xff", 0) is None
+
+
+# ======================================
+# PACKET READER
+# ======================================
+def test_reader_byte_by_byte():
+    stream = publish_packet("pico/a/data", b"x" * 200) + publish_packet("pico/b/data", b"{}", qos=1, packet_id=7)
+    reader, packets = PacketReader(), []
+    for i in range(len(stream)):
+        packets += reader.feed(stream[i:i + 1])
+    assert [parse_publish(*p) for p in packets] == [
+        ("pico/a/data", b"x" * 200, 0, None),
+        ("pico/b/data", b"{}", 1, 7),
+    ]
+    assert not reader.buffer
+
+
+def test_reader_split_across_reads():
+    first, second = publish_packet("t", b"1"), publish_packet("t", b"2")
+    stream = first + second
+    reader = PacketReader()
+    assert len(reader.feed(stream[:len(first) + 1])) == 1
+    assert reader.feed(b"") == []
+    assert [parse_publish(*p)[1] for p in reader.feed(stream[len(first) + 1:])] == [b"2"]
+
+
+def test_reader_empty_body():
+    assert PacketReader().feed(packet(0xD0) + packet(0xE0)) == [(0xD0, b""), (0xE0, b"")]
+
+
+def test_reader_rejects_over_long_length():
+    with pytest.raises(ProtocolError):
+        PacketReader().feed(b"\x30\x80\x80\x80\x80\x01")
+
+
+# ======================================
+# QOS
+# ======================================
+@pytest.mark.parametrize("qos", [0, 1])
+def test_publish_round_trip(qos):
+    first, body = PacketReader().feed(publish_packet("pico/x/control", b"ON", qos=qos, packet_id=513))[0]
+    assert packet_type(first) == PUBLISH
+    assert parse_publish(first, body) == ("pico/x/control", b"ON", qos, 513 if qos else None)
+
+
+@pytest.mark.parametrize("qos", [2, 3])
+def test_publish_above_qos_1_rejected(qos):
+    body = b"\x00\x01t\x00\x05payload"
+    with pytest.raises(ProtocolError):
+        parse_publish(PUBLISH << 4 | qos << 1, body)
+    with pytest.raises(ProtocolError):
+        publish_packet("t", b"", qos=qos)
+
+
+def test_subscribe_capped_at_qos_1():
+    with pytest.raises(ProtocolError):
+        subscribe_packet("pico/+/data", qos=2)
+    first, body = PacketReader().feed(subscribe_packet(["pico/data", "pico/+/data"], packet_id=3, qos=1))[0]
+    assert packet_type(first) == SUBSCRIBE and first & 0x0F == 0x02
+    assert parse_subscribe(body) == (3, [("pico/data", 1), ("pico/+/data", 1)])
+
+
+def test_truncated_publish_rejected():
+    with pytest.raises(ProtocolError):
+        parse_publish(PUBLISH << 4, b"\x00")
+    with pytest.raises(ProtocolError):
+        parse_publish(PUBLISH << 4, b"\x00\x09abc")
+    with pytest.raises(ProtocolError):
+        parse_publish(PUBLISH << 4 | 0x02, b"\x00\x01t\x00")  # packet id cut short
+
+
+def test_puback_carries_packet_id():
+    first, body = PacketReader().feed(puback_packet(0xBEEF))[0]
+    assert packet_type(first) == PUBACK
+    assert body == b"\xbe\xef"
+
+
+def test_connack_code():
+    assert connack_code(0x20, b"\x00\x00") == 0
+    assert connack_code(0x20, b"\x00\x05") == 5
+    assert connack_code(0x90, b"\x00\x01\x00") == -1
+
+
+# ======================================
+# TOPIC FILTERS
+# ======================================
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("pico/+/data", "pico/d1/data", True),
+    ("pico/+/data", "pico/data", False),
+    ("pico/+/data", "pico/a/b/data", False),
+    ("pico/data", "pico/data", True),
+    ("pico/#", "pico/d1/data", True),
+    ("pico/+", "pico/d1/data", False),
+])
+def test_topic_matches(topic_filter, topic, matches):
+    assert topic_matches(topic_filter, topic) is matches
@@ -14,10 +14,17 @@ import network
 import time
 import machine
 import ubinascii
+import usocket
+import uerrno
+import ustruct
 import dht
 import ujson
 import ssd1306
-from umqtt.robust import MQTTClient
+import uasyncio as asyncio
+# umqtt.simple: reconnecting is the supervisor task's job. umqtt.robust retries
+# inside publish()/check_msg() with time.sleep, which would stall every task.
+# Its connect() blocks too, so the connection itself is opened by mqtt_connect().
+from umqtt.simple import MQTTClient
 
 # =====================================
 # CONFIGURATION
@@ -27,11 +34,19 @@ WIFI_PASSWORD = "xxxxxxxx"		 # add your password
 
 MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
+MQTT_KEEPALIVE = 60  # seconds
 
 MQTT_SUBSCRIPTION = b"pico/control"  # topic to subscribe to
 MQTT_PUBLISH = b"pico/data"			 # topic to publish 
 
 PUBLISH_INTERVAL = 5000  # milliseconds
+SENSOR_INTERVAL = 2000   # milliseconds (the DHT11 needs at least 1 s between readings)
+DISPLAY_REFRESH = 1000   # milliseconds between OLED redraws when nothing changed (RSSI)
+WIFI_TIMEOUT = 15000     # milliseconds to wait for WiFi before trying again
+RETRY_MIN = 1000         # milliseconds before the first reconnect attempt
+RETRY_MAX = 30000        # reconnect backoff ceiling
+CONNECT_TIMEOUT = 10000  # milliseconds for the TCP handshake and CONNACK
+CONNECT_POLL = 50        # milliseconds between checks while connecting
 
 # =====================================
 # OLED SETUP (SSD1306 128x64 I2C)
@@ -55,6 +70,25 @@ sensor = dht.DHT11(machine.Pin(2))
 wlan = network.WLAN(network.STA_IF)
 wlan.active(True)
 
+# =====================================
+# SHARED STATE
+# Every task runs on one uasyncio loop, so plain
+# globals are safe; events wake the task that
+# has work to do instead of polling for it.
+# =====================================
+temperature = None
+humidity = None
+net_status = "Starting"     # shown on the OLED while not connected
+
+mqtt_connected = False
+mqtt_up = asyncio.Event()     # set while the MQTT session is usable
+mqtt_lost = asyncio.Event()   # set by any task whose MQTT call failed
+
+commands = []                 # relay commands received, oldest first
+command_ready = asyncio.Event()
+display_dirty = asyncio.Event()
+publish_now = asyncio.Event() # publish before the interval is up (relay changed)
+
 # =====================================
 # OLED FUNCTIONS
 # =====================================
@@ -92,7 +126,9 @@ def draw_wifi_bars(rssi):
             oled.rect(x + i*6, y + 12 - height, 4, height, 1)
 
 
-def oled_dashboard(temp=None, hum=None):
+def oled_dashboard():
+
+    temp, hum = temperature, humidity
 
     oled.fill(0)
 
@@ -107,7 +143,9 @@ def oled_dashboard(temp=None, hum=None):
         oled.text("Hum : {}%".format(hum), 0, 38)
 
     # WiFi signal
-    if wlan.isconnected():
+    if not mqtt_connected:
+        oled.text(net_status, 0, 52)
+    elif wlan.isconnected():
         try:
             rssi = wlan.status('rssi')
             oled.text("{} dBm".format(rssi), 0, 52)
@@ -121,180 +159,377 @@ def oled_dashboard(temp=None, hum=None):
 
 
 # =====================================
-# WIFI CONNECT FUNCTION
+# MQTT CALLBACK
+# Runs inside receive_task: it only queues the
+# command, command_task acts on it right away.
 # =====================================
-def wifi_connect():
+def mqtt_callback(topic, msg):
 
-    if wlan.isconnected():
-        return
+    message = msg.decode().strip().upper()
 
-    oled.fill(0)
-    oled.text("Connecting WiFi", 0, 20)
-    oled.show()
+    print("MQTT Message:", message)
 
-    print("Connecting to WiFi...")
+    commands.append(message)
+    command_ready.set()
 
-    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
 
-    while not wlan.isconnected():
-        time.sleep(1)
+# =====================================
+# MQTT SETUP
+# =====================================
+client_id = ubinascii.hexlify(machine.unique_id())
+
+client = MQTTClient(
+    client_id,
+    MQTT_BROKER,
+    port=MQTT_PORT,
+    keepalive=MQTT_KEEPALIVE
+)
 
-    ip = wlan.ifconfig()[0]
+client.set_callback(mqtt_callback)
 
-    print("WiFi Connected:", ip)
 
-    oled.fill(0)
-    oled.text("WiFi Connected", 0, 20)
-    oled.text(ip, 0, 35)
-    oled.show()
+def set_status(text):
 
-    time.sleep(2)
+    global net_status
+
+    print(text)
+
+    net_status = text
+    display_dirty.set()
+
+
+def connection_lost(e):
+
+    print("MQTT error:", e)
+
+    mqtt_lost.set()
 
 
 # =====================================
-# MQTT CALLBACK
+# CONNECTIVITY SUPERVISOR TASK
+# Brings WiFi and MQTT up, watches them, and
+# reconnects with backoff. Waiting is always
+# done with await, so the other tasks keep
+# running while the network is down.
 # =====================================
-def mqtt_callback(topic, msg):
+async def wifi_connect():
 
-    global relay_state
+    if wlan.isconnected():
+        return True
 
-    message = msg.decode().strip().upper()
+    set_status("WiFi...")
 
-    print("MQTT Message:", message)
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
 
-    if message == "ON":
+    start = time.ticks_ms()
 
-        relay.value(0)
-        relay_state = "ON"
+    while not wlan.isconnected():
 
-    elif message == "OFF":
+        if time.ticks_diff(time.ticks_ms(), start) > WIFI_TIMEOUT:
+            set_status("WiFi failed")
+            return False
 
-        relay.value(1)
-        relay_state = "OFF"
+        await asyncio.sleep_ms(250)
 
-    oled_dashboard()
+    print("WiFi Connected:", wlan.ifconfig()[0])
 
+    return True
 
-# =====================================
-# MQTT SETUP
-# =====================================
-client_id = ubinascii.hexlify(machine.unique_id())
 
-client = MQTTClient(
-    client_id,
-    MQTT_BROKER,
-    port=MQTT_PORT,
-    keepalive=60
-)
+# Errors a non-blocking socket raises while the handshake is still going
+BUSY_ERRORS = (uerrno.EINPROGRESS, uerrno.EAGAIN, uerrno.EALREADY, uerrno.ENOTCONN)
 
-client.set_callback(mqtt_callback)
 
+def connect_packet():
+
+    # CONNECT with a clean session, as umqtt.simple sends it
+    body = b"\x00\x04MQTT\x04\x02" + ustruct.pack("!HH", MQTT_KEEPALIVE, len(client_id)) + client_id
+
+    return bytes([0x10, len(body)]) + body  # a hex client id keeps this under 128 bytes
+
+
+async def sock_write(sock, data, deadline):
+
+    while data:
+
+        try:
+            n = sock.write(data)
+        except OSError as e:
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+            n = None
+
+        if n:
+            data = data[n:]
+        elif time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+            raise OSError(uerrno.ETIMEDOUT)
+        else:
+            await asyncio.sleep_ms(CONNECT_POLL)
+
+
+async def mqtt_connect():
+
+    # Opens the socket without blocking (the way mqtt_as does),
+    # so an unreachable broker only delays this task: relay
+    # commands, readings and the OLED keep going. Only the DNS
+    # lookup still blocks, and it is cached by the network stack.
+    set_status("MQTT...")
+
+    deadline = time.ticks_add(time.ticks_ms(), CONNECT_TIMEOUT)
+
+    addr = usocket.getaddrinfo(MQTT_BROKER, MQTT_PORT)[0][-1]
+
+    sock = usocket.socket()
+    sock.setblocking(False)
+
+    try:
+
+        try:
+            sock.connect(addr)
+        except OSError as e:
+            if e.args[0] not in BUSY_ERRORS:
+                raise
+
+        await sock_write(sock, connect_packet(), deadline)
+
+        connack = await asyncio.wait_for_ms(asyncio.StreamReader(sock).readexactly(4),
+                                            max(0, time.ticks_diff(deadline, time.ticks_ms())))
+
+        if connack[0] != 0x20 or connack[3] != 0:
+            raise OSError("MQTT refused, code {}".format(connack[3]))
+
+    except BaseException:
+        sock.close()
+        raise
 
-def mqtt_connect():
+    # From here umqtt.simple drives the connected socket
+    sock.setblocking(True)
+    client.sock = sock
+
+    client.subscribe(MQTT_SUBSCRIPTION)
+
+    print("MQTT Connected")
+
+
+def mqtt_close():
+
+    global mqtt_connected
+
+    mqtt_connected = False
+    mqtt_up.clear()
+
+    try:
+        client.sock.close()  # also wakes receive_task if it waits on this socket
+    except Exception:
+        pass
+
+    display_dirty.set()
+
+
+async def supervisor_task():
+
+    global mqtt_connected
+
+    retry = RETRY_MIN
 
     while True:
 
         try:
 
-            oled.fill(0)
-            oled.text("Connecting MQTT", 0, 20)
-            oled.show()
+            if await wifi_connect():
 
-            print("Connecting to MQTT...")
+                await mqtt_connect()
 
-            client.connect()
+                mqtt_lost.clear()
+                mqtt_connected = True
+                mqtt_up.set()
+                display_dirty.set()
 
-            client.subscribe(MQTT_SUBSCRIPTION)
+                retry = RETRY_MIN
+                last_ping = time.ticks_ms()
 
-            print("MQTT Connected")
+                # Connected: check the link every second, ping at half the keepalive
+                while not mqtt_lost.is_set():
 
-            oled.fill(0)
-            oled.text("MQTT Connected", 0, 25)
-            oled.show()
+                    if not wlan.isconnected():
+                        print("WiFi lost. Reconnecting...")
+                        break
 
-            time.sleep(2)
+                    if time.ticks_diff(time.ticks_ms(), last_ping) > MQTT_KEEPALIVE * 500:
+                        client.ping()
+                        last_ping = time.ticks_ms()
 
-            break
+                    try:
+                        await asyncio.wait_for_ms(mqtt_lost.wait(), 1000)
+                    except asyncio.TimeoutError:
+                        pass
 
         except Exception as e:
 
             print("MQTT failed:", e)
 
-            time.sleep(5)
+        mqtt_close()
+        set_status("Retry {}s".format(retry // 1000))
+
+        await asyncio.sleep_ms(retry)
+
+        retry = min(retry * 2, RETRY_MAX)
 
 
 # =====================================
-# SENSOR PUBLISH FUNCTION
+# MQTT RECEIVE TASK
+# Sleeps until the socket is readable instead
+# of polling check_msg() on a timer.
 # =====================================
-def publish_sensor_data():
+async def receive_task():
 
-    try:
+    while True:
 
-        sensor.measure()
+        await mqtt_up.wait()
 
-        temp = sensor.temperature()
-        hum = sensor.humidity()
+        try:
 
-        payload = ujson.dumps({
+            # read(0) returns once data (or a close) is waiting, without consuming it
+            await asyncio.StreamReader(client.sock).read(0)
 
-            "temperature": temp,
-            "humidity": hum,
-            "relay": relay_state
+            if mqtt_up.is_set():
+                client.check_msg()
 
-        })
+        except Exception as e:
+
+            if mqtt_up.is_set():
+                connection_lost(e)
+
+            await asyncio.sleep_ms(0)
 
-        client.publish(MQTT_PUBLISH, payload)
 
-        print("Published:", payload)
+# =====================================
+# COMMAND TASK
+# =====================================
+async def command_task():
 
-        oled_dashboard(temp, hum)
+    global relay_state
+
+    while True:
 
-    except Exception as e:
+        await command_ready.wait()
+        command_ready.clear()
 
-        print("Sensor error:", e)
+        while commands:
+
+            message = commands.pop(0)
+
+            if message == "ON":
+
+                relay.value(0)
+                relay_state = "ON"
+
+            elif message == "OFF":
+
+                relay.value(1)
+                relay_state = "OFF"
+
+        display_dirty.set()
+
+        # Confirms the new state to the dashboard now, not at the next interval
+        publish_now.set()
 
 
 # =====================================
-# MAIN PROGRAM
+# SENSOR TASK
 # =====================================
-oled_show_startup()
+async def sensor_task():
 
-time.sleep(2)
+    global temperature, humidity
 
-wifi_connect()
+    while True:
 
-mqtt_connect()
+        try:
 
-last_publish = time.ticks_ms()
+            sensor.measure()
 
-while True:
+            temperature = sensor.temperature()
+            humidity = sensor.humidity()
 
-    # Reconnect WiFi if lost
-    if not wlan.isconnected():
+            display_dirty.set()
 
-        print("WiFi lost. Reconnecting...")
+        except Exception as e:
 
-        wifi_connect()
+            print("Sensor error:", e)
 
-        mqtt_connect()
+        await asyncio.sleep_ms(SENSOR_INTERVAL)
 
-    # Check MQTT messages
-    try:
 
-        client.check_msg()
+# =====================================
+# PUBLISH TASK
+# =====================================
+async def publish_task():
+
+    while True:
+
+        try:
+            await asyncio.wait_for_ms(publish_now.wait(), PUBLISH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+        publish_now.clear()
+
+        # Readings taken while offline are not queued: the next one after reconnecting is published
+        if not mqtt_up.is_set() or temperature is None:
+            continue
+
+        payload = ujson.dumps({
+
+            "temperature": temperature,
+            "humidity": humidity,
+            "relay": relay_state
+
+        })
+
+        try:
 
-    except Exception as e:
+            client.publish(MQTT_PUBLISH, payload)
 
-        print("MQTT error:", e)
+            print("Published:", payload)
+
+        except Exception as e:
+
+            connection_lost(e)
+
+
+# =====================================
+# DISPLAY TASK
+# =====================================
+async def display_task():
+
+    while True:
+
+        try:
+            await asyncio.wait_for_ms(display_dirty.wait(), DISPLAY_REFRESH)
+        except asyncio.TimeoutError:
+            pass
+
+        display_dirty.clear()
+
+        oled_dashboard()
+
+
+# =====================================
+# MAIN PROGRAM
+# =====================================
+async def main():
 
-        mqtt_connect()
+    oled_show_startup()
 
-    # Publish periodically
-    if time.ticks_diff(time.ticks_ms(), last_publish) > PUBLISH_INTERVAL:
+    await asyncio.sleep_ms(2000)
 
-        publish_sensor_data()
+    asyncio.create_task(display_task())
+    asyncio.create_task(command_task())
+    asyncio.create_task(sensor_task())
+    asyncio.create_task(publish_task())
+    asyncio.create_task(receive_task())
 
-        last_publish = time.ticks_ms()
+    await supervisor_task()
 
-    time.sleep(0.1)
 
+asyncio.run(main())
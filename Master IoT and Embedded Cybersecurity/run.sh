@@ -0,0 +1,12 @@
+#!/bin/sh
+# Runs one of the apps, tools or benchmarks from its own directory, with the
+# shared modules in common/ (the MQTT codec) on PYTHONPATH:
+#
+#   ./run.sh "IoT web app/app.py"
+#   ./run.sh "IoT web app/capture.py" replay capture.bin --speed 0
+#   ./run.sh bench/web_app_loadtest.py --publishers 50 --rate 5
+here=$(cd "$(dirname "$0")" && pwd)
+script=$1
+shift
+cd "$here/$(dirname "$script")" || exit 1
+PYTHONPATH="$here/common${PYTHONPATH:+:$PYTHONPATH}" exec "${PYTHON:-python}" "$(basename "$script")" "$@"